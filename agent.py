@@ -0,0 +1,174 @@
+import json
+import os
+import socket
+import struct
+import time
+
+from storage import load_vault, vault_version, VAULT_FILE
+from vault import LOCK_TIMEOUT
+
+AGENT_SOCKET = os.environ.get("VAULT_AGENT_SOCK", ".vault-agent.sock")
+
+# ---------------------
+# Agent Server
+# ---------------------
+
+class VaultAgent:
+    """
+    Holds a derived vault key and the decrypted vault in memory and answers
+    requests from `cli.py` over a Unix socket (one JSON line in, one out).
+
+    The decrypted data is reloaded whenever the vault file changes on disk,
+    so writes made by other commands are picked up on the next request.
+    """
+
+    def __init__(self, key: bytes, vault_file: str = VAULT_FILE, idle_timeout: float = LOCK_TIMEOUT):
+        self.key = key
+        self.vault_file = vault_file
+        self.idle_timeout = idle_timeout
+        self.last_used = time.monotonic()
+        self.running = False
+        self._data = {}
+        self._stamp = None
+
+    def data(self) -> dict:
+        # The version covers a SQLite vault's write-ahead log, where its commits land first
+        stamp = vault_version(self.vault_file)
+        if stamp is None:
+            self._data, self._stamp = {}, None
+            return self._data
+        if stamp != self._stamp:
+            self._data = load_vault(self.key, self.vault_file)
+            self._stamp = stamp
+        return self._data
+
+    def handle(self, request: dict) -> dict:
+        self.last_used = time.monotonic()
+        op = request.get("op")
+
+        if op == "status":
+            return {"ok": True, "pid": os.getpid(), "entries": len(self.data()),
+                    "idle_timeout": self.idle_timeout}
+        if op == "stop":
+            self.running = False
+            return {"ok": True}
+        if op == "key":
+            return {"ok": True, "key": self.key.decode()}
+        if op == "get":
+            creds = self.data().get(request.get("site"))
+            return {"ok": True, "creds": creds}
+        if op == "dump":
+            return {"ok": True, "data": self.data()}
+        return {"ok": False, "error": f"Unknown op: {op}"}
+
+    def serve(self, path: str = AGENT_SOCKET):
+        if os.path.exists(path):
+            os.remove(path)
+        old_umask = os.umask(0o177)  # socket is created rw------- for the owner only
+        try:
+            server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            server.bind(path)
+        finally:
+            os.umask(old_umask)
+        server.listen(8)
+        server.settimeout(1.0)
+        self.running = True
+        try:
+            while self.running:
+                if time.monotonic() - self.last_used > self.idle_timeout:
+                    break
+                try:
+                    conn, _ = server.accept()
+                except socket.timeout:
+                    continue
+                with conn:
+                    self._serve_connection(conn)
+        finally:
+            server.close()
+            self.key = None
+            self._data = {}
+            if os.path.exists(path):
+                os.remove(path)
+
+    def _serve_connection(self, conn):
+        if not _same_user(conn):
+            return
+        conn.settimeout(5.0)
+        try:
+            request = json.loads(_read_line(conn))
+            reply = self.handle(request)
+        except Exception as e:
+            reply = {"ok": False, "error": str(e)}
+        conn.sendall(json.dumps(reply).encode() + b"\n")
+
+
+def _same_user(conn) -> bool:
+    """Rejects peers running as another user, where the platform can tell."""
+    if not hasattr(socket, "SO_PEERCRED"):
+        return True
+    creds = conn.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i"))
+    _, uid, _ = struct.unpack("3i", creds)
+    return uid == os.getuid()
+
+
+def _read_line(conn) -> bytes:
+    chunks = []
+    while True:
+        chunk = conn.recv(65536)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        if chunk.endswith(b"\n"):
+            break
+    return b"".join(chunks)
+
+# ---------------------
+# Agent Client
+# ---------------------
+
+def request(op: str, path: str = AGENT_SOCKET, **params):
+    """
+    Sends one request to the running agent.
+
+    Returns the reply dict, or None if no agent is listening on `path`.
+    """
+    if not hasattr(socket, "AF_UNIX") or not os.path.exists(path):
+        return None
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as conn:
+            conn.settimeout(5.0)
+            conn.connect(path)
+            conn.sendall(json.dumps({"op": op, **params}).encode() + b"\n")
+            reply = _read_line(conn)
+    except (ConnectionRefusedError, FileNotFoundError):
+        return None
+    if not reply:
+        return None
+    return json.loads(reply)
+
+
+def start(key: bytes, path: str = AGENT_SOCKET, idle_timeout: float = LOCK_TIMEOUT) -> int:
+    """
+    Forks a background agent holding `key` and waits until it is accepting
+    connections. Returns the agent's pid.
+    """
+    if not hasattr(os, "fork"):
+        raise RuntimeError("The vault agent requires a POSIX system.")
+
+    pid = os.fork()
+    if pid == 0:
+        try:
+            os.setsid()
+            devnull = os.open(os.devnull, os.O_RDWR)
+            for fd in (0, 1, 2):
+                os.dup2(devnull, fd)
+            VaultAgent(key, idle_timeout=idle_timeout).serve(path)
+        finally:
+            os._exit(0)
+
+    deadline = time.monotonic() + 5
+    while time.monotonic() < deadline:
+        if request("status", path=path):
+            return pid
+        time.sleep(0.05)
+    raise RuntimeError("Vault agent did not start.")
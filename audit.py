@@ -1,34 +1,773 @@
-from datetime import datetime
+from collections import deque
+from datetime import datetime, timezone
+import atexit
+import base64
+import fcntl
+import gzip
+import hmac
+import json
 import os
+import queue
+import re
+import shutil
+import threading
+import time
 
+# Events are JSON lines appended to AUDIT_LOG_FILE, the active segment. Once it
+# grows past AUDIT_SEGMENT_BYTES, or its first event is older than
+# AUDIT_SEGMENT_SECONDS, it is sealed as "<file>.<seq>.gz" with a
+# "<file>.<seq>.idx" sidecar (time range and per-action counts) that lets
+# queries skip it without decompressing it.
+#
+# Entries are hash-chained: each carries its position `n` in the chain and a
+# `mac`, an HMAC keyed from the vault key over the previous entry's mac and its
+# own content. A process that hasn't unlocked the vault can't key a link, so
+# its events wait unchained in "<file>.pending" until the next process holding
+# the key appends to the log and chains them first. Every
+# AUDIT_CHECKPOINT_EVERY entries a signed checkpoint is appended to
+# "<file>.checkpoints", so verification can start from the latest one.
 AUDIT_LOG_FILE = "vault_audit.log"
+GENESIS_MAC = "0" * 64
 
-def log_action(action: str, site: str = None, status: str = "SUCCESS", note: str = ""):
+# Writer tuning, overridable from the environment
+AUDIT_QUEUE_SIZE = int(os.environ.get("AUDIT_QUEUE_SIZE", "10000"))
+AUDIT_BATCH_SIZE = int(os.environ.get("AUDIT_BATCH_SIZE", "256"))
+AUDIT_FLUSH_INTERVAL = float(os.environ.get("AUDIT_FLUSH_INTERVAL", "1.0"))
+AUDIT_FSYNC = os.environ.get("AUDIT_FSYNC", "never")
+AUDIT_BACKPRESSURE = os.environ.get("AUDIT_BACKPRESSURE", "block")
+AUDIT_SEGMENT_BYTES = int(os.environ.get("AUDIT_SEGMENT_BYTES", str(1024 * 1024)))
+AUDIT_SEGMENT_SECONDS = int(os.environ.get("AUDIT_SEGMENT_SECONDS", str(24 * 3600)))
+AUDIT_CHECKPOINT_EVERY = int(os.environ.get("AUDIT_CHECKPOINT_EVERY", "1000"))
+
+FSYNC_POLICIES = ["never", "batch"]
+BACKPRESSURE_POLICIES = ["block", "drop"]
+
+# ---------------------
+# Segments
+# ---------------------
+
+_SEGMENT_NAME = re.compile(r"\.(\d{6})(\.gz)?$")
+_LEGACY_LINE = re.compile(
+    r"^\[(?P<ts>[^\]]+)\] ACTION: (?P<action>\S+)(?: \| SITE: (?P<site>.*?))?"
+    r" \| STATUS: (?P<status>\S+)(?: \((?P<note>.*)\))?$"
+)
+
+def _utc(moment: datetime) -> str:
+    return moment.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+def parse_event(line: str):
+    """Returns the event dict for one log line (JSON, or the older text format), or None."""
+    line = line.strip()
+    if not line:
+        return None
+    if line.startswith("{"):
+        try:
+            return json.loads(line)
+        except ValueError:
+            return None
+    match = _LEGACY_LINE.match(line)
+    if match is None:
+        return None
+    event = match.groupdict()
+    event["ts"] = _utc(datetime.strptime(event["ts"], "%Y-%m-%d %H:%M:%S"))
+    return {k: v for k, v in event.items() if v}
+
+def sealed_segments(path: str = AUDIT_LOG_FILE) -> list:
+    """Returns [(seq, segment path)] of the sealed segments of `path`, oldest first."""
+    directory = os.path.dirname(os.path.abspath(path))
+    base = os.path.basename(path)
+    found = {}
+    for name in os.listdir(directory):
+        match = _SEGMENT_NAME.search(name)
+        if name.startswith(base) and match and name[:match.start()] == base:
+            seq = int(match.group(1))
+            # A segment interrupted mid-compression is still readable uncompressed
+            if match.group(2) or seq not in found:
+                found[seq] = os.path.join(directory, name)
+    return sorted(found.items())
+
+def log_files(path: str = AUDIT_LOG_FILE) -> list:
+    """Every file holding audit events: the active segment, sealed segments and their sidecars."""
+    files = [path, checkpoints_path(path), pending_path(path)]
+    for seq, segment in sealed_segments(path):
+        files += [segment, _index_path(path, seq)]
+    return [f for f in files if os.path.exists(f)]
+
+def checkpoints_path(path: str = AUDIT_LOG_FILE) -> str:
+    return path + ".checkpoints"
+
+def pending_path(path: str = AUDIT_LOG_FILE) -> str:
+    return path + ".pending"
+
+def _index_path(path: str, seq: int) -> str:
+    return f"{path}.{seq:06d}.idx"
+
+def _active_seq(path: str) -> int:
+    """The seq the active segment will get when it is sealed, so positions survive rotation."""
+    segments = sealed_segments(path)
+    return segments[-1][0] + 1 if segments else 1
+
+def read_index(path: str, seq: int):
+    try:
+        with open(_index_path(path, seq), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _build_index(lines) -> dict:
+    index = {"first": None, "last": None, "count": 0, "actions": {}, "first_n": None, "last_n": None, "last_mac": None}
+    for line in lines:
+        event = parse_event(line)
+        if event is None:
+            continue
+        if "mac" in event:
+            if index["first_n"] is None:
+                index["first_n"] = event["n"]
+            index["last_n"], index["last_mac"] = event["n"], event["mac"]
+        ts = event.get("ts")
+        if ts and (index["first"] is None or ts < index["first"]):
+            index["first"] = ts
+        if ts and (index["last"] is None or ts > index["last"]):
+            index["last"] = ts
+        index["count"] += 1
+        action = event.get("action", "")
+        index["actions"][action] = index["actions"].get(action, 0) + 1
+    return index
+
+class _SegmentLock:
+    """flock on "<log>.lock", held by writers while appending or rotating and by readers while opening segments."""
+
+    def __init__(self, path: str, exclusive: bool):
+        self.path = path + ".lock"
+        self.exclusive = exclusive
+
+    def __enter__(self):
+        self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.flock(self.fd, fcntl.LOCK_EX if self.exclusive else fcntl.LOCK_SH)
+        return self
+
+    def __exit__(self, *exc):
+        fcntl.flock(self.fd, fcntl.LOCK_UN)
+        os.close(self.fd)
+
+def _needs_rotation(path: str, max_bytes: int, max_seconds: int) -> bool:
+    try:
+        if os.path.getsize(path) >= max_bytes:
+            return True
+        with open(path, "r", encoding="utf-8") as f:
+            first = parse_event(f.readline())
+    except OSError:
+        return False
+    if not first or "ts" not in first:
+        return False
+    started = datetime.strptime(first["ts"], "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=timezone.utc)
+    return (datetime.now(timezone.utc) - started).total_seconds() >= max_seconds
+
+def rotate_segment(path: str = AUDIT_LOG_FILE):
+    """Seals the active segment: renames, gzips and indexes it. Callers hold the exclusive segment lock."""
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return None
+    seq = _active_seq(path)
+    raw = f"{path}.{seq:06d}"
+    os.rename(path, raw)
+    with open(raw, "r", encoding="utf-8") as f:
+        index = _build_index(f)
+    with open(raw, "rb") as src, gzip.open(raw + ".gz.tmp", "wb") as out:
+        shutil.copyfileobj(src, out)
+    os.replace(raw + ".gz.tmp", raw + ".gz")
+    tmp = _index_path(path, seq) + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"seq": seq, **index}, f)
+    os.replace(tmp, _index_path(path, seq))
+    os.remove(raw)
+    return seq
+
+# ---------------------
+# Hash Chain
+# ---------------------
+
+def chain_key(vault_key: bytes) -> bytes:
+    from vault import derive_subkey  # vault imports this module
+    return derive_subkey(vault_key, "audit")
+
+# Built once: json.dumps would construct a new encoder on every call with these options
+_canonical = json.JSONEncoder(sort_keys=True, separators=(",", ":"), ensure_ascii=False).encode
+
+def chain_mac(key: bytes, prev_mac: str, event: dict) -> str:
+    """The link for `event` (without its mac) after `prev_mac`."""
+    data = prev_mac.encode() + b"\n" + _canonical(event).encode()
+    return hmac.digest(key, data, "sha256").hex()
+
+def checkpoint_sig(key: bytes, n: int, mac: str) -> str:
+    return hmac.digest(key, f"checkpoint:{n}:{mac}".encode(), "sha256").hex()
+
+def _last_link(lines):
+    last = None
+    for line in lines:
+        event = parse_event(line if isinstance(line, str) else line.decode("utf-8", "replace"))
+        if event and "mac" in event:
+            last = (event["n"], event["mac"])
+    return last
+
+def _chain_tail(path: str):
+    """(n, mac) of the newest chained entry, from the end of the active segment or the newest sidecar."""
+    if os.path.exists(path) and os.path.getsize(path):
+        with open(path, "rb") as f:
+            f.seek(max(0, os.path.getsize(path) - 64 * 1024))
+            last = _last_link(f.read().splitlines())
+            if last is None:
+                f.seek(0)
+                last = _last_link(f)
+        if last:
+            return last
+    for seq, segment in reversed(sealed_segments(path)):
+        index = read_index(path, seq)
+        if index is None:
+            with (gzip.open(segment, "rb") if segment.endswith(".gz") else open(segment, "rb")) as f:
+                last = _last_link(f)
+        else:
+            last = (index["last_n"], index["last_mac"]) if index.get("last_n") else None
+        if last:
+            return last
+    return 0, GENESIS_MAC
+
+# ---------------------
+# Batched Writer
+# ---------------------
+
+class AuditWriter:
+    """
+    Appends audit lines from a background thread, in batches.
+
+    `write` only puts the line on a bounded queue. The writer thread appends
+    everything queued with one write once `batch_size` lines are waiting or
+    `flush_interval` seconds have passed, and fsyncs each batch if `fsync` is
+    "batch". When the queue is full, `backpressure` decides whether callers
+    wait ("block") or the line is discarded and counted ("drop"); discarded
+    lines are reported in the log itself with an AUDIT_DROPPED entry.
+    The active segment is rotated, if due, just before a batch is appended,
+    and each batch is chained to the last entry in the log (by any process)
+    while the segment lock is held. Until `chain_key` is set, batches go to
+    the pending file instead; the first keyed batch chains them ahead of itself.
+    """
+
+    def __init__(self, path: str = AUDIT_LOG_FILE, max_queue: int = AUDIT_QUEUE_SIZE,
+                 batch_size: int = AUDIT_BATCH_SIZE, flush_interval: float = AUDIT_FLUSH_INTERVAL,
+                 fsync: str = AUDIT_FSYNC, backpressure: str = AUDIT_BACKPRESSURE,
+                 segment_bytes: int = AUDIT_SEGMENT_BYTES, segment_seconds: int = AUDIT_SEGMENT_SECONDS,
+                 checkpoint_every: int = AUDIT_CHECKPOINT_EVERY):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"Unknown audit fsync policy: {fsync}")
+        if backpressure not in BACKPRESSURE_POLICIES:
+            raise ValueError(f"Unknown audit backpressure policy: {backpressure}")
+        self.path = path
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self.backpressure = backpressure
+        self.segment_bytes = segment_bytes
+        self.segment_seconds = segment_seconds
+        self.checkpoint_every = checkpoint_every
+        self.chain_key = None
+        self._tail = None  # (inode, size, n, mac) after this writer's last append
+        self.written = 0
+        self.dropped = 0
+        self.batches = 0
+        self._unreported_drops = 0
+        self._lock = threading.Lock()
+        self._pid = None
+        self._queue = None
+        self._thread = None
+
+    def _ensure_started(self):
+        # A forked child (agent, gunicorn worker) inherits the queue but not the thread
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._queue = queue.Queue(self.max_queue)
+            self._thread = threading.Thread(target=self._run, name="audit-writer", daemon=True)
+            self._thread.start()
+            self._pid = os.getpid()
+
+    def write(self, event: dict):
+        self._ensure_started()
+        if self.backpressure == "block":
+            self._queue.put(event)
+            return
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+                self._unreported_drops += 1
+
+    def flush(self, timeout: float = None) -> bool:
+        """
+        Blocks until every event written so far is on disk, and chained if the
+        writer has a key. Returns False on timeout.
+        """
+        if self._pid != os.getpid():
+            if self.chain_key is None or not os.path.exists(pending_path(self.path)):
+                return True
+            self._ensure_started()
+        done = threading.Event()
+        self._queue.put(done)  # markers always block, so a flush is never dropped
+        return done.wait(timeout)
+
+    def close(self):
+        if self._pid != os.getpid():
+            return
+        self.flush()
+        self._queue.put(None)
+        self._thread.join()
+        self._pid = None
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"written": self.written, "dropped": self.dropped, "batches": self.batches,
+                    "queued": self._queue.qsize() if self._queue else 0}
+
+    def _run(self):
+        events, waiters = [], []
+        stopping = False
+        while not stopping:
+            deadline = time.monotonic() + self.flush_interval
+            while len(events) < self.batch_size and not waiters:
+                try:
+                    item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                if isinstance(item, threading.Event):
+                    waiters.append(item)
+                else:
+                    events.append(item)
+            if events or (waiters and self.chain_key and os.path.exists(pending_path(self.path))):
+                self._append(events)
+            for waiter in waiters:
+                waiter.set()
+            events, waiters = [], []
+
+    def _link(self):
+        """(n, mac) to chain the next entry to; re-read from disk if another process wrote since."""
+        try:
+            st = os.stat(self.path)
+            stamp = (st.st_ino, st.st_size)
+        except FileNotFoundError:
+            stamp = None
+        if self._tail and stamp == self._tail[:2]:
+            return self._tail[2:]
+        return _chain_tail(self.path)
+
+    def _append(self, events: list):
+        with self._lock:
+            drops, self._unreported_drops = self._unreported_drops, 0
+        if drops:
+            events.append(make_event("AUDIT_DROPPED", status="WARNING", note=f"{drops} entries dropped, queue full"))
+        try:
+            with _SegmentLock(self.path, exclusive=True):
+                if self.chain_key is None:
+                    lines = [json.dumps(event, ensure_ascii=False) + "\n" for event in events]
+                    self._write(pending_path(self.path), lines)
+                else:
+                    lines = self._chain(events)
+        except Exception as e:
+            print(f"⚠️ Failed to write to audit log: {e}")
+            return
+        with self._lock:
+            self.written += len(lines)
+            self.batches += 1
+
+    def _chain(self, events: list) -> list:
+        """Appends the pending events, then `events`, to the chain. Called with the segment lock held."""
+        pending = pending_path(self.path)
+        if os.path.exists(pending):
+            with open(pending, "r", encoding="utf-8") as f:
+                events = [event for event in map(parse_event, f) if event is not None] + events
+        if not events:
+            return []
+        if _needs_rotation(self.path, self.segment_bytes, self.segment_seconds):
+            rotate_segment(self.path)
+        n, mac = self._link()
+        lines, checkpoints = [], []
+        for event in events:
+            n += 1
+            event = {**event, "n": n}
+            event["mac"] = mac = chain_mac(self.chain_key, mac, event)
+            lines.append(json.dumps(event, ensure_ascii=False) + "\n")
+            if n % self.checkpoint_every == 0:
+                checkpoints.append(json.dumps({"n": n, "mac": mac, "ts": event["ts"],
+                                               "sig": checkpoint_sig(self.chain_key, n, mac)}) + "\n")
+        self._write(self.path, lines)
+        if checkpoints:
+            self._write(checkpoints_path(self.path), checkpoints)
+        if os.path.exists(pending):
+            os.remove(pending)
+        st = os.stat(self.path)
+        self._tail = (st.st_ino, st.st_size, n, mac)
+        return lines
+
+    def _write(self, path: str, lines: list):
+        with open(path, "a", encoding="utf-8") as log:
+            log.write("".join(lines))
+            if self.fsync == "batch":
+                log.flush()
+                os.fsync(log.fileno())
+
+
+# One writer per log file: the default log, plus one per tenant (see tenants.py)
+_writer = AuditWriter()
+_writers = {os.path.abspath(AUDIT_LOG_FILE): _writer}
+_writers_lock = threading.Lock()
+
+def writer_for(path: str = None) -> AuditWriter:
+    """The writer appending to `path` (the default log if None), created on first use."""
+    if path is None:
+        return _writer
+    with _writers_lock:
+        writer = _writers.get(os.path.abspath(path))
+        if writer is None:
+            writer = _writers[os.path.abspath(path)] = AuditWriter(path)
+        return writer
+
+@atexit.register
+def _close_writers():
+    with _writers_lock:
+        writers = list(_writers.values())
+    for writer in writers:
+        writer.close()
+
+# ---------------------
+# Audit API
+# ---------------------
+
+def make_event(action: str, site: str = None, status: str = "SUCCESS", note: str = "") -> dict:
+    """One audit event, timestamped now (UTC)."""
+    event = {"ts": _utc(datetime.now()), "action": action, "status": status}
+    if site:
+        event["site"] = site
+    if note:
+        event["note"] = note
+    return event
+
+def use_vault_key(vault_key: bytes, log_file: str = None):
+    """
+    Keys this process's audit entries (and checkpoints) from a vault key known
+    to be correct. Pending entries are chained with the next write or flush.
+    """
+    writer_for(log_file).chain_key = chain_key(vault_key)
+
+def log_action(action: str, site: str = None, status: str = "SUCCESS", note: str = "", log_file: str = None):
     """
     Logs actions performed on the vault with timestamps.
 
+    The entry is queued and written by the background audit writer; call
+    `flush()` when it must be on disk before continuing.
+
     Args:
         action (str): Action performed (e.g., ADD, GET, DELETE)
         site (str): Site related to the action
         status (str): Status of the action (e.g., SUCCESS, FAILURE)
         note (str): Optional message for context
+        log_file (str): Log to append to, if not the default one
+    """
+    writer_for(log_file).write(make_event(action, site, status, note))
+
+def flush(timeout: float = None, log_file: str = None) -> bool:
+    return writer_for(log_file).flush(timeout)
+
+# ---------------------
+# Queries
+# ---------------------
+
+def parse_time(value: str) -> str:
+    """Turns an ISO date or datetime (local time unless it has an offset) into the UTC form events use."""
+    moment = datetime.fromisoformat(value.strip().replace("Z", "+00:00"))
+    return _utc(moment)
+
+def format_text(event: dict) -> str:
+    """Renders an event the way the audit log has always been displayed, in local time."""
+    moment = datetime.strptime(event["ts"], "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=timezone.utc).astimezone()
+    site_part = f" | SITE: {event['site']}" if event.get("site") else ""
+    note_part = f" ({event['note']})" if event.get("note") else ""
+    return (f"[{moment.strftime('%Y-%m-%d %H:%M:%S')}] ACTION: {event.get('action')}"
+            f"{site_part} | STATUS: {event.get('status')}{note_part}")
+
+class _Filter:
+    def __init__(self, since=None, until=None, action=None, site=None):
+        self.since = since
+        self.until = until
+        self.action = action.upper() if action else None
+        self.site = site.lower() if site else None
+
+    def skips_segment(self, index) -> bool:
+        """True if a sealed segment's sidecar proves none of its events can match."""
+        if index is None:
+            return False
+        if self.action and not index["actions"].get(self.action):
+            return True
+        if self.since and index["last"] and index["last"] < self.since:
+            return True
+        if self.until and index["first"] and index["first"] > self.until:
+            return True
+        return False
+
+    def matches(self, event: dict) -> bool:
+        ts = event.get("ts", "")
+        if self.since and ts < self.since:
+            return False
+        if self.until and ts > self.until:
+            return False
+        if self.action and event.get("action", "").upper() != self.action:
+            return False
+        if self.site and (event.get("site") or "").lower() != self.site:
+            return False
+        return True
+
+    def matching_count(self, index):
+        """Upper bound of matches in a sealed segment from its sidecar, or None if unknown."""
+        if index is None or self.site or self.since or self.until:
+            return None
+        return index["actions"].get(self.action, 0) if self.action else index["count"]
+
+def _open_sealed(segment: str):
+    if segment.endswith(".gz"):
+        return gzip.open(segment, "rt", encoding="utf-8")
+    return open(segment, "r", encoding="utf-8")
+
+def _open_segments(path: str, filters: _Filter, after=(0, 0), pending=True):
+    """
+    Returns [(seq, source)] for every segment that may hold matching events
+    after position `after`. The segments are listed, and the active one opened,
+    under the shared lock so a concurrent rotation can't move events between
+    them; sealed segments never change, so they are left as paths and only
+    opened when reached. The caller closes the files it was handed.
+    """
+    segments = []
+    with _SegmentLock(path, exclusive=False):
+        sealed = sealed_segments(path)
+        for seq, segment in sealed:
+            if seq < after[0] or filters.skips_segment(read_index(path, seq)):
+                continue
+            segments.append((seq, segment))
+        active_seq = sealed[-1][0] + 1 if sealed else 1
+        if active_seq >= after[0]:
+            # Pending entries read as the end of the active segment, where they will be chained
+            for name in (path, pending_path(path)) if pending else (path,):
+                if os.path.exists(name):
+                    segments.append((active_seq, open(name, "r", encoding="utf-8")))
+    return segments
+
+def iter_events(path: str = AUDIT_LOG_FILE, since=None, until=None, action=None, site=None, after=(0, 0),
+                pending=True):
     """
-    timestamp = datetime.now().strftime("[%Y-%m-%d %H:%M:%S]")
-    site_part = f" | SITE: {site}" if site else ""
-    note_part = f" ({note})" if note else ""
-    line = f"{timestamp} ACTION: {action}{site_part} | STATUS: {status}{note_part}\n"
+    Yields ((segment seq, line number), event) for matching events, oldest first.
 
+    `since`/`until` are UTC timestamps as produced by parse_time. Sealed
+    segments whose sidecar rules them out are never opened, and matching
+    ones are decompressed as a stream. `after` resumes past a position.
+    `pending` includes the entries still waiting to be chained.
+    """
+    filters = _Filter(since, until, action, site)
+    segments = _open_segments(path, filters, after, pending)
+    current, number = None, 0
     try:
-        with open(AUDIT_LOG_FILE, "a", encoding="utf-8") as log:
-            log.write(line)
-    except Exception as e:
-        print(f"⚠️ Failed to write to audit log: {e}")
+        for seq, source in segments:
+            if seq != current:
+                current, number = seq, 0
+            with _open_sealed(source) if isinstance(source, str) else source as f:
+                for line in f:
+                    number += 1
+                    if (seq, number) <= after:
+                        continue
+                    event = parse_event(line)
+                    if event is not None and filters.matches(event):
+                        yield (seq, number), event
+    finally:
+        # A consumer that stops early (page_events, a dropped generator) never reaches the active file
+        for _, source in segments:
+            if not isinstance(source, str):
+                source.close()
+
+def tail_events(n: int, path: str = AUDIT_LOG_FILE, **filters):
+    """Returns the last `n` matching events, opening sealed segments only as far back as needed."""
+    sealed = sealed_segments(path)
+    wanted = _Filter(**filters)
+    start, total = len(sealed), 0
+    # The active segment is small; count back through sidecars until they cover n events
+    while start > 0 and total < n:
+        count = wanted.matching_count(read_index(path, sealed[start - 1][0]))
+        if count is None:
+            start = 0
+            break
+        total += count
+        start -= 1
+    first_seq = sealed[start][0] if start < len(sealed) else _active_seq(path)
+    last = deque(iter_events(path, after=(first_seq, 0), **filters), maxlen=n)
+    return [event for _, event in last]
+
+def follow_events(path: str = AUDIT_LOG_FILE, poll: float = 0.5, **filters):
+    """Yields matching events appended to the log from now on, following it across rotations."""
+    wanted = _Filter(**filters)
+    f, inode, pending = None, None, b""
+    started = False
+    while True:
+        try:
+            current = os.stat(path).st_ino
+        except FileNotFoundError:
+            current = None
+        if current != inode:
+            lines = []
+            if f:
+                # Rotated: finish what was written before the seal, then move on to the new segment
+                lines = (pending + f.read()).splitlines()
+                f.close()
+            f, inode, pending = (open(path, "rb") if current else None), current, b""
+            if f and not started:
+                f.seek(0, os.SEEK_END)
+            for line in lines:
+                event = parse_event(line.decode("utf-8"))
+                if event is not None and wanted.matches(event):
+                    yield event
+        started = True
+
+        chunk = f.read() if f else b""
+        if not chunk:
+            time.sleep(poll)
+            continue
+        *lines, pending = (pending + chunk).split(b"\n")
+        for line in lines:
+            event = parse_event(line.decode("utf-8"))
+            if event is not None and wanted.matches(event):
+                yield event
+
+def encode_cursor(position) -> str:
+    return base64.urlsafe_b64encode(json.dumps(list(position)).encode()).decode()
+
+def decode_cursor(cursor: str):
+    try:
+        seq, number = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return int(seq), int(number)
+    except Exception:
+        raise ValueError("Invalid cursor.")
+
+def page_events(limit: int, cursor: str = None, path: str = AUDIT_LOG_FILE, **filters):
+    """Returns (up to `limit` matching events after `cursor`, next cursor or None)."""
+    after = decode_cursor(cursor) if cursor else (0, 0)
+    events, last = [], None
+    matching = iter_events(path, after=after, **filters)
+    try:
+        for position, event in matching:
+            if len(events) == limit:
+                return events, encode_cursor(last)
+            events.append(event)
+            last = position
+    finally:
+        matching.close()  # closes the files now, not whenever the generator is collected
+    return events, None
 
 def read_audit_log():
-    if not os.path.exists(AUDIT_LOG_FILE):
-        return "No audit log entries found."
+    """The whole audit log as text. Prefer iter_events/tail_events, which stream."""
+    flush()
     try:
-        with open(AUDIT_LOG_FILE, "r", encoding="utf-8") as log_file:
-            return log_file.read()
+        text = "".join(format_text(event) + "\n" for _, event in iter_events(AUDIT_LOG_FILE))
     except Exception as e:
-        return f"Failed to read audit log: {e}"
\ No newline at end of file
+        return f"Failed to read audit log: {e}"
+    return text or "No audit log entries found."
+
+# ---------------------
+# Verification
+# ---------------------
+
+def _start_after(path: str, n: int):
+    """Position just before the segment holding chain entry `n`, going by the sidecars."""
+    for seq, _ in sealed_segments(path):
+        index = read_index(path, seq)
+        if index is None or index.get("last_n") is None or index["last_n"] >= n:
+            return seq, 0
+    return _active_seq(path), 0
+
+def verify_chain(vault_key, path: str = AUDIT_LOG_FILE, full: bool = False, previous_keys=()) -> dict:
+    """
+    Checks the audit hash chain and the checkpoint signatures.
+
+    By default only entries from the latest checkpoint onwards are rehashed:
+    the checkpointed entry must still carry the signed mac, and every later
+    entry must link to it. `full` rehashes the whole chain and also checks
+    each entry a checkpoint covers. The report names the first broken link.
+    Entries and checkpoints made before the vault was re-keyed are checked
+    against `previous_keys` (see vault.previous_keys). A link that isn't keyed
+    (from before pending entries existed) breaks the chain, since anyone could
+    have recomputed it. Pending entries aren't chained yet and are only counted.
+    """
+    keys = [chain_key(k) for k in (vault_key, *previous_keys)]
+
+    def signed(mac: str, sign):
+        return any(hmac.compare_digest(mac, sign(key)) for key in keys)
+    report = {"ok": True, "checked": 0, "pending": 0, "legacy": 0, "from": 0, "error": None, "at": None}
+
+    def broken(reason, position=None, n=None):
+        report.update(ok=False, error=reason,
+                      at={"n": n, "segment": position[0], "line": position[1]} if position else None)
+        return report
+
+    checkpoints = {}
+    if os.path.exists(checkpoints_path(path)):
+        with open(checkpoints_path(path), "r", encoding="utf-8") as f:
+            for number, line in enumerate(f, start=1):
+                try:
+                    checkpoint = json.loads(line)
+                    valid = signed(checkpoint["sig"], lambda key: checkpoint_sig(key, checkpoint["n"], checkpoint["mac"]))
+                except (ValueError, KeyError, TypeError):
+                    valid = False
+                if not valid:
+                    return broken(f"checkpoint on line {number} has a bad signature (wrong key or forged)")
+                checkpoints[checkpoint["n"]] = checkpoint["mac"]
+    latest = max(checkpoints) if checkpoints else 0
+
+    start = 0 if full else latest
+    prev_n, prev_mac = 0, GENESIS_MAC
+    reached = start == 0
+    report["from"] = start
+    for position, event in iter_events(path, after=_start_after(path, start) if start else (0, 0), pending=False):
+        if "mac" not in event:
+            # Entries logged before the chain existed can only come first
+            if prev_n == 0 and not report["checked"]:
+                report["legacy"] += 1
+                continue
+            return broken("entry is not chained (inserted or stripped)", position)
+
+        n, mac = event.get("n"), event.pop("mac")
+        if not reached:
+            if not isinstance(n, int) or n < start:
+                continue
+            if n != start or mac != checkpoints[start]:
+                return broken(f"checkpointed entry {start} was altered or removed", position, n)
+            reached, prev_n, prev_mac = True, n, mac
+            continue
+
+        if n != prev_n + 1:
+            return broken(f"expected entry {prev_n + 1}, found {n} (entries removed, reordered or inserted)", position, n)
+        if mac.startswith("u:"):
+            return broken("entry was chained without the vault key, so it could have been rewritten", position, n)
+        if not signed(mac, lambda key: chain_mac(key, prev_mac, event)):
+            return broken("entry does not match its mac (altered, or logged with another key)", position, n)
+        if n in checkpoints and checkpoints[n] != mac:
+            return broken(f"entry {n} does not match its checkpoint", position, n)
+        report["checked"] += 1
+        prev_n, prev_mac = n, mac
+
+    if not reached:
+        return broken(f"checkpointed entry {start} is missing")
+    if prev_n < latest:
+        return broken(f"log ends at entry {prev_n} but was checkpointed at entry {latest} (truncated)")
+    report["last"] = prev_n
+    if os.path.exists(pending_path(path)):
+        with open(pending_path(path), "r", encoding="utf-8") as f:
+            report["pending"] = sum(parse_event(line) is not None for line in f)
+    return report
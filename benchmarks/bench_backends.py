@@ -0,0 +1,72 @@
+"""
+Point-lookup and write latency of each storage format vs. vault size.
+
+Every format is filled with the same synthetic vault, then timed on random
+get_record calls and on single-record put_record calls (each one a full,
+durable write, as the CLI and web app issue them).
+
+    python -m benchmarks.bench_backends --sizes 100 10000 100000
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from cryptography.fernet import Fernet
+
+import storage
+from benchmarks.synthetic import synthetic_vault
+
+# Formats that rewrite or decrypt the whole vault per operation get fewer
+# rounds at large sizes, so a run still finishes in minutes
+_WHOLE_VAULT = {storage.FORMAT_V1: 20_000, storage.FORMAT_V2: 200_000, storage.FORMAT_STREAM: 20_000}
+
+
+def rounds_for(fmt, size, rounds):
+    budget = _WHOLE_VAULT.get(fmt)
+    return max(3, min(rounds, budget // size)) if budget else rounds
+
+
+def time_ms(operation, args):
+    start = time.perf_counter()
+    for arg in args:
+        operation(arg)
+    return (time.perf_counter() - start) / len(args) * 1000
+
+
+def disk_bytes(path):
+    return sum(os.path.getsize(p) for p in (path, path + "-wal") if os.path.exists(p))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 10_000, 100_000])
+    parser.add_argument("--formats", nargs="+", choices=storage.FORMATS, default=storage.FORMATS)
+    parser.add_argument("--rounds", type=int, default=200)
+    args = parser.parse_args()
+
+    key = Fernet.generate_key()
+    print(f"{'format':>7} {'entries':>9} {'file MiB':>9} {'build s':>8} {'get ms':>9} {'put ms':>9}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in args.sizes:
+            data = synthetic_vault(size)
+            sites = [*data]
+            for fmt in args.formats:
+                path = os.path.join(tmp, f"vault-{fmt}-{size}")
+                start = time.perf_counter()
+                storage.save_vault(data, key, path, fmt)
+                build = time.perf_counter() - start
+
+                rounds = rounds_for(fmt, size, args.rounds)
+                rng = random.Random(0)
+                get_ms = time_ms(lambda s: storage.get_record(key, s, path), rng.choices(sites, k=rounds))
+                put_ms = time_ms(lambda s: storage.put_record(key, s, {"username": "bench", "password": "new"}, path),
+                                 rng.choices(sites, k=rounds))
+                mib = disk_bytes(path) / 2**20
+                print(f"{fmt:>7} {size:>9} {mib:>9.2f} {build:>8.2f} {get_ms:>9.3f} {put_ms:>9.3f}")
+                storage.clear_cache()
+
+
+if __name__ == "__main__":
+    main()
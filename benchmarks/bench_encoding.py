@@ -0,0 +1,57 @@
+"""
+Vault payload encodings compared: JSON vs. the binary record encoding, with and without zlib.
+
+For each size, the same synthetic vault is serialized in every encoding and
+timed on encode and decode alone, then on a full encrypt_data/decrypt_data
+round trip. The on-disk size is that of the v1 vault file the token becomes.
+
+    python -m benchmarks.bench_encoding --sizes 1000 100000 1000000
+"""
+import argparse
+import time
+
+from cryptography.fernet import Fernet
+
+import recordcodec
+from benchmarks.synthetic import synthetic_vault
+from vault import decrypt_data, encrypt_data
+
+
+def best_ms(operation, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = operation()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 100_000, 1_000_000])
+    parser.add_argument("--encodings", nargs="+", choices=recordcodec.ENCODINGS, default=recordcodec.ENCODINGS)
+    parser.add_argument("--repeat", type=int, default=3, help="best of this many runs per measurement")
+    args = parser.parse_args()
+
+    key = Fernet.generate_key()
+    print(f"{'encoding':>13} {'entries':>9} {'file MiB':>9} {'vs json':>8} "
+          f"{'encode ms':>10} {'decode ms':>10} {'encrypt ms':>11} {'decrypt ms':>11}")
+    for size in args.sizes:
+        data = synthetic_vault(size)
+        json_size = None
+        for encoding in args.encodings:
+            encode_ms, payload = best_ms(lambda: recordcodec.encode(data, encoding), args.repeat)
+            decode_ms, decoded = best_ms(lambda: recordcodec.decode(payload), args.repeat)
+            encrypt_ms, token = best_ms(lambda: encrypt_data(data, key, encoding), args.repeat)
+            decrypt_ms, _ = best_ms(lambda: decrypt_data(token, key), args.repeat)
+            assert decoded == data, encoding
+            if encoding == recordcodec.ENCODING_JSON:
+                json_size = len(token)
+            ratio = f"{len(token) / json_size:>7.0%}" if json_size else f"{'-':>7}"
+            print(f"{encoding:>13} {size:>9} {len(token) / 2**20:>9.2f} {ratio:>8} "
+                  f"{encode_ms:>10.1f} {decode_ms:>10.1f} {encrypt_ms:>11.1f} {decrypt_ms:>11.1f}")
+            del payload, decoded, token
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""
+Single-record lookup latency vs. vault size.
+
+Compares the memory-mapped VaultReader (tag table + one record) with
+decrypting the whole vault, for v2 vaults of increasing size.
+
+    python -m benchmarks.bench_lookup --sizes 1000 10000 100000
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+
+from cryptography.fernet import Fernet
+
+import storage
+from benchmarks.synthetic import synthetic_vault
+
+
+def build_vault(path, key, size):
+    data = synthetic_vault(size)
+    storage.save_vault(data, key, path, storage.FORMAT_V2)
+    return [*data]
+
+
+def time_lookups(lookup, sites, rounds):
+    picks = random.Random(0).choices(sites, k=rounds)
+    tracemalloc.start()
+    start = time.perf_counter()
+    for site in picks:
+        lookup(site)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed / rounds * 1000, peak / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1_000, 10_000, 50_000])
+    parser.add_argument("--rounds", type=int, default=200)
+    args = parser.parse_args()
+
+    key = Fernet.generate_key()
+    print(f"{'entries':>9} {'file MiB':>9} {'mmap get ms':>12} {'peak KiB':>9} {'full load ms':>13} {'peak KiB':>9}")
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "vault.json.enc")
+        for size in args.sizes:
+            sites = build_vault(path, key, size)
+            mmap_ms, mmap_kib = time_lookups(lambda s: storage.get_record(key, s, path), sites, args.rounds)
+            full_rounds = max(1, min(args.rounds, 20_000 // size))
+            full_ms, full_kib = time_lookups(lambda s: storage.load_vault(key, path)[s], sites, full_rounds)
+            mib = os.path.getsize(path) / 2**20
+            print(f"{size:>9} {mib:>9.2f} {mmap_ms:>12.3f} {mmap_kib:>9.1f} {full_ms:>13.3f} {full_kib:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
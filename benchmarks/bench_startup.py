@@ -0,0 +1,105 @@
+"""
+CLI cold-start time: an import breakdown and a budget for --version and --help.
+
+Each command runs in a fresh interpreter and its median wall time is compared
+with an interpreter that only imports click, which every invocation needs
+anyway. The difference is the CLI's own startup cost; the run fails (exit 1)
+if it exceeds the budget. The slowest imports under `cli`, from
+`python -X importtime`, show where the time goes.
+
+    python -m benchmarks.bench_startup --runs 20 --budget-ms 50
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+COMMANDS = {
+    "click only": ["-c", "import click"],
+    "cli.py --version": ["cli.py", "--version"],
+    "cli.py --help": ["cli.py", "--help"],
+    # Run as a module, cli.py's bytecode is cached instead of recompiled every time
+    "-m cli --version": ["-m", "cli", "--version"],
+}
+BASELINE = "click only"
+DEFAULT_BUDGET_MS = 50
+
+
+def environment():
+    # Measure with bytecode caching on, as users run it
+    env = dict(os.environ)
+    env.pop("PYTHONDONTWRITEBYTECODE", None)
+    return env
+
+
+def run(args, env, importtime=False):
+    flags = ["-X", "importtime"] if importtime else []
+    return subprocess.run([sys.executable, *flags, *args], cwd=ROOT, env=env, capture_output=True, text=True)
+
+
+def wall_ms(args, env, runs):
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        run(args, env)
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def import_breakdown(args, env):
+    """(cumulative ms, self ms, module) for each module imported directly by `cli`, slowest first."""
+    # A module's line comes after its imports', so the direct imports of `cli`
+    # are the depth-1 lines since the top-level import before it
+    children = []
+    for line in run(args, env, importtime=True).stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        own, cumulative, name = line[len("import time:"):].split("|")
+        if not own.strip().isdigit():
+            continue  # the header line
+        depth = (len(name) - len(name.lstrip())) // 2
+        if depth == 0:
+            if name.strip() == "cli":
+                return sorted(children, reverse=True)
+            children = []
+        elif depth == 1:
+            children.append((int(cumulative) / 1000, int(own) / 1000, name.strip()))
+    return []
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--budget-ms", type=float, default=DEFAULT_BUDGET_MS,
+                        help="Allowed startup time on top of importing click.")
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+
+    env = environment()
+    for command in COMMANDS.values():
+        run(command, env)  # warm-up, and writes the bytecode cache
+
+    print(f"{'imported by cli':<24} {'cumul ms':>9} {'self ms':>8}")
+    for cumulative, own, name in import_breakdown(["-c", "import cli"], env)[:args.top]:
+        print(f"{name:<24} {cumulative:>9.2f} {own:>8.2f}")
+
+    print(f"\n{'command':<24} {'median ms':>9} {'overhead':>9}")
+    medians = {name: wall_ms(command, env, args.runs) for name, command in COMMANDS.items()}
+    over_budget = []
+    for name, median in medians.items():
+        overhead = median - medians[BASELINE]
+        print(f"{name:<24} {median:>9.1f} {overhead:>+9.1f}")
+        if name != BASELINE and overhead > args.budget_ms:
+            over_budget.append(name)
+
+    if over_budget:
+        print(f"\n❌ Over the {args.budget_ms:.0f} ms startup budget: {', '.join(over_budget)}")
+        sys.exit(1)
+    print(f"\n✅ Within the {args.budget_ms:.0f} ms startup budget.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""
+Peak memory and time of whole-vault writes and reads: Fernet-token v1 vs. the streaming container.
+
+Peak memory is what tracemalloc sees allocated during the operation, on top
+of the synthetic vault itself. "scan" walks iter_vault without keeping the
+records, as exports do; "load" builds the whole dict, as load_vault does.
+
+    python -m benchmarks.bench_stream --sizes 10000 100000 1000000
+"""
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+
+from cryptography.fernet import Fernet
+
+import storage
+from benchmarks.synthetic import synthetic_vault
+
+FORMATS = [storage.FORMAT_V1, storage.FORMAT_STREAM]
+
+
+def measure(operation):
+    """(seconds, peak MiB allocated while running `operation`)."""
+    tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        operation()
+        seconds = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return seconds, peak / 2**20
+
+
+def scan(key, path):
+    for _ in storage.iter_vault(key, path):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    args = parser.parse_args()
+
+    key = Fernet.generate_key()
+    print(f"{'format':>7} {'entries':>9} {'file MiB':>9} {'op':>6} {'seconds':>8} {'peak MiB':>9}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in args.sizes:
+            data = synthetic_vault(size)
+            for fmt in FORMATS:
+                path = os.path.join(tmp, f"vault-{fmt}-{size}")
+                rows = [("save", lambda: storage.save_vault(data, key, path, fmt)),
+                        ("load", lambda: storage.load_vault(key, path)),
+                        ("scan", lambda: scan(key, path))]
+                for op, operation in rows:
+                    seconds, peak = measure(operation)
+                    mib = os.path.getsize(path) / 2**20
+                    print(f"{fmt:>7} {size:>9} {mib:>9.2f} {op:>6} {seconds:>8.2f} {peak:>9.1f}")
+                os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
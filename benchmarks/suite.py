@@ -0,0 +1,441 @@
+"""
+Benchmark suite: vault.py micro-benchmarks plus end-to-end CLI and web timings.
+
+Every benchmark runs on the deterministic vaults from benchmarks/synthetic.py,
+once per requested size where the vault size matters. CLI commands go through
+click's test runner and web endpoints through Flask's test client, each in a
+scratch directory, so nothing outside it is touched. `agent` and `copy` are
+left out (they need a daemon and a clipboard), as is `kdf calibrate`, whose
+cost is whatever target it is given.
+
+Results are written as JSON. `compare` flags every benchmark whose median got
+slower than the baseline's by more than the threshold, and exits 1 if any did.
+
+    python -m benchmarks.suite run --sizes 100 10000 --output baseline.json
+    python -m benchmarks.suite run --sizes 100 10000 --compare baseline.json
+    python -m benchmarks.suite compare baseline.json results.json --threshold 0.25
+"""
+import argparse
+import contextlib
+import datetime
+import itertools
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+from unittest.mock import patch
+
+from benchmarks.synthetic import (PASSWORD_LENGTH, SITE_LENGTH, USERNAME_LENGTH,
+                                  synthetic_entries, synthetic_vault)
+
+GROUPS = ["vault", "cli", "web"]
+MASTER = "bench-master-password"
+DEFAULT_SIZES = [100, 10_000]
+DEFAULT_REPEAT = 5
+DEFAULT_THRESHOLD = 0.20
+# Microsecond-scale benchmarks jitter by more than any sensible threshold
+DEFAULT_MIN_DELTA_MS = 0.05
+IMPORT_ROWS = 100
+
+
+# ---------------------
+# Timing
+# ---------------------
+
+def measure(fn, repeat: int = DEFAULT_REPEAT, setup=None) -> dict:
+    """
+    Times `fn` `repeat` times after one untimed warm-up call; `setup` runs
+    untimed before each call. Without a setup, fast functions are looped
+    (as timeit does) so each sample lasts long enough to be meaningful.
+    """
+    if setup:
+        setup()
+        fn()
+        number = 1
+    else:
+        number = timeit.Timer(fn).autorange()[0]
+    samples = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        samples.append((time.perf_counter() - start) / number * 1000)
+    return {
+        "median_ms": round(statistics.median(samples), 4),
+        "min_ms": round(min(samples), 4),
+        "max_ms": round(max(samples), 4),
+        "repeat": repeat,
+        "number": number,
+    }
+
+
+def result_name(group: str, name: str, size: int = None) -> str:
+    return f"{group}.{name}" + (f"[{size}]" if size else "")
+
+
+@contextlib.contextmanager
+def scratch_dir():
+    """A temporary working directory; the vault, salt and audit log default to relative paths."""
+    import audit
+    import storage
+
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix="vault-bench-") as tmp:
+        os.chdir(tmp)
+        try:
+            yield tmp
+        finally:
+            audit.flush()
+            storage.clear_cache()
+            os.chdir(cwd)
+
+
+def build_vault(size: int, lengths: dict, vault_file: str, salt_file: str) -> tuple:
+    """Writes the synthetic vault for `size` (v2, indexed) and returns (key, sites)."""
+    import storage
+    import vault
+
+    key = vault.generate_key(MASTER, salt_file)
+    data = synthetic_vault(size, **lengths)
+    storage.save_vault(data, key, vault_file)
+    storage.reindex_vault(key, vault_file)
+    return key, [*data]
+
+
+def import_csv(lengths: dict) -> bytes:
+    """A CSV export of entries that aren't in any synthetic vault, for the import benchmarks."""
+    import exporter
+
+    entries = ((f"import-{site}", creds) for site, creds in synthetic_entries(IMPORT_ROWS, seed=1, **lengths))
+    return b"".join(exporter.export_chunks(entries, "csv"))
+
+
+# ---------------------
+# vault.py micro-benchmarks
+# ---------------------
+
+def bench_vault(sizes, repeat, lengths):
+    import vault
+
+    results = {}
+    with scratch_dir():
+        salt = vault.generate_salt()
+        vault.generate_key(MASTER)
+        key = vault.generate_key(MASTER)
+        passwords = [creds["password"] for _, creds in synthetic_entries(1000, **lengths)]
+        strength = itertools.cycle(passwords)
+        vault.update_last_access()
+
+        fixed = {
+            "generate_salt": lambda: vault.generate_salt(),
+            "derive_key.pbkdf2": lambda: vault.derive_key(MASTER, salt, vault.DEFAULT_KDF),
+            "derive_key.scrypt": lambda: vault.derive_key(
+                MASTER, salt, {"kdf": vault.KDF_SCRYPT, "n": vault.MIN_SCRYPT_N, "r": 8, "p": 1}),
+            "generate_key": lambda: vault.generate_key(MASTER),
+            "read_kdf_header": lambda: vault.read_kdf_header(),
+            "derive_subkey": lambda: vault.derive_subkey(key, "lookup"),
+            "check_password_strength": lambda: vault.check_password_strength(next(strength)),
+            "update_last_access": lambda: vault.update_last_access(),
+            "is_vault_locked": lambda: vault.is_vault_locked(),
+        }
+        for name, fn in fixed.items():
+            results[result_name("vault", name)] = measure(fn, repeat)
+
+        for size in sizes:
+            data = synthetic_vault(size, **lengths)
+            token = vault.encrypt_data(data, key)
+            results[result_name("vault", "encrypt_data", size)] = measure(lambda: vault.encrypt_data(data, key), repeat)
+            results[result_name("vault", "decrypt_data", size)] = measure(lambda: vault.decrypt_data(token, key), repeat)
+    return results
+
+
+# ---------------------
+# CLI end-to-end timings
+# ---------------------
+
+def bench_cli(sizes, repeat, lengths):
+    from click.testing import CliRunner
+
+    import cli
+    import storage
+
+    runner = CliRunner()
+
+    def command(*args):
+        def invoke():
+            result = runner.invoke(cli.cli, [*args])
+            if result.exit_code != 0 or "❌" in result.output:
+                raise RuntimeError(f"`{' '.join(args)}` failed:\n{result.output}")
+        return invoke
+
+    results = {}
+    with scratch_dir():
+        results[result_name("cli", "init")] = measure(
+            command("init", "--master", MASTER), repeat, setup=lambda: os.remove(storage.VAULT_FILE)
+            if os.path.exists(storage.VAULT_FILE) else None)
+        results[result_name("cli", "generate")] = measure(command("generate", "--length", "24"), repeat)
+
+    for size in sizes:
+        with scratch_dir() as tmp:
+            key, sites = build_vault(size, lengths, storage.VAULT_FILE, "salt.bin")
+            site = sites[len(sites) // 2]
+            with open("import.csv", "wb") as f:
+                f.write(import_csv(lengths))
+            master = ("--master", MASTER)
+
+            def put_victim():
+                storage.put_record(key, "bench-delete.example.com", {"username": "u", "password": "p"})
+
+            def to_log():
+                storage.migrate_vault(key, fmt=storage.FORMAT_LOG)
+                storage.put_record(key, site, {"username": "rewritten", "password": "p"})
+
+            benches = {
+                "list": (command("list", *master), None),
+                "get": (command("get", *master, "--site", site), None),
+                "search": (command("search", *master, "--query", site[:9]), None),
+                "add": (command("add", *master, "--site", "bench-add.example.com",
+                                "--username", "bench", "--password", "Bench-pw-1234"), None),
+                "edit": (command("edit", *master, "--site", site,
+                                 "--new_username", "edited", "--new_password", "Edited-pw-1234"), None),
+                "delete": (command("delete", *master, "--site", "bench-delete.example.com"), put_victim),
+                "export": (command("export", *master, "--format", "csv",
+                                   "--output", os.path.join(tmp, "export.csv")), None),
+                "import": (command("import", *master, "--on-conflict", "overwrite", "import.csv"), None),
+                "reindex": (command("reindex", *master), None),
+                "audit": (command("audit", "--tail", "50"), None),
+                "audit_verify": (command("audit", "verify", *master), None),
+                "kdf_status": (command("kdf", "status"), None),
+                "migrate": (command("migrate", *master, "--to", storage.FORMAT_LOG),
+                            lambda: storage.migrate_vault(key, fmt=storage.DEFAULT_FORMAT)),
+                "compact": (command("compact", *master), to_log),
+            }
+            for name, (fn, setup) in benches.items():
+                results[result_name("cli", name, size)] = measure(fn, repeat, setup)
+    return results
+
+
+# ---------------------
+# Web end-to-end timings
+# ---------------------
+
+def bench_web(sizes, repeat, lengths):
+    import pyotp
+
+    import audit
+    import flask_app
+    import storage
+    import tenants
+    from tenants import Tenant
+
+    def request(client, method, url, expect=200, **kwargs):
+        def send():
+            resp = client.open(url, method=method, **kwargs)
+            resp.get_data()  # streamed responses only do their work when read
+            if resp.status_code != expect:
+                raise RuntimeError(f"{method} {url} returned {resp.status_code}: {resp.get_data(as_text=True)}")
+        return send
+
+    def login(user):
+        client = flask_app.app.test_client()
+        request(client, "POST", "/", data={"username": user, "master": MASTER})()
+        code = pyotp.TOTP(Tenant.for_user(user).totp_secret()).now()
+        request(client, "POST", "/verify-2fa", data={"code": code})()
+        return client
+
+    def cold():
+        flask_app.key_cache.clear()
+        flask_app.vault_cache.clear()
+        storage.clear_cache()
+
+    results = {}
+    with scratch_dir() as tmp, patch.object(tenants, "TENANTS_DIR", tmp):
+        login("bench")
+        anonymous = flask_app.app.test_client()
+        results[result_name("web", "health")] = measure(request(anonymous, "GET", "/"), repeat)
+        results[result_name("web", "login")] = measure(
+            request(anonymous, "POST", "/", data={"username": "bench", "master": MASTER}), repeat)
+
+        csv_rows = import_csv(lengths)
+        for size in sizes:
+            user = f"bench-{size}"
+            tenant = Tenant.for_user(user)
+            os.makedirs(tenant.directory)
+            key, sites = build_vault(size, lengths, tenant.vault_file, tenant.salt_file)
+            site = sites[len(sites) // 2]
+            client = login(user)
+
+            def put_victim():
+                storage.put_record(key, "bench-delete.example.com", {"username": "u", "password": "p"},
+                                   tenant.vault_file)
+
+            def upload():
+                import io
+                return {"file": (io.BytesIO(csv_rows), "import.csv"), "on_conflict": "overwrite"}
+
+            benches = {
+                "credentials_cold": (request(client, "GET", "/api/credentials"), cold),
+                "credentials": (request(client, "GET", "/api/credentials"), None),
+                "credentials_search": (request(client, "GET", f"/api/credentials?q={site[:9]}"), None),
+                "credential": (request(client, "GET", f"/api/credentials/{site}"), None),
+                "add": (request(client, "POST", "/add-credential", json={
+                    "site": "bench-add.example.com", "username": "bench", "password": "Bench-pw-1234"}), None),
+                "edit": (request(client, "POST", f"/edit/{site}",
+                                 json={"username": "edited", "password": "Edited-pw-1234"}), None),
+                "delete": (request(client, "POST", "/delete/bench-delete.example.com"), put_victim),
+                "export": (request(client, "GET", "/export?format=csv"), None),
+                "audit": (request(client, "GET", "/api/audit"), None),
+            }
+            for name, (fn, setup) in benches.items():
+                results[result_name("web", name, size)] = measure(fn, repeat, setup)
+            # The upload is consumed by each request, so it is rebuilt per call
+            results[result_name("web", "import", size)] = measure(
+                lambda: request(client, "POST", "/api/import", data=upload())(), repeat)
+            audit.flush(log_file=tenant.audit_log)
+            cold()
+    return results
+
+
+BENCHMARKS = {"vault": bench_vault, "cli": bench_cli, "web": bench_web}
+
+
+# ---------------------
+# Results
+# ---------------------
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_suite(groups=GROUPS, sizes=DEFAULT_SIZES, repeat: int = DEFAULT_REPEAT, lengths: dict = None,
+              progress=None) -> dict:
+    lengths = lengths or {}
+    results = {}
+    for group in groups:
+        for name, stats in BENCHMARKS[group](sizes, repeat, lengths).items():
+            results[name] = stats
+            if progress:
+                progress(name, stats)
+    return {
+        "meta": {
+            "created": datetime.datetime.now().astimezone().isoformat(timespec="seconds"),
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "groups": [*groups],
+            "sizes": [*sizes],
+            "repeat": repeat,
+            "lengths": {"site": SITE_LENGTH, "username": USERNAME_LENGTH, "password": PASSWORD_LENGTH,
+                        **{k.removesuffix("_length"): v for k, v in lengths.items()}},
+        },
+        "results": results,
+    }
+
+
+def compare_results(baseline: dict, current: dict, threshold: float = DEFAULT_THRESHOLD,
+                    min_delta_ms: float = DEFAULT_MIN_DELTA_MS) -> list:
+    """
+    Compares two runs benchmark by benchmark on their medians. Returns rows of
+    (name, baseline ms, current ms, ratio, status); status is "regression",
+    "improved", "ok", "new" or "missing".
+    """
+    old, new = baseline["results"], current["results"]
+    rows = []
+    for name in sorted(old.keys() | new.keys()):
+        if name not in old:
+            rows.append((name, None, new[name]["median_ms"], None, "new"))
+            continue
+        if name not in new:
+            rows.append((name, old[name]["median_ms"], None, None, "missing"))
+            continue
+        before, after = old[name]["median_ms"], new[name]["median_ms"]
+        ratio = after / before if before else float("inf")
+        if ratio > 1 + threshold and after - before > min_delta_ms:
+            status = "regression"
+        elif ratio < 1 / (1 + threshold) and before - after > min_delta_ms:
+            status = "improved"
+        else:
+            status = "ok"
+        rows.append((name, before, after, ratio, status))
+    return rows
+
+
+def print_comparison(rows, threshold) -> int:
+    """Prints the comparison and returns the number of regressions."""
+    def ms(value):
+        return f"{value:>11.3f}" if value is not None else f"{'-':>11}"
+
+    print(f"{'benchmark':<40} {'baseline ms':>11} {'current ms':>11} {'change':>8}  status")
+    for name, before, after, ratio, status in rows:
+        change = f"{(ratio - 1) * 100:>+7.1f}%" if ratio is not None else f"{'':>8}"
+        print(f"{name:<40} {ms(before)} {ms(after)} {change}  {status}")
+    regressions = sum(status == "regression" for *_, status in rows)
+    print(f"\n{regressions} regression(s) beyond {threshold:.0%}.")
+    return regressions
+
+
+def load_results(path: str) -> dict:
+    with open(path) as f:
+        return json.load(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    run = sub.add_parser("run", help="Run the benchmarks and write the results as JSON.")
+    run.add_argument("--groups", nargs="+", choices=GROUPS, default=GROUPS)
+    run.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES,
+                     help="Synthetic vault sizes (1 to 1,000,000 entries).")
+    run.add_argument("--repeat", type=int, default=DEFAULT_REPEAT)
+    run.add_argument("--site-length", type=int, default=SITE_LENGTH)
+    run.add_argument("--username-length", type=int, default=USERNAME_LENGTH)
+    run.add_argument("--password-length", type=int, default=PASSWORD_LENGTH)
+    run.add_argument("--output", default="benchmark-results.json")
+    run.add_argument("--compare", metavar="BASELINE", default=None, help="Compare the results with a saved run.")
+    run.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+
+    cmp = sub.add_parser("compare", help="Compare two saved runs.")
+    cmp.add_argument("baseline")
+    cmp.add_argument("current")
+    cmp.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                     help="Slowdown that counts as a regression (0.2 = 20%%).")
+    cmp.add_argument("--min-delta-ms", type=float, default=DEFAULT_MIN_DELTA_MS,
+                     help="Ignore changes smaller than this many milliseconds.")
+    args = parser.parse_args()
+
+    if args.command == "compare":
+        rows = compare_results(load_results(args.baseline), load_results(args.current),
+                               args.threshold, args.min_delta_ms)
+        sys.exit(1 if print_comparison(rows, args.threshold) else 0)
+
+    # Relative paths are resolved before the benchmarks change directory
+    output = os.path.abspath(args.output)
+    lengths = {"site_length": args.site_length, "username_length": args.username_length,
+               "password_length": args.password_length}
+    print(f"{'benchmark':<40} {'median ms':>11} {'min ms':>11}")
+    report = run_suite(args.groups, args.sizes, args.repeat, lengths,
+                       progress=lambda name, s: print(f"{name:<40} {s['median_ms']:>11.3f} {s['min_ms']:>11.3f}"))
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults written to {output}")
+
+    if args.compare:
+        rows = compare_results(load_results(args.compare), report, args.threshold)
+        sys.exit(1 if print_comparison(rows, args.threshold) else 0)
+
+
+if __name__ == "__main__":
+    main()
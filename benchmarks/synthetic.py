@@ -0,0 +1,77 @@
+"""
+Deterministic synthetic vaults for the benchmarks.
+
+The same size, seed and field lengths always give the same vault, so
+timings from different runs (and machines) are measured on identical data.
+Run as a script to write an encrypted vault for manual testing:
+
+    python -m benchmarks.synthetic --size 100000 --master bench --output vault.json.enc
+"""
+import argparse
+import random
+import string
+
+SITE_LENGTH = 24
+USERNAME_LENGTH = 12
+PASSWORD_LENGTH = 16
+
+MIN_SIZE, MAX_SIZE = 1, 1_000_000
+
+_LOWER = string.ascii_lowercase
+_USERNAME = string.ascii_lowercase + string.digits
+_PASSWORD = string.ascii_letters + string.digits + "!@#$%^&*()-_=+"
+
+
+def _text(rng, alphabet, length):
+    return "".join(rng.choices(alphabet, k=length))
+
+
+def synthetic_entries(size: int, seed: int = 0, site_length: int = SITE_LENGTH,
+                      username_length: int = USERNAME_LENGTH, password_length: int = PASSWORD_LENGTH):
+    """Yields `size` (site, creds) pairs; sites are unique and in ascending order."""
+    if not MIN_SIZE <= size <= MAX_SIZE:
+        raise ValueError(f"Synthetic vaults have {MIN_SIZE}-{MAX_SIZE} entries.")
+    rng = random.Random(seed)
+    for i in range(size):
+        # The counter keeps sites unique; random letters pad them to the requested length
+        prefix = f"site-{i:07d}"
+        site = prefix + _text(rng, _LOWER, max(0, site_length - len(prefix))) + ".example.com"
+        yield site, {
+            "username": _text(rng, _USERNAME, username_length),
+            "password": _text(rng, _PASSWORD, password_length),
+        }
+
+
+def synthetic_vault(size: int, seed: int = 0, **lengths) -> dict:
+    return dict(synthetic_entries(size, seed, **lengths))
+
+
+def main():
+    import time
+
+    import storage
+    import vault
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--size", type=int, default=10_000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--site-length", type=int, default=SITE_LENGTH)
+    parser.add_argument("--username-length", type=int, default=USERNAME_LENGTH)
+    parser.add_argument("--password-length", type=int, default=PASSWORD_LENGTH)
+    parser.add_argument("--format", dest="fmt", choices=storage.FORMATS, default=storage.DEFAULT_FORMAT)
+    parser.add_argument("--master", required=True)
+    parser.add_argument("--output", default=storage.VAULT_FILE)
+    parser.add_argument("--salt", default=vault.SALT_FILE)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    data = synthetic_vault(args.size, args.seed, site_length=args.site_length,
+                           username_length=args.username_length, password_length=args.password_length)
+    key = vault.generate_key(args.master, args.salt)
+    storage.save_vault(data, key, args.output, args.fmt)
+    storage.reindex_vault(key, args.output)
+    print(f"Wrote {args.size} entries ({args.fmt}) to {args.output} in {time.perf_counter() - start:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,103 @@
 import click
 import traceback
-from vault import generate_key, encrypt_data, is_vault_locked, update_last_access
-from audit import log_action
+import storage
+from storage import VAULT_FILE
+import vault
+from vault import is_vault_locked, update_last_access, LOCK_TIMEOUT
+
+# Startup cost is paid on every invocation, so only what the command line
+# itself needs is imported here. The agent client, the audit log and
+# `cryptography` (see vault.py) are imported by the commands that use them;
+# `python -m benchmarks.bench_startup` checks the budget.
+__version__ = "0.1.0"
+
+def log_action(action, site=None, status="SUCCESS", note=""):
+    import audit
+    audit.log_action(action, site, status, note)
 
 @click.group()
-def cli():
+@click.version_option(__version__, prog_name="Credential Vault CLI")
+@click.option('--profile', is_flag=True, help="Print a per-stage timing breakdown after the command.")
+@click.pass_context
+def cli(ctx, profile):
     """Credential Vault CLI - Securely store, retrieve, and manage your passwords."""
-    pass
+    if profile:
+        import time
+        import metrics
+
+        metrics.registry.clear()
+        started = time.perf_counter()
+        ctx.call_on_close(lambda: click.echo("\n⏱️ Profile\n" + metrics.stage_report(time.perf_counter() - started),
+                                             err=True))
+
+# ---------------------
+# UNLOCK HELPERS
+# ---------------------
+def master_option(f):
+    """--master is only prompted for when no vault agent is running."""
+    return click.option('--master', default=None, hide_input=True,
+                        help="Master password (not needed while `agent` is running).")(f)
+
+def resolve_key(master):
+    """Returns the vault key, taking it from the running agent before paying for the KDF."""
+    import agent
+    import audit as audit_log
+
+    key, proven = None, False
+    if master is None:
+        reply = agent.request("key")
+        if reply and reply.get("ok"):
+            key = reply["key"].encode()
+        else:
+            master = click.prompt("Master", hide_input=True)
+    if key is None:
+        outdated = vault.kdf_outdated()
+        key = storage.unlock(master)
+        if outdated and not vault.kdf_outdated():
+            click.echo("🔁 Vault re-keyed to this host's KDF parameters.")
+            log_action("REKEY", note=_kdf_summary(vault.target_kdf()))
+            # An agent still holding the old key can no longer open the vault
+            if agent.request("stop"):
+                click.echo("🔒 Vault agent stopped; start it again to use the new key.")
+        # Unwrapping the data key has already proven the password
+        proven = "dek" in (vault.read_kdf_header() or {})
+    # Only a key that opens the vault may sign audit entries, or a typo would break the chain
+    if proven or storage.check_key(key):
+        audit_log.use_vault_key(key)
+    return key
+
+def _kdf_summary(params: dict) -> str:
+    return " ".join(f"{name}={value}" for name, value in params.items())
+
+def open_vault(master):
+    """Returns the decrypted vault, served from the agent's memory when it is running."""
+    import agent
+
+    if master is None:
+        reply = agent.request("dump")
+        if reply and reply.get("ok"):
+            return reply["data"]
+    return storage.load_vault(resolve_key(master))
+
+def iter_records(master):
+    """Yields (site, creds) one at a time, from the agent when it is running."""
+    import agent
+
+    if master is None:
+        reply = agent.request("dump")
+        if reply and reply.get("ok"):
+            return iter(reply["data"].items())
+    return storage.iter_vault(resolve_key(master))
+
+def lookup(master, site):
+    """Returns the credentials for one site (or None), decrypting only that record."""
+    import agent
+
+    if master is None:
+        reply = agent.request("get", site=site)
+        if reply and reply.get("ok"):
+            return reply["creds"]
+    return storage.get_record(resolve_key(master), site)
 
 # ---------------------
 # INIT COMMAND
@@ -16,18 +107,18 @@ def cli():
 def init(master):
     """Initialize a new encrypted credential vault."""
     import os
+    import audit as audit_log
 
-    if os.path.exists("vault.json.enc"):
+    if os.path.exists(VAULT_FILE):
         update_last_access()
         click.echo("✅ Vault already exists. Session refreshed.")
         log_action("INIT", status="REFRESHED", note="Vault already existed")
         return
 
-    key = generate_key(master)
-    encrypted = encrypt_data({}, key)
-
-    with open("vault.json.enc", "wb") as f:
-        f.write(encrypted)
+    key = storage.unlock(master)  # a new vault gets a random data key, wrapped by the master password
+    storage.save_vault({}, key)
+    storage.reindex_vault(key)
+    audit_log.use_vault_key(key)
 
     update_last_access()
     click.echo("🔐 Vault initialized and encrypted!")
@@ -37,34 +128,26 @@ def init(master):
 # ADD COMMAND
 # ---------------------
 @cli.command()
-@click.option('--master', prompt=True, hide_input=True)
+@master_option
 @click.option('--site', prompt="Site")
 @click.option('--username', prompt="Username")
 @click.option('--password', prompt="Password", hide_input=True, confirmation_prompt=True)
 def add(master, site, username, password):
     """Add new credentials for a website to your encrypted vault."""
-    from vault import encrypt_data, decrypt_data, check_password_strength
-    import os
-
-    key = generate_key(master)
+    from vault import check_password_strength
 
     try:
-        with open("vault.json.enc", "rb") as f:
-            encrypted_data = f.read()
-        data = decrypt_data(encrypted_data, key)
+        key = resolve_key(master)
 
         if is_vault_locked():
             click.echo("🔒 Vault session expired. Session refreshed.")
         else:
             click.echo("🔓 Vault unlocked.")
 
-        data[site] = {
+        storage.put_record(key, site, {
             "username": username,
             "password": password
-        }
-
-        with open("vault.json.enc", "wb") as f:
-            f.write(encrypt_data(data, key))
+        })
 
         strength = check_password_strength(password)
         click.echo(f"✅ Credentials for '{site}' added to vault!")
@@ -81,31 +164,23 @@ def add(master, site, username, password):
 # GET COMMAND
 # ---------------------
 @cli.command()
-@click.option('--master', prompt=True, hide_input=True)
+@master_option
 @click.option('--site', prompt="Site")
 def get(master, site):
     """Retrieve credentials for a given site."""
-    from vault import decrypt_data
-    import os
-
-    key = generate_key(master)
-
     try:
-        with open("vault.json.enc", "rb") as f:
-            encrypted_data = f.read()
-        data = decrypt_data(encrypted_data, key)
+        creds = lookup(master, site)
 
         if is_vault_locked():
             click.echo("🔒 Vault session expired. Session refreshed.")
         else:
             click.echo("🔓 Vault unlocked.")
 
-        if site not in data:
+        if creds is None:
             click.echo(f"❌ No credentials found for '{site}'.")
             log_action("GET", site=site, status="FAILURE", note="Site not found")
             return
 
-        creds = data[site]
         click.echo("🔍 Credentials found:")
         click.echo(f"  👤 Username: {creds['username']}")
         click.echo(f"  🔑 Password: {creds['password']}")
@@ -121,18 +196,11 @@ def get(master, site):
 # LIST COMMAND
 # ---------------------
 @cli.command()
-@click.option('--master', prompt=True, hide_input=True)
+@master_option
 def list(master):
     """List all stored sites in your vault."""
-    from vault import decrypt_data
-    import os
-
-    key = generate_key(master)
-
     try:
-        with open("vault.json.enc", "rb") as f:
-            encrypted_data = f.read()
-        data = decrypt_data(encrypted_data, key)
+        data = open_vault(master)
 
         if is_vault_locked():
             click.echo("🔒 Vault session expired. Session refreshed.")
@@ -158,35 +226,23 @@ def list(master):
 # DELETE COMMAND
 # ---------------------
 @cli.command()
-@click.option('--master', prompt=True, hide_input=True)
+@master_option
 @click.option('--site', prompt="Site")
 def delete(master, site):
     """Delete credentials for a given site."""
-    from vault import encrypt_data, decrypt_data
-    import os
-
-    key = generate_key(master)
-
     try:
-        with open("vault.json.enc", "rb") as f:
-            encrypted_data = f.read()
-        data = decrypt_data(encrypted_data, key)
+        key = resolve_key(master)
 
         if is_vault_locked():
             click.echo("🔒 Vault session expired. Session refreshed.")
         else:
             click.echo("🔓 Vault unlocked.")
 
-        if site not in data:
+        if not storage.delete_record(key, site):
             click.echo(f"❌ No credentials found for '{site}'.")
             log_action("DELETE", site=site, status="FAILURE", note="Site not found")
             return
 
-        del data[site]
-
-        with open("vault.json.enc", "wb") as f:
-            f.write(encrypt_data(data, key))
-
         click.echo(f"🗑️ Credentials for '{site}' deleted from vault.")
         update_last_access()
         log_action("DELETE", site=site)
@@ -200,32 +256,26 @@ def delete(master, site):
 # COPY COMMAND
 # ---------------------
 @cli.command()
-@click.option('--master', prompt=True, hide_input=True)
+@master_option
 @click.option('--site', prompt="Site")
 def copy(master, site):
     """Copy a password to the clipboard for a given site."""
-    from vault import decrypt_data
     import pyperclip
-    import os
-
-    key = generate_key(master)
 
     try:
-        with open("vault.json.enc", "rb") as f:
-            encrypted_data = f.read()
-        data = decrypt_data(encrypted_data, key)
+        creds = lookup(master, site)
 
         if is_vault_locked():
             click.echo("🔒 Vault session expired. Session refreshed.")
         else:
             click.echo("🔓 Vault unlocked.")
 
-        if site not in data:
+        if creds is None:
             click.echo(f"❌ No credentials found for '{site}'.")
             log_action("COPY", site=site, status="FAILURE", note="Site not found")
             return
 
-        pyperclip.copy(data[site]["password"])
+        pyperclip.copy(creds["password"])
         click.echo(f"📋 Password for '{site}' copied to clipboard!")
         update_last_access()
         log_action("COPY", site=site)
@@ -239,38 +289,44 @@ def copy(master, site):
 # EXPORT COMMAND
 # ---------------------
 @cli.command()
-@click.option('--master', prompt=True, hide_input=True)
-def export(master):
-    """Export all credentials to a plaintext file."""
-    from vault import decrypt_data
+@master_option
+@click.option('--format', 'fmt', type=click.Choice(["txt", "csv", "ndjson", "encrypted"]),
+              default="txt", show_default=True)
+@click.option('--output', default=None, help="Output file (default: vault_export.<format>).")
+@click.option('--passphrase', default=None, hide_input=True, help="Passphrase for --format encrypted.")
+def export(master, fmt, output, passphrase):
+    """Export all credentials to a plaintext or encrypted file."""
+    import itertools
     import os
-
-    key = generate_key(master)
+    import exporter
 
     try:
-        with open("vault.json.enc", "rb") as f:
-            encrypted_data = f.read()
-        data = decrypt_data(encrypted_data, key)
+        records = iter_records(master)
+        first = next(records, None)
 
         if is_vault_locked():
             click.echo("🔒 Vault session expired. Session refreshed.")
         else:
             click.echo("🔓 Vault unlocked.")
 
-        if not data:
+        if first is None:
             click.echo("⚠️ Vault is empty. Nothing to export.")
             log_action("EXPORT", status="SKIPPED", note="Vault was empty")
             return
 
-        with open("vault_export.txt", "w", encoding="utf-8") as f:
-            for site, creds in data.items():
-                f.write(f"Site: {site}\n")
-                f.write(f"  Username: {creds['username']}\n")
-                f.write(f"  Password: {creds['password']}\n\n")
+        if fmt == "encrypted" and not passphrase:
+            passphrase = click.prompt("Export passphrase", hide_input=True, confirmation_prompt=True)
+        output = output or f"vault_export.{exporter.EXTENSIONS[fmt]}"
 
-        click.echo("✅ Vault successfully exported to 'vault_export.txt'.")
+        # Written chunk by chunk as records are decrypted; owner-only since it may be plaintext
+        fd = os.open(output, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "wb", buffering=exporter.BATCH_SIZE) as f:
+            for chunk in exporter.export_chunks(itertools.chain([first], records), fmt, passphrase):
+                f.write(chunk)
+
+        click.echo(f"✅ Vault successfully exported to '{output}'.")
         update_last_access()
-        log_action("EXPORT")
+        log_action("EXPORT", note=f"Format={fmt}")
 
     except Exception as e:
         click.echo(f"❌ Error: {e}")
@@ -285,13 +341,10 @@ def export(master):
 @click.option('--copy', is_flag=True, help="Copy password to clipboard")
 def generate(length, copy):
     """Generate a secure random password."""
-    import string
-    import secrets
     import pyperclip
-    from vault import check_password_strength
+    from vault import check_password_strength, generate_password
 
-    chars = string.ascii_letters + string.digits + string.punctuation
-    password = ''.join(secrets.choice(chars) for _ in range(length))
+    password = generate_password(length)
 
     click.echo(f"🔐 Generated Password: {password}")
     click.echo(f"🧠 Password Strength: {check_password_strength(password)}")
@@ -306,42 +359,39 @@ def generate(length, copy):
 # EDIT COMMAND
 # ---------------------
 @cli.command()
-@click.option('--master', prompt=True, hide_input=True)
+@master_option
 @click.option('--site', prompt="Site")
 @click.option('--new_username', prompt="New Username", default="", show_default=False)
 @click.option('--new_password', prompt="New Password", hide_input=True, confirmation_prompt=True, default="", show_default=False)
 def edit(master, site, new_username, new_password):
     """Edit credentials for a site."""
-    from vault import encrypt_data, decrypt_data, check_password_strength
-    import os
-
-    key = generate_key(master)
+    from vault import check_password_strength
 
     try:
-        with open("vault.json.enc", "rb") as f:
-            encrypted_data = f.read()
-        data = decrypt_data(encrypted_data, key)
+        key = resolve_key(master)
 
         if is_vault_locked():
             click.echo("🔒 Vault session expired. Session refreshed.")
         else:
             click.echo("🔓 Vault unlocked.")
 
-        if site not in data:
-            click.echo(f"❌ No credentials found for '{site}'.")
-            log_action("EDIT", site=site, status="FAILURE", note="Site not found")
-            return
+        # Hold the write lock across read-modify-write so a concurrent edit isn't lost
+        with storage.vault_lock(exclusive=True):
+            creds = storage.get_record(key, site)
+            if creds is None:
+                click.echo(f"❌ No credentials found for '{site}'.")
+                log_action("EDIT", site=site, status="FAILURE", note="Site not found")
+                return
 
-        if new_username:
-            data[site]["username"] = new_username
+            if new_username:
+                creds["username"] = new_username
 
-        if new_password:
-            data[site]["password"] = new_password
-            strength = check_password_strength(new_password)
-            click.echo(f"🧠 New Password Strength: {strength}")
+            if new_password:
+                creds["password"] = new_password
+                strength = check_password_strength(new_password)
+                click.echo(f"🧠 New Password Strength: {strength}")
 
-        with open("vault.json.enc", "wb") as f:
-            f.write(encrypt_data(data, key))
+            storage.put_record(key, site, creds)
 
         click.echo(f"✏️ Credentials for '{site}' updated.")
         update_last_access()
@@ -356,19 +406,20 @@ def edit(master, site, new_username, new_password):
 # SEARCH COMMAND
 # ---------------------
 @cli.command()
-@click.option('--master', prompt=True, hide_input=True)
+@master_option
 @click.option('--query', prompt="Search query")
 def search(master, query):
     """Search for sites in the vault matching a query."""
-    from vault import decrypt_data
-    import os
-
-    key = generate_key(master)
+    import agent
 
     try:
-        with open("vault.json.enc", "rb") as f:
-            encrypted_data = f.read()
-        data = decrypt_data(encrypted_data, key)
+        matches = None
+        if master is None:
+            reply = agent.request("dump")
+            if reply and reply.get("ok"):
+                matches = {site: creds for site, creds in reply["data"].items() if query.lower() in site.lower()}
+        if matches is None:
+            matches = storage.search_records(resolve_key(master), query)
 
         if is_vault_locked():
             click.echo("🔒 Vault session expired. Session refreshed.")
@@ -377,7 +428,6 @@ def search(master, query):
 
         update_last_access()
 
-        matches = {site: creds for site, creds in data.items() if query.lower() in site.lower()}
         if not matches:
             click.echo("🔎 No matches found.")
             log_action("SEARCH", status="SKIPPED", note=f"Query: '{query}' — No matches found")
@@ -386,8 +436,8 @@ def search(master, query):
         click.echo("🔍 Matching Results:")
         for site, creds in matches.items():
             click.echo(f"  🌐 Site: {site}")
-            click.echo(f"     👤 Username: {creds['username']}")
-            click.echo(f"     🔑 Password: {creds['password']}\n")
+            click.echo(f"     👤 Username: {creds['username']}\n")
+        click.echo("💡 Use `get` or `copy` to retrieve a password.")
         log_action("SEARCH", note=query)
 
     except Exception as e:
@@ -396,6 +446,289 @@ def search(master, query):
         # log_action("SEARCH", note=query, status="FAILURE", note=str(e))
         log_action("SEARCH", status="FAILURE", note=f"Query: '{query}' — Error: {e}")
 
+# ---------------------
+# REINDEX COMMAND
+# ---------------------
+@cli.command()
+@master_option
+@click.option('--usernames/--no-usernames', default=None,
+              help="Also index usernames (default: keep the current setting).")
+def reindex(master, usernames):
+    """Rebuild the encrypted search index from scratch."""
+    try:
+        fields = None if usernames is None else ["site", "username"] if usernames else ["site"]
+        count = storage.reindex_vault(resolve_key(master), fields=fields)
+        click.echo(f"🗂️ Search index rebuilt for {count} entries.")
+        log_action("REINDEX", note=f"Entries={count}")
+
+    except Exception as e:
+        click.echo(f"❌ Error: {e}")
+        traceback.print_exc()
+        log_action("REINDEX", status="FAILURE", note=str(e))
+
+# ---------------------
+# IMPORT COMMAND
+# ---------------------
+@cli.command(name="import")
+@master_option
+@click.option('--format', 'fmt', type=click.Choice(["csv", "json", "bitwarden-json", "keepass-csv"]),
+              default="csv", show_default=True)
+@click.option('--on-conflict', type=click.Choice(["skip", "overwrite", "rename"]),
+              default="skip", show_default=True, help="What to do when a site already exists.")
+@click.argument('file', type=click.File('r', encoding='utf-8-sig'))
+def import_(master, fmt, on_conflict, file):
+    """Import credentials from a CSV/JSON export in a single write."""
+    import importer
+
+    try:
+        report = importer.import_credentials(resolve_key(master), file, fmt, on_conflict)
+
+        click.echo(f"📥 Imported {report.imported} entries "
+                   f"({report.overwritten} overwritten, {report.renamed} renamed, {report.skipped} skipped) "
+                   f"in {report.seconds:.2f}s — {report.rows_per_second:.0f} rows/s.")
+        if report.rejected:
+            click.echo(f"⚠️ Rejected {len(report.rejected)} rows:")
+            for row, reason in report.rejected:
+                click.echo(f"  - row {row}: {reason}")
+        update_last_access()
+        log_action("IMPORT", note=f"Format={fmt} Imported={report.imported} Rejected={len(report.rejected)}")
+
+    except Exception as e:
+        click.echo(f"❌ Error: {e}")
+        traceback.print_exc()
+        log_action("IMPORT", status="FAILURE", note=str(e))
+
+# ---------------------
+# MIGRATE COMMAND
+# ---------------------
+@cli.command()
+@master_option
+@click.option('--to', 'fmt', type=click.Choice(storage.FORMATS),
+              default=storage.DEFAULT_FORMAT, show_default=True, help="Target vault format.")
+def migrate(master, fmt):
+    """Convert the vault file to another storage format."""
+    try:
+        old_fmt = storage.migrate_vault(resolve_key(master), fmt=fmt)
+        if old_fmt == fmt:
+            click.echo(f"ℹ️ Vault is already in {fmt} format.")
+            return
+        click.echo(f"✅ Vault migrated from {old_fmt} to {fmt}.")
+        log_action("MIGRATE", note=f"{old_fmt} -> {fmt}")
+
+    except Exception as e:
+        click.echo(f"❌ Error: {e}")
+        traceback.print_exc()
+        log_action("MIGRATE", status="FAILURE", note=str(e))
+
+# ---------------------
+# COMPACT COMMAND
+# ---------------------
+@cli.command()
+@master_option
+def compact(master):
+    """Rewrite a log-structured vault without its overwritten and deleted records."""
+    try:
+        result = storage.compact_vault(resolve_key(master))
+        if result is None:
+            click.echo("ℹ️ Only log-structured vaults need compaction.")
+            return
+        before, after = result
+        click.echo(f"🧹 Vault compacted: {before} → {after} bytes.")
+        log_action("COMPACT", note=f"{before} -> {after} bytes")
+
+    except Exception as e:
+        click.echo(f"❌ Error: {e}")
+        traceback.print_exc()
+        log_action("COMPACT", status="FAILURE", note=str(e))
+
+# ---------------------
+# MASTER PASSWORD & DATA KEY COMMANDS
+# ---------------------
+@cli.command()
+@click.option('--master', prompt="Current master", hide_input=True)
+@click.option('--new-master', prompt="New master", hide_input=True, confirmation_prompt=True)
+def passwd(master, new_master):
+    """Change the master password; the vault is not re-encrypted."""
+    import os
+    import tenants
+
+    try:
+        storage.change_master_password(master, new_master)
+        # The web app's single-user login checks the same password
+        if os.path.exists(tenants.MASTER_HASH_FILE):
+            tenants.Tenant.legacy().set_master_password(new_master)
+    except Exception as e:
+        click.echo(f"❌ Error: {e}")
+        log_action("PASSWD", status="FAILURE", note=str(e))
+        return
+
+    click.echo("🔑 Master password changed.")
+    click.echo(f"🧠 New Password Strength: {vault.check_password_strength(new_master)}")
+    if vault.read_kdf_header().get("derived"):
+        click.echo("⚠️ The vault is still encrypted with a key the old password derived; "
+                   "run `rotate-dek` if that password may be known to someone else.")
+    log_action("PASSWD")
+
+@cli.command(name="rotate-dek")
+@click.option('--master', prompt=True, hide_input=True)
+@click.option('--batch-size', type=int, default=storage.ROTATE_BATCH, show_default=True,
+              help="Records re-encrypted between checkpoints.")
+def rotate_dek(master, batch_size):
+    """Re-encrypt the vault under a new random data key; an interrupted run resumes where it stopped."""
+    import agent
+    import audit as audit_log
+
+    try:
+        key, count = storage.rotate_data_key(master, batch_size=batch_size,
+                                             progress=lambda done: click.echo(f"  🔁 {done} records re-encrypted..."))
+    except Exception as e:
+        click.echo(f"❌ Error: {e}")
+        traceback.print_exc()
+        log_action("ROTATE_DEK", status="FAILURE", note=str(e))
+        return
+
+    audit_log.use_vault_key(key)
+    click.echo(f"✅ Vault re-encrypted under a new data key ({count} records).")
+    log_action("ROTATE_DEK", note=f"{count} records")
+    # An agent still holding the old key can no longer open the vault
+    if agent.request("stop"):
+        click.echo("🔒 Vault agent stopped; start it again to use the new key.")
+
+# ---------------------
+# SHELL & BATCH COMMANDS
+# ---------------------
+@cli.command()
+@master_option
+def shell(master):
+    """Unlock once and run many commands against the vault in memory."""
+    import shell as vault_shell
+
+    try:
+        session = vault_shell.VaultSession(resolve_key(master))
+    except Exception as e:
+        click.echo(f"❌ Error: {e}")
+        log_action("SHELL", status="FAILURE", note=str(e))
+        return
+    update_last_access()
+    log_action("SHELL")
+    # After an idle lock, the password is asked for again even if an agent is running
+    unlock = lambda: resolve_key(click.prompt("Master", hide_input=True))
+    vault_shell.VaultShell(session, unlock=unlock).cmdloop()
+
+@cli.command()
+@master_option
+@click.option('--keep-going', is_flag=True, help="Run the remaining lines after a failure and save what succeeded.")
+@click.argument('script', type=click.File('r'), default='-')
+def batch(master, keep_going, script):
+    """Run shell commands from SCRIPT (or stdin) and save their changes in one write."""
+    import agent
+    import shell as vault_shell
+
+    if master is None and script.name == "<stdin>" and not agent.request("status"):
+        click.echo("❌ Error: the script is read from stdin, so pass --master or start the agent.")
+        raise SystemExit(1)
+    try:
+        session = vault_shell.VaultSession(resolve_key(master))
+        ok = vault_shell.run_batch(session, script, keep_going)
+    except Exception as e:
+        click.echo(f"❌ Error: {e}")
+        log_action("BATCH", status="FAILURE", note=str(e))
+        raise SystemExit(1)
+    update_last_access()
+    log_action("BATCH", status="SUCCESS" if ok else "FAILURE")
+    if not ok:
+        raise SystemExit(1)
+
+# ---------------------
+# AGENT COMMANDS
+# ---------------------
+@cli.group(name="agent")
+def agent_group():
+    """Keep the vault unlocked in a background agent (like ssh-agent)."""
+    pass
+
+@agent_group.command(name="start")
+@click.option('--master', prompt=True, hide_input=True)
+def agent_start(master):
+    """Unlock the vault once and serve it to later commands."""
+    import agent
+
+    if agent.request("status"):
+        click.echo("ℹ️ Vault agent is already running.")
+        return
+
+    try:
+        key = storage.unlock(master)
+        storage.load_vault(key)
+        pid = agent.start(key, idle_timeout=LOCK_TIMEOUT)
+    except Exception as e:
+        click.echo(f"❌ Error: {e}")
+        log_action("AGENT_START", status="FAILURE", note=str(e))
+        return
+
+    click.echo(f"🕵️ Vault agent started (pid {pid}), locks after {LOCK_TIMEOUT}s idle.")
+    log_action("AGENT_START", note=f"pid={pid}")
+
+@agent_group.command(name="stop")
+def agent_stop():
+    """Stop the agent and forget the key."""
+    import agent
+
+    if agent.request("stop"):
+        click.echo("🔒 Vault agent stopped.")
+        log_action("AGENT_STOP")
+    else:
+        click.echo("ℹ️ Vault agent is not running.")
+
+@agent_group.command(name="status")
+def agent_status():
+    """Show whether the agent is running."""
+    import agent
+
+    reply = agent.request("status")
+    if not reply:
+        click.echo("ℹ️ Vault agent is not running.")
+        return
+    click.echo(f"🕵️ Vault agent running (pid {reply['pid']}) with {reply['entries']} entries.")
+
+# ---------------------
+# KDF COMMANDS
+# ---------------------
+@cli.group()
+def kdf():
+    """Tune the key derivation cost for this host."""
+    pass
+
+@kdf.command()
+@click.option('--target-ms', type=float, default=250, show_default=True,
+              help="Time one unlock may spend deriving the key.")
+@click.option('--algorithm', type=click.Choice(vault.KDFS), default=vault.KDF_PBKDF2, show_default=True)
+@click.option('--dry-run', is_flag=True, help="Only print the parameters.")
+def calibrate(target_ms, algorithm, dry_run):
+    """Measure this host and pick the KDF parameters for new and re-keyed vaults."""
+    params, measured = vault.calibrate_kdf(target_ms, algorithm)
+    click.echo(f"⏱️ {_kdf_summary(params)} takes {measured:.0f} ms here (target {target_ms:.0f} ms).")
+    if measured > target_ms * 1.5:
+        click.echo("⚠️ This host is slower than the target allows at the minimum safe cost.")
+    if dry_run:
+        return
+    vault.save_target_kdf(params)
+    click.echo(f"✅ Saved to {vault.KDF_CONFIG_FILE}; the vault is re-keyed at its next unlock.")
+    log_action("KDF_CALIBRATE", note=_kdf_summary(params))
+
+@kdf.command(name="status")
+def kdf_status():
+    """Show the vault's KDF parameters and the ones this host wants."""
+    header = vault.read_kdf_header()
+    target = vault.target_kdf()
+    click.echo(f"🎯 Configured: {_kdf_summary(target)}")
+    if header is None:
+        click.echo("ℹ️ No vault yet.")
+        return
+    click.echo(f"🔑 Vault:      {_kdf_summary(header['kdf'])}")
+    if header["kdf"] != target:
+        click.echo("🔁 The vault will be re-keyed at its next unlock.")
+
 # ---------------------
 # HELP ENTRY
 # ---------------------
@@ -403,19 +736,89 @@ def search(master, query):
 @cli.command()
 def help():
     """Show available commands."""
-    import subprocess
-    subprocess.run(["python", "cli.py", "--help"])
+    click.echo(click.get_current_context().parent.get_help())
 
 # ---------------------
 # AUDIT LOG VIEW COMMAND
 # ---------------------
-@cli.command()
-def audit():
+@cli.group(invoke_without_command=True)
+@click.option('--since', default=None, help="Only events at or after this ISO date/time (local time).")
+@click.option('--until', default=None, help="Only events at or before this ISO date/time (local time).")
+@click.option('--action', default=None, help="Only this action, e.g. ADD or DELETE.")
+@click.option('--site', default=None, help="Only events for this site.")
+@click.option('--tail', 'tail', type=int, default=None, help="Show only the last N matching events.")
+@click.option('--follow', is_flag=True, help="Keep printing new events as they are logged.")
+@click.pass_context
+def audit(ctx, since, until, action, site, tail, follow):
     """View the audit log."""
-    from vault import read_audit_log
+    import audit as audit_log
+
+    if ctx.invoked_subcommand is not None:
+        return
     log_action("AUDIT_VIEW")
+    audit_log.flush()
+
+    try:
+        filters = {
+            "since": audit_log.parse_time(since) if since else None,
+            "until": audit_log.parse_time(until) if until else None,
+            "action": action,
+            "site": site,
+        }
+    except ValueError as e:
+        click.echo(f"❌ Invalid date: {e}")
+        return
+
     click.echo("📜 Audit Log:\n")
-    click.echo(read_audit_log())
+    if tail is not None:
+        events = audit_log.tail_events(tail, **filters)
+    else:
+        events = (event for _, event in audit_log.iter_events(**filters))
+
+    shown = 0
+    for event in events:
+        click.echo(audit_log.format_text(event))
+        shown += 1
+    if not shown and not follow:
+        click.echo("No audit log entries found.")
+
+    if follow:
+        try:
+            for event in audit_log.follow_events(**filters):
+                click.echo(audit_log.format_text(event))
+        except KeyboardInterrupt:
+            pass
+
+@audit.command()
+@master_option
+@click.option('--full', is_flag=True, help="Rehash the whole chain instead of starting at the latest checkpoint.")
+def verify(master, full):
+    """Check the audit log's hash chain for tampering."""
+    import audit as audit_log
+
+    key = resolve_key(master)
+    audit_log.flush()
+    # Entries from before a re-key are keyed from the old KDF parameters
+    previous = vault.previous_keys(master) if master else []
+    report = audit_log.verify_chain(key, full=full, previous_keys=previous)
+
+    if report["ok"]:
+        start = f"checkpoint #{report['from']}" if report["from"] else "the first entry"
+        click.echo(f"✅ Audit chain intact: {report['checked']} entries verified from {start}.")
+        if report["pending"]:
+            click.echo(f"ℹ️ {report['pending']} entries logged without the vault key are not chained yet.")
+        if report["legacy"]:
+            click.echo(f"ℹ️ {report['legacy']} older entries predate the chain and can't be verified.")
+        log_action("AUDIT_VERIFY", note=f"Entries={report['checked']} Full={full}")
+        return
+
+    at = report["at"]
+    where = f" at entry {at['n']} (segment {at['segment']}, line {at['line']})" if at and at["n"] else (
+        f" (segment {at['segment']}, line {at['line']})" if at else "")
+    click.echo(f"❌ Audit chain broken{where}: {report['error']}")
+    log_action("AUDIT_VERIFY", status="FAILURE", note=report["error"])
+    audit_log.flush()
+    raise SystemExit(1)
 
 # ---------------------
 # MAIN ENTRY
@@ -0,0 +1,146 @@
+import math
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+
+# Password hashing and key derivation run here instead of on request threads,
+# so a burst of logins can't tie up every thread the web server has.
+# bcrypt, PBKDF2 and scrypt release the GIL, so threads are enough unless
+# a deployment prefers processes.
+CRYPTO_POOL = os.environ.get("CRYPTO_POOL", "thread")
+CRYPTO_WORKERS = int(os.environ.get("CRYPTO_WORKERS", str(min(4, os.cpu_count() or 1))))
+CRYPTO_QUEUE = int(os.environ.get("CRYPTO_QUEUE", "16"))
+CRYPTO_TIMEOUT = float(os.environ.get("CRYPTO_TIMEOUT", "10"))
+
+POOL_KINDS = ["thread", "process"]
+
+
+class PoolBusy(Exception):
+    """The pool is full, or a job waited longer than its timeout; try again after `retry_after` seconds."""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def _timed(fn, args, kwargs):
+    # Runs in the worker: reports when the job left the queue, for the wait-time stats
+    started = time.monotonic()
+    return started, fn(*args, **kwargs)
+
+
+class CryptoPool:
+    """
+    A bounded pool for CPU-heavy crypto.
+
+    At most `workers` jobs run at once and `max_queue` more may wait; `run`
+    refuses anything beyond that straight away with PoolBusy rather than
+    letting callers pile up. A job not finished within `timeout` seconds also
+    raises PoolBusy (it is cancelled if it never started).
+    """
+
+    def __init__(self, workers: int = CRYPTO_WORKERS, max_queue: int = CRYPTO_QUEUE,
+                 timeout: float = CRYPTO_TIMEOUT, kind: str = CRYPTO_POOL):
+        if kind not in POOL_KINDS:
+            raise ValueError(f"Unknown crypto pool kind: {kind}")
+        self.workers = workers
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.kind = kind
+        self.submitted = 0
+        self.completed = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self._depth = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._run_avg = 0.0
+        self._lock = threading.Lock()
+        self._pid = None
+        self._executor = None
+
+    def _ensure_started(self):
+        # A forked gunicorn worker inherits the executor object but none of its workers
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            if self.kind == "process":
+                self._executor = ProcessPoolExecutor(self.workers)
+            else:
+                self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix="crypto")
+            self._pid = os.getpid()
+
+    def retry_after(self) -> int:
+        """Seconds until a slot is likely free, from the average job time and the current depth."""
+        with self._lock:
+            return max(1, math.ceil(self._run_avg * self._depth / self.workers))
+
+    def run(self, fn, *args, **kwargs):
+        """Runs `fn(*args, **kwargs)` on the pool and returns its result (or raises its exception)."""
+        self._ensure_started()
+        with self._lock:
+            if self._depth >= self.workers + self.max_queue:
+                self.rejected += 1
+                full = True
+            else:
+                self._depth += 1
+                self.submitted += 1
+                full = False
+        if full:
+            raise PoolBusy("Too many requests are waiting for the crypto pool.", self.retry_after())
+
+        enqueued = time.monotonic()
+        try:
+            future = self._executor.submit(_timed, fn, args, kwargs)
+        except BaseException:
+            self._finished()
+            raise
+        future.add_done_callback(lambda f: self._finished(enqueued, f))
+        try:
+            started, result = future.result(self.timeout)
+        except FutureTimeout:
+            future.cancel()
+            with self._lock:
+                self.timeouts += 1
+            raise PoolBusy("Timed out waiting for the crypto pool.", self.retry_after())
+        return result
+
+    def _finished(self, enqueued: float = None, future=None):
+        finished = time.monotonic()
+        with self._lock:
+            self._depth -= 1
+            if future is None or future.cancelled() or future.exception() is not None:
+                return
+            started, _ = future.result()
+            waited, ran = started - enqueued, finished - started
+            self.completed += 1
+            self._wait_total += waited
+            self._wait_max = max(self._wait_max, waited)
+            # Moving average, so Retry-After follows the current cost of a job
+            self._run_avg = ran if self.completed == 1 else 0.8 * self._run_avg + 0.2 * ran
+
+    def shutdown(self):
+        if self._executor is not None and self._pid == os.getpid():
+            self._executor.shutdown(cancel_futures=True)
+        self._pid = None
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "kind": self.kind,
+                "workers": self.workers,
+                "max_queue": self.max_queue,
+                "depth": self._depth,
+                "queued": max(0, self._depth - self.workers),
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "timeouts": self.timeouts,
+                "wait_ms_avg": round(self._wait_total / self.completed * 1000, 3) if self.completed else 0.0,
+                "wait_ms_max": round(self._wait_max * 1000, 3),
+                "run_ms_avg": round(self._run_avg * 1000, 3),
+            }
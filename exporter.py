@@ -0,0 +1,120 @@
+import csv
+import io
+import json
+import os
+import struct
+
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+
+import streamcrypt
+from vault import ITERATIONS
+
+FORMATS = ["txt", "csv", "ndjson", "encrypted"]
+EXTENSIONS = {"txt": "txt", "csv": "csv", "ndjson": "ndjson", "encrypted": "vaultexport"}
+MIMETYPES = {"txt": "text/plain", "csv": "text/csv", "ndjson": "application/x-ndjson",
+             "encrypted": "application/octet-stream"}
+
+# Encrypted exports: "CVEX" | version | PBKDF2 salt | iterations | nonce prefix,
+# followed by chunked AES-GCM over the NDJSON export (see streamcrypt)
+MAGIC_EXPORT = b"CVEX"
+_EXPORT_HEADER = struct.Struct(">4sB16sI7s")
+BATCH_SIZE = 64 * 1024
+
+# ---------------------
+# Line Formatters
+# ---------------------
+
+def _txt_lines(records):
+    for site, creds in records:
+        yield f"Site: {site}\n  Username: {creds['username']}\n  Password: {creds['password']}\n\n"
+
+def _csv_lines(records):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(["site", "username", "password"])
+    for site, creds in records:
+        writer.writerow([site, creds["username"], creds["password"]])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+def _ndjson_lines(records):
+    for site, creds in records:
+        yield json.dumps({"site": site, "username": creds["username"], "password": creds["password"]}) + "\n"
+
+def _batched(lines, size: int = BATCH_SIZE):
+    """Joins encoded lines into chunks of roughly `size` bytes so writes stay few and large."""
+    batch, length = [], 0
+    for line in lines:
+        data = line.encode("utf-8")
+        batch.append(data)
+        length += len(data)
+        if length >= size:
+            yield b"".join(batch)
+            batch, length = [], 0
+    if batch:
+        yield b"".join(batch)
+
+# ---------------------
+# Export Pipeline
+# ---------------------
+
+def _export_key(passphrase: str, salt: bytes, iterations: int) -> bytes:
+    kdf = PBKDF2HMAC(
+        algorithm=hashes.SHA256(),
+        length=32,
+        salt=salt,
+        iterations=iterations,
+        backend=default_backend()
+    )
+    return kdf.derive(passphrase.encode())
+
+def export_key(passphrase: str) -> tuple:
+    """(salt, key) for a new encrypted export: the PBKDF2 run, for callers that schedule it themselves."""
+    salt = os.urandom(16)
+    return salt, _export_key(passphrase, salt, ITERATIONS)
+
+def export_chunks(records, fmt: str, passphrase: str = None, sealing: tuple = None):
+    """
+    Yields the export of `records` ((site, creds) pairs, consumed lazily) as byte chunks.
+
+    The "encrypted" format is an NDJSON export sealed with a key derived from
+    `passphrase`, encrypted chunk by chunk so no plaintext copy is ever built.
+    `sealing`, from export_key, replaces the passphrase when the key was derived beforehand.
+    """
+    if fmt == "txt":
+        yield from _batched(_txt_lines(records))
+    elif fmt == "csv":
+        yield from _batched(_csv_lines(records))
+    elif fmt == "ndjson":
+        yield from _batched(_ndjson_lines(records))
+    elif fmt == "encrypted":
+        if sealing is None and not passphrase:
+            raise ValueError("An encrypted export needs a passphrase.")
+        salt, key = sealing or export_key(passphrase)
+        prefix = os.urandom(streamcrypt.NONCE_PREFIX_SIZE)
+        header = _EXPORT_HEADER.pack(MAGIC_EXPORT, 1, salt, ITERATIONS, prefix)
+        yield header
+        yield from streamcrypt.seal_stream(key, prefix, _batched(_ndjson_lines(records)), aad=header)
+    else:
+        raise ValueError(f"Unknown export format: {fmt}")
+
+def read_encrypted_export(fileobj, passphrase: str):
+    """Yields the (site, creds) pairs of an encrypted export, decrypting it chunk by chunk."""
+    header = fileobj.read(_EXPORT_HEADER.size)
+    if len(header) != _EXPORT_HEADER.size:
+        raise ValueError("Not an encrypted vault export.")
+    magic, version, salt, iterations, prefix = _EXPORT_HEADER.unpack(header)
+    if magic != MAGIC_EXPORT or version != 1:
+        raise ValueError("Not an encrypted vault export.")
+
+    key = _export_key(passphrase, salt, iterations)
+    pending = b""
+    for chunk in streamcrypt.open_stream(key, prefix, fileobj, aad=header):
+        *lines, pending = (pending + chunk).split(b"\n")
+        for line in lines:
+            entry = json.loads(line)
+            yield entry["site"], {"username": entry["username"], "password": entry["password"]}
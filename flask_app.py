@@ -1,12 +1,25 @@
-from flask import Flask, request, session, send_file
-from vault import generate_key, decrypt_data, encrypt_data, update_last_access, is_vault_locked, read_audit_log
+from flask import Flask, Response, g, request, session, send_file, stream_with_context
+from vault import check_password_strength, update_last_access, is_vault_locked
 from functools import wraps
-from totp import verify_totp_code, get_provisioning_uri, get_or_create_totp_secret
+from totp import verify_totp_code, get_provisioning_uri
+from keycache import KeyCache
+from vaultcache import VaultCache
+from cryptopool import CryptoPool, PoolBusy
+from tenants import Tenant
+import audit
+import metrics
+import storage
+import importer
+import exporter
 import os
 import io
+import itertools
+import heapq
+import hmac
+import json
+import secrets
 import qrcode
 import base64
-import bcrypt
 from datetime import timedelta
 from flask import current_app as logger
 from flask_cors import CORS
@@ -34,6 +47,18 @@ app.config.update(
 
 VAULT_FILE = 'vault.json.enc'
 MASTER_HASH_FILE = "master.hash"
+# Whether logging in with an unknown username creates that user's vault (off
+# unless the operator opts in: anyone who can reach the app could sign up)
+ALLOW_SIGNUP = os.environ.get("VAULT_ALLOW_SIGNUP", "0") == "1"
+# Bearer token a Prometheus scraper presents for /metrics; logged-in sessions may read it too
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN")
+
+# Derived keys shared by every route, so PBKDF2 runs once per login
+key_cache = KeyCache()
+# Decrypted vault, reused until the file changes on disk
+vault_cache = VaultCache()
+# bcrypt and key derivation, kept off the request threads (see cryptopool.py)
+crypto_pool = CryptoPool()
 
 def login_required(f):
     @wraps(f)
@@ -45,11 +70,27 @@ def login_required(f):
     return wrapper
 
 
+def current_tenant():
+    """
+    The user whose files this request works on: the one named at login, or
+    the single-user layout in the working directory if no username was given.
+    """
+    user = session.get('user')
+    if user:
+        return Tenant.for_user(user)
+    return Tenant.legacy(vault_file=VAULT_FILE, master_hash_file=MASTER_HASH_FILE)
+
+
 @app.route("/qrcode")
 def show_qr():
-    secret = get_or_create_totp_secret()
+    tenant = current_tenant()
+    # A user's TOTP secret is shown while they enroll, right after signing up,
+    # or once fully logged in; the password alone must not reveal it
+    if tenant.user_id is not None and not (session.get('enrolling') or session.get('2fa_passed')):
+        return {"error": "Unauthorized"}, 401
+    secret = tenant.totp_secret()
     # 3-arg call: account_name, issuer_name, secret
-    uri = get_provisioning_uri("VaultUser", "Credential-Vault", secret)
+    uri = get_provisioning_uri(tenant.user_id or "VaultUser", "Credential-Vault", secret)
 
     img = qrcode.make(uri)
     buf = io.BytesIO()
@@ -59,19 +100,72 @@ def show_qr():
 
 
 
+def start_key_session():
+    """Gives the session a fresh opaque id; the old one's cached key is dropped."""
+    old_sid = session.get('sid')
+    if old_sid:
+        key_cache.evict(old_sid)
+    session['sid'] = secrets.token_urlsafe(16)
+
+
+def forget_tenant(tenant):
+    """Drops this session's key and the tenant's decrypted vault; other users' stay cached."""
+    if 'sid' in session:
+        key_cache.evict(session['sid'])
+    vault_cache.invalidate(tenant.vault_file)
+    storage.clear_cache(tenant.vault_file)
+
+
+def get_vault_key():
+    """Returns the vault key for the current session, deriving it at most once."""
+    tenant = current_tenant()
+    if is_vault_locked(tenant.last_access_file):
+        # Only this session's key: other sessions' keys expire on their own after the same idle time
+        forget_tenant(tenant)
+    if 'sid' not in session:
+        start_key_session()
+
+    def derive():
+        # Re-keys the vault first if its KDF parameters are outdated
+        key = crypto_pool.run(storage.unlock, session['master'], tenant.vault_file, tenant.salt_file)
+        # A key that opens the vault (or will create it) may key the audit chain
+        if not os.path.exists(tenant.vault_file) or storage.check_key(key, tenant.vault_file):
+            audit.use_vault_key(key, tenant.audit_log)
+        return key
+
+    return key_cache.get_or_derive(session['sid'], derive)
+
+
+def vault_etag():
+    version = storage.vault_version(current_tenant().vault_file)
+    return f'"{version}"' if version else None
+
+
+def if_match_version():
+    """
+    The vault version a write is conditional on, from the If-Match header.
+
+    Returns None for an unconditional write (no header, or "*").
+    """
+    header = request.headers.get("If-Match", "").strip()
+    if not header or header == "*":
+        return None
+    return header.removeprefix("W/").strip('"')
+
+
 def load_vault_data():
-    key = generate_key(session['master'])
-    if not os.path.exists(VAULT_FILE):        
+    tenant = current_tenant()
+    key = get_vault_key()
+    if not os.path.exists(tenant.vault_file):
         return {}                             
 
     try:
-        with open(VAULT_FILE, "rb") as f:
-            encrypted = f.read()
-        data = decrypt_data(encrypted, key)
+        data = vault_cache.get_or_load(key, tenant.vault_file,
+                                       lambda: storage.load_vault(key, tenant.vault_file))
     except Exception as exc:
         app.logger.warning("vault decrypt failed: %s", exc)
         raise                                     
-    update_last_access()
+    update_last_access(tenant.last_access_file)
     return data
 
 
@@ -81,26 +175,42 @@ def health():
 
 @app.route('/', methods=['POST'])
 def login():
-    master = request.json.get('master') if request.is_json else request.form.get('master')
+    form = request.json if request.is_json else request.form
+    master = form.get('master')
+    username = (form.get('username') or '').strip()
 
     session['2fa_passed'] = False
 
-    if not os.path.exists(MASTER_HASH_FILE):
+    if username:
+        try:
+            tenant = Tenant.for_user(username)
+        except ValueError as e:
+            return {"error": str(e)}, 400
+    else:
+        session.pop('user', None)
+        tenant = current_tenant()
+
+    created = False
+    if not tenant.exists():
+        if tenant.user_id is not None and not ALLOW_SIGNUP:
+            return {"error": "Incorrect username or master password"}, 401
         # First time setup — hash and save password
-        hashed = bcrypt.hashpw(master.encode(), bcrypt.gensalt())
-        with open(MASTER_HASH_FILE, 'wb') as f:
-            f.write(hashed)
-        session.permanent = True        
-        session['master'] = master
-        return {"status": "2fa_required"}, 200
-
-    with open(MASTER_HASH_FILE, 'rb') as f:
-        stored_hash = f.read()
+        try:
+            crypto_pool.run(tenant.create, master)
+            created = True
+        except FileExistsError:
+            pass  # created by a concurrent first login; check the password against it
 
-    if not bcrypt.checkpw(master.encode(), stored_hash):
+    if not created and not crypto_pool.run(tenant.verify_master_password, master):
         return {"error": "Incorrect master password"}, 401
 
+    if created:
+        session.permanent = True        
+    session['enrolling'] = created
+    if tenant.user_id is not None:
+        session['user'] = tenant.user_id
     session['master'] = master
+    start_key_session()
     return {"status": "2fa_required"}, 200
 
 
@@ -111,7 +221,7 @@ def verify_2fa():
 
     code = (request.form.get('code') or request.json.get('code') or '').strip()
 
-    secret   = os.environ["TOTP_SECRET"]
+    secret   = current_tenant().totp_secret()
     expected = pyotp.TOTP(secret).now()
 
     app.logger.info(      # <── Gunicorn will forward this line
@@ -121,6 +231,7 @@ def verify_2fa():
 
     if verify_totp_code(code, secret):
         session['2fa_passed'] = True
+        session.pop('enrolling', None)
         return {"status": "ok"}, 200
 
     return {"error": "Invalid 2FA code"}, 401
@@ -130,7 +241,9 @@ def verify_2fa():
 @app.route('/reset-vault', methods=['POST'])
 @login_required
 def reset_vault():
-    for file in ['vault.json.enc', 'vault_audit.log', 'salt.bin']:
+    tenant = current_tenant()
+    forget_tenant(tenant)
+    for file in tenant.vault_files():
         if os.path.exists(file):
             os.remove(file)
     return {"status": "authenticated"}, 200
@@ -140,7 +253,9 @@ def reset_vault():
 def force_reset():
     print("🔥 /force-reset endpoint hit")
     try:
-        for file in ['vault.json.enc', 'vault_audit.log', 'salt.bin']:
+        tenant = current_tenant()
+        forget_tenant(tenant)
+        for file in tenant.vault_files():
             if os.path.exists(file):
                 os.remove(file)
         try:
@@ -154,17 +269,119 @@ def force_reset():
 
 
 
+CREDENTIAL_FIELDS = ("site", "username", "password")
+SORT_KEYS = ("site", "-site", "username", "-username")
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+
+def _encode_cursor(sort, key):
+    return base64.urlsafe_b64encode(json.dumps({"sort": sort, "after": key}).encode()).decode()
+
+
+def _decode_cursor(cursor, sort):
+    try:
+        decoded = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        key = tuple(decoded["after"])
+    except Exception:
+        raise ValueError("Invalid cursor.")
+    if decoded.get("sort") != sort or len(key) != 2:
+        raise ValueError("Cursor does not match the requested sort.")
+    return key
+
+
+def page_credentials(data, q=None, prefix=None, username=None, sort="site", cursor=None, limit=DEFAULT_PAGE_SIZE):
+    """
+    Returns (matching sites after `cursor` in `sort` order, at most `limit`; next cursor or None).
+
+    Pages are keyed on (sort value, site) rather than an offset, so entries
+    added or removed between requests never shift or repeat later pages.
+    """
+    descending = sort.startswith("-")
+    field = sort.lstrip("-")
+    q, prefix, username = (v.lower() if v else v for v in (q, prefix, username))
+
+    def sort_key(site):
+        value = site if field == "site" else data[site]["username"]
+        return (value.lower(), site)
+
+    def wanted(site):
+        creds = data[site]
+        if q and q not in site.lower() and q not in creds["username"].lower():
+            return False
+        if prefix and not site.lower().startswith(prefix):
+            return False
+        if username and creds["username"].lower() != username:
+            return False
+        return True
+
+    candidates = (site for site in data if wanted(site))
+    if cursor is not None:
+        after = _decode_cursor(cursor, sort)
+        candidates = (site for site in candidates
+                      if (sort_key(site) < after if descending else sort_key(site) > after))
+
+    # Only the requested page (plus one to know if there is more) is ever sorted
+    pick = heapq.nlargest if descending else heapq.nsmallest
+    page = pick(limit + 1, candidates, key=sort_key)
+    next_cursor = _encode_cursor(sort, sort_key(page[limit - 1])) if len(page) > limit else None
+    return page[:limit], next_cursor
+
+
 @app.route('/api/credentials', methods=['GET'])
 @login_required
 def api_credentials():
+    fields = request.args.get("fields", "site,username").split(",")
+    sort = request.args.get("sort", "site")
+    try:
+        limit = int(request.args.get("limit", DEFAULT_PAGE_SIZE))
+    except ValueError:
+        limit = 0
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        return {"error": f"limit must be between 1 and {MAX_PAGE_SIZE}."}, 400
+    if not fields or any(field not in CREDENTIAL_FIELDS for field in fields):
+        return {"error": f"fields must be a subset of {', '.join(CREDENTIAL_FIELDS)}."}, 400
+    if sort not in SORT_KEYS:
+        return {"error": f"sort must be one of {', '.join(SORT_KEYS)}."}, 400
+
     data = load_vault_data()
     if data is None:
         return {"error": "Vault locked or corrupted."}, 403
 
-    return {"credentials": [
-        {"site": site, "username": creds["username"], "password": creds["password"]}
-        for site, creds in data.items()
-    ]}, 200
+    try:
+        sites, next_cursor = page_credentials(
+            data,
+            q=request.args.get("q"),
+            prefix=request.args.get("prefix"),
+            username=request.args.get("username"),
+            sort=sort,
+            cursor=request.args.get("cursor"),
+            limit=limit,
+        )
+    except ValueError as e:
+        return {"error": str(e)}, 400
+
+    return {
+        "credentials": [
+            {field: site if field == "site" else data[site][field] for field in fields}
+            for site in sites
+        ],
+        "next_cursor": next_cursor,
+    }, 200, {"ETag": vault_etag() or '""'}
+
+
+@app.route('/api/credentials/<path:site>', methods=['GET'])
+@login_required
+def api_credential(site):
+    tenant = current_tenant()
+    creds = None
+    if os.path.exists(tenant.vault_file):
+        creds = storage.get_record(get_vault_key(), site, tenant.vault_file)
+    if creds is None:
+        return {"error": "Site not found"}, 404
+
+    update_last_access(tenant.last_access_file)
+    return {"site": site, "username": creds["username"], "password": creds["password"]}, 200, {"ETag": vault_etag()}
 
 
 @app.route('/add-credential', methods=['POST'])
@@ -178,42 +395,62 @@ def add_credential():
     if not site or not username or not password:
         return {"error": "Missing required fields."}, 400
 
-    vault_data = load_vault_data()
-    if vault_data is None:
-        return {"error": "Vault is locked or invalid."}, 403
+    tenant = current_tenant()
+    key = get_vault_key()
+    storage.put_record(key, site, {"username": username, "password": password}, tenant.vault_file,
+                       expected_version=if_match_version())
+    vault_cache.invalidate(tenant.vault_file)
+    tenant.log_action("ADD", site)
 
-    vault_data[site] = {"username": username, "password": password}
-    key = generate_key(session['master'])
+    update_last_access(tenant.last_access_file)
+    return {"message": f"Credential for '{site}' added."}, 200, {"ETag": vault_etag()}
 
-    with open(VAULT_FILE, "wb") as f:
-        f.write(encrypt_data(vault_data, key))
 
-    update_last_access()
-    return {"message": f"Credential for '{site}' added."}, 200
+@app.route('/api/import', methods=['POST'])
+@login_required
+def api_import():
+    upload = request.files.get("file")
+    fmt = request.form.get("format", "csv")
+    on_conflict = request.form.get("on_conflict", "skip")
+
+    if upload is None:
+        return {"error": "Missing import file."}, 400
+    if fmt not in importer.FORMATS or on_conflict not in importer.CONFLICT_POLICIES:
+        return {"error": "Unsupported format or conflict policy."}, 400
+
+    tenant = current_tenant()
+    stream = io.TextIOWrapper(upload.stream, encoding="utf-8-sig", newline="")
+    try:
+        report = importer.import_credentials(get_vault_key(), stream, fmt, on_conflict, tenant.vault_file,
+                                             expected_version=if_match_version())
+    except ValueError as e:
+        return {"error": str(e)}, 400
+    finally:
+        vault_cache.invalidate(tenant.vault_file)
+    tenant.log_action("IMPORT", note=f"{report.imported} imported")
+
+    update_last_access(tenant.last_access_file)
+    return report.to_dict(), 200, {"ETag": vault_etag()}
 
 
 @app.route('/delete/<site>', methods=['POST'])
 @login_required
 def delete_site(site):
     try:
-        key = generate_key(session['master'])
-
-        # Load current vault data
-        with open(VAULT_FILE, "rb") as f:
-            encrypted_data = f.read()
-        data = decrypt_data(encrypted_data, key)
+        tenant = current_tenant()
+        key = get_vault_key()
 
         # Remove the entry if it exists
-        if site in data:
-            del data[site]
-
-            # Save updated vault
-            with open(VAULT_FILE, "wb") as f:
-                f.write(encrypt_data(data, key))
-
-            return {"message": f"Deleted credentials for {site}"}, 200
+        if storage.delete_record(key, site, tenant.vault_file, expected_version=if_match_version()):
+            vault_cache.invalidate(tenant.vault_file)
+            tenant.log_action("DELETE", site)
+            return {"message": f"Deleted credentials for {site}"}, 200, {"ETag": vault_etag()}
         else:
             return {"error": "Site not found"}, 404
+    except storage.VersionConflict as e:
+        return vault_changed(e)
+    except PoolBusy as e:
+        return pool_busy(e)
     except Exception as e:
         return {"error": str(e)}, 500
 
@@ -222,51 +459,185 @@ def delete_site(site):
 @login_required
 def edit_site(site):
     try:
-        key = generate_key(session['master'])
+        tenant = current_tenant()
+        key = get_vault_key()
         new_data = request.json  # expects {"username": "...", "password": "..."}
 
-        # Load existing vault
-        with open(VAULT_FILE, "rb") as f:
-            encrypted = f.read()
-        data = decrypt_data(encrypted, key)
+        # Load only the credential being edited, holding the write lock until it is saved
+        with storage.vault_lock(tenant.vault_file, exclusive=True):
+            creds = storage.get_record(key, site, tenant.vault_file)
+            if creds is None:
+                return {"error": "Site not found"}, 404
 
-        # Update the credential
-        if site in data:
-            data[site] = {
-                "username": new_data.get("username", data[site]["username"]),
-                "password": new_data.get("password", data[site]["password"]),
+            # Update the credential
+            creds = {
+                "username": new_data.get("username", creds["username"]),
+                "password": new_data.get("password", creds["password"]),
             }
+            storage.put_record(key, site, creds, tenant.vault_file, expected_version=if_match_version())
+        vault_cache.invalidate(tenant.vault_file)
+        tenant.log_action("EDIT", site)
 
-            # Save vault
-            with open(VAULT_FILE, "wb") as f:
-                f.write(encrypt_data(data, key))
-
-            return {"message": f"Updated {site}"}, 200
-        else:
-            return {"error": "Site not found"}, 404
+        return {"message": f"Updated {site}"}, 200, {"ETag": vault_etag()}
 
+    except storage.VersionConflict as e:
+        return vault_changed(e)
+    except PoolBusy as e:
+        return pool_busy(e)
     except Exception as e:
         return {"error": str(e)}, 500
 
 
-@app.route('/export', methods=['GET'])
+@app.route('/export', methods=['GET', 'POST'])
 @login_required
 def export():
-    data = load_vault_data()
-    if data is None:
-        return {"error": "Vault locked"}, 403
+    fmt = request.args.get("format", "txt")
+    if fmt not in exporter.FORMATS:
+        return {"error": "Unsupported export format."}, 400
+
+    sealing = None
+    if fmt == "encrypted":
+        body = request.get_json(silent=True) or request.form
+        passphrase = body.get("passphrase") if request.method == "POST" else None
+        if not passphrase:
+            return {"error": "Encrypted exports need a passphrase in a POST body."}, 400
+        # PBKDF2 for the export key, through the pool like every other derivation (503 when busy)
+        sealing = crypto_pool.run(exporter.export_key, passphrase)
+
+    tenant = current_tenant()
+    records = iter(())
+    if os.path.exists(tenant.vault_file):
+        records = storage.iter_vault(get_vault_key(), tenant.vault_file)
+        first = next(records, None)  # fail here, not mid-stream, on a bad key
+        records = itertools.chain([first] if first else [], records)
+    tenant.log_action("EXPORT", note=fmt)
+    update_last_access(tenant.last_access_file)
+
+    chunks = exporter.export_chunks(records, fmt, sealing=sealing)
+    return Response(stream_with_context(chunks), mimetype=exporter.MIMETYPES[fmt], headers={
+        "Content-Disposition": f"attachment; filename=vault_export.{exporter.EXTENSIONS[fmt]}",
+    })
+
+
+@app.route('/api/audit', methods=['GET'])
+@login_required
+def api_audit():
+    try:
+        limit = int(request.args.get("limit", DEFAULT_PAGE_SIZE))
+    except ValueError:
+        limit = 0
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        return {"error": f"limit must be between 1 and {MAX_PAGE_SIZE}."}, 400
+
+    tenant = current_tenant()
+    audit.flush(log_file=tenant.audit_log)
+    try:
+        since, until = (request.args.get(name) for name in ("since", "until"))
+        events, next_cursor = audit.page_events(
+            limit,
+            cursor=request.args.get("cursor"),
+            path=tenant.audit_path,
+            since=audit.parse_time(since) if since else None,
+            until=audit.parse_time(until) if until else None,
+            action=request.args.get("action"),
+            site=request.args.get("site"),
+        )
+    except ValueError as e:
+        return {"error": str(e)}, 400
+
+    return {"events": events, "next_cursor": next_cursor}, 200
+
+
+@app.route('/change-master', methods=['POST'])
+@login_required
+def change_master():
+    data = request.get_json(silent=True) or request.form
+    current = data.get("current")
+    new = data.get("new")
+    if not current or not new:
+        return {"error": "Missing required fields."}, 400
+
+    tenant = current_tenant()
+    if not crypto_pool.run(tenant.verify_master_password, current):
+        tenant.log_action("CHANGE_MASTER", status="FAILURE", note="Incorrect master password")
+        return {"error": "Incorrect master password"}, 401
 
-    content = "".join([f"Site: {site}\nUsername: {creds['username']}\nPassword: {creds['password']}\n\n"
-                       for site, creds in data.items()])
-    return send_file(io.BytesIO(content.encode()), as_attachment=True, download_name='vault_export.txt', mimetype='text/plain')
+    # Only the data key's wrapping changes, so the vault, its cached key and
+    # the audit chain key all stay as they are
+    try:
+        crypto_pool.run(storage.change_master_password, current, new, tenant.vault_file, tenant.salt_file)
+    except ValueError as e:
+        tenant.log_action("CHANGE_MASTER", status="FAILURE", note=str(e))
+        return {"error": str(e)}, 400
+    crypto_pool.run(tenant.set_master_password, new)
+    session['master'] = new
+    tenant.log_action("CHANGE_MASTER")
+    return {"message": "Master password changed.", "strength": check_password_strength(new)}, 200
 
 
 @app.route('/logout')
 def logout():
+    forget_tenant(current_tenant())
     session.clear()
     return {"message": "Logged out"}, 200
 
 
+@app.route('/api/crypto-pool', methods=['GET'])
+def api_crypto_pool():
+    if not metrics_authorized():
+        return {"error": "Unauthorized"}, 401
+    return crypto_pool.stats(), 200
+
+
+@app.before_request
+def start_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def record_request(response):
+    started = g.pop('request_started', None)
+    if started is not None and metrics.ENABLED:
+        # The route pattern, never the concrete path: that would put site names in the labels
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        metrics.registry.observe("vault_http_request_seconds", time.perf_counter() - started, route=route)
+        metrics.registry.inc("vault_http_requests_total", route=route, method=request.method,
+                             status=str(response.status_code))
+    return response
+
+
+def metrics_authorized() -> bool:
+    """A scraper presenting METRICS_TOKEN, or a fully logged-in session."""
+    header = request.headers.get("Authorization", "")
+    token_ok = bool(METRICS_TOKEN) and hmac.compare_digest(header.encode(), f"Bearer {METRICS_TOKEN}".encode())
+    return token_ok or ('master' in session and bool(session.get('2fa_passed')))
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    if not metrics_authorized():
+        return {"error": "Unauthorized"}, 401
+
+    # The caches and the pool keep their own totals; copy them in at scrape time
+    for cache, stats in (("key", key_cache.stats()), ("vault", vault_cache.stats())):
+        metrics.registry.set("vault_cache_hits_total", stats["hits"], cache=cache)
+        metrics.registry.set("vault_cache_misses_total", stats["misses"], cache=cache)
+    pool = crypto_pool.stats()
+    metrics.registry.set("vault_crypto_pool_depth", pool["depth"])
+    metrics.registry.set("vault_crypto_pool_rejected_total", pool["rejected"])
+    return Response(metrics.registry.render(), content_type=metrics.CONTENT_TYPE)
+
+
+@app.errorhandler(PoolBusy)
+def pool_busy(e):
+    return {"error": "Server busy. Try again shortly."}, 503, {"Retry-After": str(e.retry_after)}
+
+
+@app.errorhandler(storage.VersionConflict)
+def vault_changed(e):
+    return {"error": "Vault changed since it was read. Reload and try again."}, 412, {"ETag": vault_etag() or '""'}
+
+
 @app.errorhandler(404)
 def not_found(e):
     return {"error": "Not found"}, 404
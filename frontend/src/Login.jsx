@@ -3,14 +3,17 @@ import axios from 'axios';
 import './Login.css';
 
 function Login({ onLogin }) {
+  const [username, setUsername] = useState('');
   const [password, setPassword] = useState('');
   const [error, setError] = useState('');
 
   const handleMasterSubmit = async (e) => {
     e.preventDefault();
+    const form = new URLSearchParams({ master: password });
+    if (username.trim()) form.append('username', username.trim());
     try {
       const response = await axios.post(`${process.env.REACT_APP_API}/`, 
-        new URLSearchParams({ master: password }), 
+        form, 
         { withCredentials: true }
       );
       if (response.data.status === '2fa_required') {
@@ -49,6 +52,13 @@ function Login({ onLogin }) {
         You'll see it after entering a new password.
       </p>
       <form onSubmit={handleMasterSubmit}>
+        <input
+          type="text"
+          placeholder="Username (optional)"
+          autoComplete="username"
+          value={username}
+          onChange={(e) => setUsername(e.target.value)}
+        />
         <input
           type="password"
           placeholder="Master Password"
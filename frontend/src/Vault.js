@@ -10,15 +10,62 @@ function Vault({ onDelete }) {
   const [editData, setEditData] = useState({ username: '', password: '' });
   const [darkMode, setDarkMode] = useState(() => localStorage.getItem('darkMode') === 'true');
 
-  const fetchCredentials = () => {
-    axios
-      .get(`${process.env.REACT_APP_API}/api/credentials`, { withCredentials: true })
-      .then((res) => {
-        setCredentials(res.data.credentials || []);
-      })
-      .catch((err) => {
-        console.error('Error fetching data:', err);
-      });
+  const [passwords, setPasswords] = useState({});
+
+  // Pages through /api/credentials without passwords; those are fetched per site when shown
+  const fetchCredentials = async () => {
+    try {
+      let all = [];
+      let cursor = null;
+      do {
+        const params = { fields: 'site,username', limit: 200, ...(cursor ? { cursor } : {}) };
+        const res = await axios.get(`${process.env.REACT_APP_API}/api/credentials`, {
+          params,
+          withCredentials: true,
+        });
+        all = all.concat(res.data.credentials || []);
+        cursor = res.data.next_cursor;
+      } while (cursor);
+      setCredentials(all);
+      setPasswords({});
+    } catch (err) {
+      console.error('Error fetching data:', err);
+    }
+  };
+
+  const fetchPassword = async (cred) => {
+    if (cred.password !== undefined) return cred.password;
+    if (passwords[cred.site] !== undefined) return passwords[cred.site];
+    const res = await axios.get(
+      `${process.env.REACT_APP_API}/api/credentials/${encodeURIComponent(cred.site)}`,
+      { withCredentials: true }
+    );
+    setPasswords((prev) => ({ ...prev, [cred.site]: res.data.password }));
+    return res.data.password;
+  };
+
+  const handleEdit = (cred) => {
+    const startEditing = (password) => {
+      setEditingSite(cred.site);
+      setEditData({ username: cred.username, password });
+    };
+    const known = cred.password ?? passwords[cred.site];
+    if (known !== undefined) {
+      startEditing(known);
+    } else {
+      fetchPassword(cred)
+        .then(startEditing)
+        .catch((err) => console.error('Error fetching password:', err));
+    }
+  };
+
+  const handleShowPasswords = () => {
+    if (!showPasswords) {
+      credentials.forEach((cred) =>
+        fetchPassword(cred).catch((err) => console.error('Error fetching password:', err))
+      );
+    }
+    setShowPasswords((prev) => !prev);
   };
 
   const handleLogout = () => {
@@ -77,7 +124,7 @@ function Vault({ onDelete }) {
       <h1>🔐 Credential Vault</h1>
 
       <div style={{ marginBottom: '12px' }}>
-        <button onClick={() => setShowPasswords((prev) => !prev)}>
+        <button onClick={handleShowPasswords}>
           {showPasswords ? 'Hide Passwords' : 'Show Passwords'}
         </button>
         <button onClick={fetchCredentials} style={{ marginLeft: '10px' }}>
@@ -139,7 +186,7 @@ function Vault({ onDelete }) {
                       onChange={(e) => setEditData({ ...editData, password: e.target.value })}
                     />
                   ) : showPasswords ? (
-                    cred.password
+                    cred.password ?? passwords[cred.site] ?? '…'
                   ) : (
                     '••••••••'
                   )}
@@ -166,13 +213,7 @@ function Vault({ onDelete }) {
                   ) : (
                     <>
                       <button
-                        onClick={() => {
-                          setEditingSite(cred.site);
-                          setEditData({
-                            username: cred.username,
-                            password: cred.password,
-                          });
-                        }}
+                        onClick={() => handleEdit(cred)}
                       >
                         ✏️ Edit
                       </button>
@@ -0,0 +1,168 @@
+import csv
+import json
+import os
+import time
+
+import storage
+
+FORMATS = ["csv", "json", "bitwarden-json", "keepass-csv"]
+CONFLICT_POLICIES = ["skip", "overwrite", "rename"]
+
+# Header names accepted for each field, lower-cased (KeePass 1.x, KeePass 2 and KeePassXC exports)
+_CSV_COLUMNS = {
+    "site": ["site", "url", "name"],
+    "username": ["username", "user", "login"],
+    "password": ["password"],
+}
+_KEEPASS_COLUMNS = {
+    "site": ["title", "account", "url", "web site"],
+    "username": ["username", "user name", "login name"],
+    "password": ["password"],
+}
+
+# ---------------------
+# Readers
+# ---------------------
+
+def _pick(row: dict, names: list) -> str:
+    for name in names:
+        if row.get(name):
+            return row[name].strip()
+    return ""
+
+def _read_csv(stream, columns):
+    reader = csv.DictReader(stream)
+    for row in reader:
+        row = {(k or "").strip().lower(): v for k, v in row.items()}
+        yield reader.line_num, {field: _pick(row, names) for field, names in columns.items()}
+
+def _read_json(stream):
+    data = json.load(stream)
+    if isinstance(data, dict):
+        data = [{"site": site, **(creds if isinstance(creds, dict) else {})} for site, creds in data.items()]
+    elif not isinstance(data, list):
+        raise ValueError("A JSON import must be an object of sites or a list of entries.")
+    for number, item in enumerate(data, start=1):
+        yield number, item if isinstance(item, dict) else {}
+
+def _read_bitwarden(stream):
+    data = json.load(stream)
+    items = data.get("items", []) if isinstance(data, dict) else None
+    if not isinstance(items, list):
+        raise ValueError('A Bitwarden export must be a JSON object with a list of "items".')
+    for number, item in enumerate(items, start=1):
+        if not isinstance(item, dict):
+            yield number, {}  # rejected like any other row without a site
+            continue
+        login = item.get("login") if isinstance(item.get("login"), dict) else {}
+        uris = login.get("uris") if isinstance(login.get("uris"), list) else []
+        uri = uris[0].get("uri") if uris and isinstance(uris[0], dict) else ""
+        yield number, {
+            "site": item.get("name") or uri or "",
+            "username": login.get("username") or "",
+            "password": login.get("password") or "",
+        }
+
+def read_rows(stream, fmt: str):
+    """Yields (row number, {"site", "username", "password"}) from an export file, one row at a time."""
+    if fmt == "csv":
+        return _read_csv(stream, _CSV_COLUMNS)
+    if fmt == "keepass-csv":
+        return _read_csv(stream, _KEEPASS_COLUMNS)
+    if fmt == "json":
+        return _read_json(stream)
+    if fmt == "bitwarden-json":
+        return _read_bitwarden(stream)
+    raise ValueError(f"Unknown import format: {fmt}")
+
+# ---------------------
+# Import Pipeline
+# ---------------------
+
+class ImportReport:
+    def __init__(self):
+        self.imported = 0
+        self.overwritten = 0
+        self.renamed = 0
+        self.skipped = 0
+        self.rejected = []  # (row number, reason)
+        self.seconds = 0.0
+
+    @property
+    def rows_per_second(self) -> float:
+        rows = self.imported + self.skipped + len(self.rejected)
+        return rows / self.seconds if self.seconds else 0.0
+
+    def to_dict(self) -> dict:
+        return {
+            "imported": self.imported,
+            "overwritten": self.overwritten,
+            "renamed": self.renamed,
+            "skipped": self.skipped,
+            "rejected": [{"row": row, "reason": reason} for row, reason in self.rejected],
+            "seconds": round(self.seconds, 3),
+            "rows_per_second": round(self.rows_per_second, 1),
+        }
+
+
+def _validate(row: dict):
+    for field in ("site", "username", "password"):
+        value = row.get(field, "")
+        if not isinstance(value, str):
+            return f"'{field}' must be a string"
+    if not row.get("site", "").strip():
+        return "missing site"
+    if not row.get("password"):
+        return "missing password"
+    return None
+
+def _free_name(site: str, existing: set, incoming: dict) -> str:
+    n = 2
+    while f"{site} ({n})" in existing or f"{site} ({n})" in incoming:
+        n += 1
+    return f"{site} ({n})"
+
+def import_credentials(key: bytes, stream, fmt: str, on_conflict: str = "skip",
+                       path: str = storage.VAULT_FILE, expected_version: str = None) -> ImportReport:
+    """
+    Imports every valid row of `stream` into the vault with one encrypted write.
+
+    Existing sites are resolved with `on_conflict`: keep the vault entry
+    (skip), replace it (overwrite) or store the row as "site (2)" (rename).
+    Invalid rows are reported and never abort the import. `expected_version`
+    makes the write conditional, as in storage.put_records.
+    """
+    if on_conflict not in CONFLICT_POLICIES:
+        raise ValueError(f"Unknown conflict policy: {on_conflict}")
+
+    report = ImportReport()
+    start = time.perf_counter()
+    # Conflicts are resolved against the vault as it is when written, so hold its write lock throughout
+    with storage.vault_lock(path, exclusive=True):
+        existing = set(storage.list_sites(key, path)) if os.path.exists(path) else set()
+        incoming = {}
+
+        for number, row in read_rows(stream, fmt):
+            reason = _validate(row)
+            if reason:
+                report.rejected.append((number, reason))
+                continue
+
+            site = row["site"].strip()
+            if site in existing or site in incoming:
+                if on_conflict == "skip":
+                    report.skipped += 1
+                    continue
+                if on_conflict == "rename":
+                    site = _free_name(site, existing, incoming)
+                    report.renamed += 1
+                else:
+                    report.overwritten += 1
+
+            incoming[site] = {"username": row.get("username", ""), "password": row["password"]}
+            report.imported += 1
+
+        if incoming:
+            storage.put_records(key, incoming, path, expected_version)
+    report.seconds = time.perf_counter() - start
+    return report
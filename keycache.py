@@ -0,0 +1,71 @@
+import threading
+import time
+from collections import OrderedDict
+
+from vault import LOCK_TIMEOUT
+
+
+class KeyCache:
+    """
+    Process-level cache of derived vault keys, keyed by an opaque session id.
+
+    Deriving a key costs a full PBKDF2 run, so the web app derives it once per
+    login and reuses it for every later request of that session. Entries are
+    evicted least-recently-used once `max_entries` is reached, and expire after
+    `ttl` seconds without use (the same window as the vault idle-lock).
+    """
+
+    def __init__(self, max_entries: int = 128, ttl: float = LOCK_TIMEOUT, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, sid: str):
+        """Returns the cached key for `sid`, or None if missing or expired."""
+        with self._lock:
+            entry = self._entries.get(sid)
+            now = self._clock()
+            if entry is None or now - entry[1] > self.ttl:
+                self._entries.pop(sid, None)
+                self.misses += 1
+                return None
+            self._entries[sid] = (entry[0], now)
+            self._entries.move_to_end(sid)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, sid: str, key: bytes):
+        with self._lock:
+            self._entries[sid] = (key, self._clock())
+            self._entries.move_to_end(sid)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get_or_derive(self, sid: str, derive) -> bytes:
+        """
+        Returns the key for `sid`, calling `derive()` only on a cache miss.
+
+        The derivation runs outside the cache lock so a slow KDF for one
+        session never blocks lookups for the others.
+        """
+        key = self.get(sid)
+        if key is None:
+            key = derive()
+            self.put(sid, key)
+        return key
+
+    def evict(self, sid: str):
+        with self._lock:
+            self._entries.pop(sid, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._entries)}
@@ -0,0 +1,153 @@
+import bisect
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# In-process counters and latency histograms for the hot paths: key
+# derivation, bcrypt, Fernet, JSON, fsync and the web routes. The web app
+# serves them at /metrics in Prometheus text format; `cli.py --profile` prints
+# the per-stage totals after a command. Each gunicorn worker keeps its own
+# numbers, so a scraper sees one worker per request.
+# Set VAULT_METRICS=0 to turn the timing off entirely.
+ENABLED = os.environ.get("VAULT_METRICS", "1") != "0"
+
+# Histogram bucket upper bounds, in seconds
+BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# name: (type, help)
+METRICS = {
+    "vault_stage_seconds": ("histogram", "Time spent in each hot-path stage."),
+    "vault_kdf_total": ("counter", "Master password key derivations."),
+    "vault_bytes_read_total": ("counter", "Vault ciphertext bytes read and decrypted."),
+    "vault_bytes_written_total": ("counter", "Bytes written to vault files."),
+    "vault_cache_hits_total": ("counter", "Key and vault cache hits."),
+    "vault_cache_misses_total": ("counter", "Key and vault cache misses."),
+    "vault_crypto_pool_depth": ("gauge", "Crypto pool jobs running or queued."),
+    "vault_crypto_pool_rejected_total": ("counter", "Crypto pool jobs refused because it was full."),
+    "vault_http_requests_total": ("counter", "HTTP requests by route, method and status."),
+    "vault_http_request_seconds": ("histogram", "HTTP request latency by route."),
+}
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class Registry:
+    """Thread-safe counters, gauges and histograms, keyed by metric name and label values."""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self._values = {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(name: str, labels: dict):
+        return name, tuple(sorted(labels.items()))
+
+    def inc(self, name: str, amount: float = 1, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def set(self, name: str, value: float, **labels):
+        """Sets a gauge, or a counter kept elsewhere (e.g. cache stats) to its current total."""
+        with self._lock:
+            self._values[self._key(name, labels)] = value
+
+    def observe(self, name: str, seconds: float, **labels):
+        key = self._key(name, labels)
+        slot = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                # Per-bucket counts (the last one is +Inf), sum, count
+                histogram = self._histograms[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            histogram[0][slot] += 1
+            histogram[1] += seconds
+            histogram[2] += 1
+
+    def value(self, name: str, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(name, labels), 0)
+
+    def summary(self, name: str = "vault_stage_seconds", label: str = "stage") -> dict:
+        """{label value: (count, total seconds)} for one histogram."""
+        with self._lock:
+            return {dict(labels)[label]: (count, total)
+                    for (metric, labels), (_, total, count) in self._histograms.items() if metric == name}
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+            self._histograms.clear()
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format."""
+        with self._lock:
+            values = dict(self._values)
+            histograms = {key: (list(counts), total, count) for key, (counts, total, count) in self._histograms.items()}
+
+        lines = []
+        for name in sorted({n for n, _ in values} | {n for n, _ in histograms}):
+            kind, text = METRICS.get(name, ("untyped", name))
+            lines += [f"# HELP {name} {text}", f"# TYPE {name} {kind}"]
+            for (metric, labels), value in sorted(values.items()):
+                if metric == name:
+                    lines.append(f"{name}{_labels(labels)} {_number(value)}")
+            for (metric, labels), (counts, total, count) in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                cumulative = 0
+                for bound, hits in zip([*self.buckets, "+Inf"], counts):
+                    cumulative += hits
+                    le = bound if bound == "+Inf" else _number(bound)
+                    lines.append(f"{name}_bucket{_labels(labels + (('le', le),))} {cumulative}")
+                lines.append(f"{name}_sum{_labels(labels)} {_number(total)}")
+                lines.append(f"{name}_count{_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _labels(labels) -> str:
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}" if labels else ""
+
+def _number(value) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+registry = Registry()
+
+# ---------------------
+# Instrumentation helpers
+# ---------------------
+
+@contextmanager
+def span(stage: str):
+    """Times the enclosed block as one `stage` observation."""
+    if not ENABLED:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        registry.observe("vault_stage_seconds", time.perf_counter() - start, stage=stage)
+
+def inc(name: str, amount: float = 1, **labels):
+    if ENABLED:
+        registry.inc(name, amount, **labels)
+
+def stage_report(wall_seconds: float) -> str:
+    """The per-stage breakdown `--profile` prints, slowest stage first."""
+    rows = sorted(registry.summary().items(), key=lambda item: -item[1][1])
+    lines = [f"{'stage':<16} {'calls':>7} {'total ms':>10} {'avg ms':>9} {'share':>6}"]
+    for stage, (count, total) in rows:
+        share = total / wall_seconds * 100 if wall_seconds else 0
+        lines.append(f"{stage:<16} {count:>7} {total * 1000:>10.2f} {total / count * 1000:>9.3f} {share:>5.1f}%")
+    lines.append(f"{'wall':<16} {'':>7} {wall_seconds * 1000:>10.2f}")
+    read, written = registry.value("vault_bytes_read_total"), registry.value("vault_bytes_written_total")
+    lines.append(f"bytes read {read}, bytes written {written}")
+    return "\n".join(lines)
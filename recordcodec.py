@@ -0,0 +1,158 @@
+import itertools
+import json
+import struct
+import sys
+import zlib
+from array import array
+
+ENCODING_JSON = "json"
+ENCODING_RECORDS = "records"
+ENCODING_RECORDS_ZLIB = "records+zlib"
+ENCODINGS = [ENCODING_JSON, ENCODING_RECORDS, ENCODING_RECORDS_ZLIB]
+
+# The first byte of a payload names its encoding. JSON payloads have no header
+# byte of their own: they start with "{", which no other encoding uses.
+_JSON = ord("{")
+_RECORDS_V1 = 0x01
+_ZLIB = 0x80  # flag: everything after the header byte is zlib-compressed
+ZLIB_LEVEL = 6
+
+_COUNT = struct.Struct("<I")
+
+# ---------------------
+# Record Encoding (v1)
+# ---------------------
+# A vault {site: {field: value}} whose keys and values are all strings is
+# stored column by column:
+#
+#   u32 n | n little-endian u32s | UTF-8 text
+#
+# The integers are the field count F, the shape count S, each shape (its record
+# count, its field count k and k field numbers), then the length in code points
+# of every string in the text: the F field names, then for each shape its
+# site names followed by one column of values per field. Records with the same
+# set of fields share a shape; a vault's records usually all share one.
+#
+# Decoding never steps through the payload byte by byte: the text is decoded
+# in one call, cut into strings at the stored lengths, and each shape's
+# records are built from its columns in one list comprehension.
+
+def _strings(lengths, text: str) -> list:
+    offsets = list(itertools.accumulate(lengths, initial=0))
+    if offsets[-1] != len(text):
+        raise ValueError("Corrupted vault payload: string lengths don't match the text.")
+    return [text[start:end] for start, end in zip(offsets, offsets[1:])]
+
+def _build(keys: list, columns: list, count: int) -> list:
+    if len(keys) == 2:
+        # Username and password: the shape of nearly every record, built
+        # without a zip() per record
+        first, second = keys
+        return [{first: a, second: b} for a, b in zip(*columns)]
+    if not keys:
+        return [{} for _ in range(count)]
+    return [dict(zip(keys, values)) for values in zip(*columns)]
+
+def _encode_records(data: dict):
+    """The record encoding of `data`, or None if it isn't a vault of strings."""
+    fields, shapes = {}, {}
+    for site, creds in data.items():
+        if type(creds) is not dict:
+            return None
+        shape = tuple(creds)
+        group = shapes.get(shape)
+        if group is None:
+            group = shapes[shape] = []
+            for field in shape:
+                fields.setdefault(field, len(fields))
+        group.append(site)
+
+    ints = [len(fields), len(shapes)]
+    strings = [*fields]
+    for shape, sites in shapes.items():
+        ints += [len(sites), len(shape), *map(fields.__getitem__, shape)]
+        strings += sites
+        for field in shape:
+            strings += [data[site][field] for site in sites]
+    try:
+        text = "".join(strings)
+    except TypeError:
+        return None  # a value that isn't a string
+    ints += map(len, strings)
+
+    numbers = array("I", ints)
+    if sys.byteorder != "little":
+        numbers.byteswap()
+    return _COUNT.pack(len(numbers)) + numbers.tobytes() + text.encode("utf-8", "surrogatepass")
+
+def _decode_records(body) -> dict:
+    count, = _COUNT.unpack_from(body)
+    end = _COUNT.size + 4 * count
+    numbers = array("I")
+    numbers.frombytes(body[_COUNT.size:end])
+    if sys.byteorder != "little":
+        numbers.byteswap()
+
+    field_count, shape_count = numbers[0], numbers[1]
+    position, shapes = 2, []
+    for _ in range(shape_count):
+        records, width = numbers[position], numbers[position + 1]
+        shapes.append((records, numbers[position + 2:position + 2 + width]))
+        position += 2 + width
+    strings = _strings(numbers[position:], str(body[end:], "utf-8", "surrogatepass"))
+
+    names, position = strings[:field_count], field_count
+    data = {}
+    for records, shape in shapes:
+        keys = [names[number] for number in shape]
+        sites = strings[position:position + records]
+        position += records
+        columns = []
+        for _ in keys:
+            columns.append(strings[position:position + records])
+            position += records
+        data.update(zip(sites, _build(keys, columns, records)))
+    return data
+
+# ---------------------
+# Payloads
+# ---------------------
+
+def encode(data: dict, encoding: str = ENCODING_JSON) -> bytes:
+    """
+    Serializes `data` as a payload in `encoding`. Anything the record encoding
+    can't hold (values that aren't {field: string} dicts) is written as JSON,
+    which every reader accepts.
+    """
+    if encoding not in ENCODINGS:
+        raise ValueError(f"Unknown vault encoding: {encoding}")
+    if encoding != ENCODING_JSON:
+        body = _encode_records(data)
+        if body is not None:
+            if encoding == ENCODING_RECORDS_ZLIB:
+                return bytes([_RECORDS_V1 | _ZLIB]) + zlib.compress(body, ZLIB_LEVEL)
+            return bytes([_RECORDS_V1]) + body
+    return json.dumps(data).encode()
+
+def payload_encoding(payload: bytes) -> str:
+    header = payload[0] if payload else None
+    if header == _JSON:
+        return ENCODING_JSON
+    if header == _RECORDS_V1:
+        return ENCODING_RECORDS
+    if header == _RECORDS_V1 | _ZLIB:
+        return ENCODING_RECORDS_ZLIB
+    raise ValueError("Corrupted vault payload: unknown encoding.")
+
+def decode(payload: bytes) -> dict:
+    """Parses a payload written by `encode` in any encoding, including plain JSON."""
+    encoding = payload_encoding(payload)
+    if encoding == ENCODING_JSON:
+        return json.loads(payload.decode())
+    body = memoryview(payload)[1:]
+    try:
+        if encoding == ENCODING_RECORDS_ZLIB:
+            body = zlib.decompress(body)
+        return _decode_records(body)
+    except (zlib.error, struct.error, IndexError) as e:
+        raise ValueError(f"Corrupted vault payload: {e}")
@@ -0,0 +1,94 @@
+import hashlib
+import hmac
+import json
+import os
+
+from vault import derive_subkey
+
+INDEX_SUFFIX = ".search"
+NGRAM = 3
+TOKEN_BYTES = 12
+
+def index_path(vault_path: str) -> str:
+    """The search index lives next to the vault file it indexes, named after it."""
+    return vault_path + INDEX_SUFFIX
+
+def ngrams(text: str) -> set:
+    text = text.lower()
+    return {text[i:i + NGRAM] for i in range(len(text) - NGRAM + 1)}
+
+
+class SearchIndex:
+    """
+    Blind substring index over site names (and optionally usernames).
+
+    Every trigram is stored only as a truncated HMAC keyed from the vault key,
+    and records are referred to by their keyed record id, so the index file
+    doesn't reveal names without the key. Tokens are deterministic, though:
+    anyone who can read it sees which records share trigrams, and how many.
+    A query returns candidate record ids; callers decrypt just those and
+    confirm the match, which also weeds out the rare token collision.
+    """
+
+    def __init__(self, key: bytes, fields=("site",)):
+        self.fields = [*fields]
+        self.records = {}   # record id -> [tokens]
+        self.postings = {}  # token -> {record ids}
+        self._key = derive_subkey(key, "search")
+
+    def _token(self, field: str, gram: str) -> str:
+        return hmac.new(self._key, f"{field}:{gram}".encode(), hashlib.sha256).digest()[:TOKEN_BYTES].hex()
+
+    def _values(self, site: str, creds: dict) -> dict:
+        return {"site": site, "username": creds.get("username", "")}
+
+    def add(self, record_id: str, site: str, creds: dict):
+        self.remove(record_id)
+        values = self._values(site, creds)
+        tokens = sorted({self._token(field, gram) for field in self.fields for gram in ngrams(values[field])})
+        self.records[record_id] = tokens
+        for token in tokens:
+            self.postings.setdefault(token, set()).add(record_id)
+
+    def remove(self, record_id: str):
+        for token in self.records.pop(record_id, []):
+            ids = self.postings.get(token)
+            if ids:
+                ids.discard(record_id)
+                if not ids:
+                    del self.postings[token]
+
+    def lookup(self, query: str) -> set:
+        """Returns the ids of records that may contain `query` in an indexed field."""
+        grams = ngrams(query)
+        candidates = set()
+        for field in self.fields:
+            postings = [self.postings.get(self._token(field, gram), set()) for gram in grams]
+            if postings:
+                candidates |= set.intersection(*postings)
+        return candidates
+
+    def matches(self, query: str, site: str, creds: dict) -> bool:
+        query = query.lower()
+        values = self._values(site, creds)
+        return any(query in values[field].lower() for field in self.fields)
+
+    def save(self, path: str):
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"version": 1, "fields": self.fields, "records": self.records}, f)
+        os.replace(tmp, path)
+
+
+def load(key: bytes, path: str):
+    """Returns the SearchIndex stored at `path`, or None if there isn't one."""
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        stored = json.load(f)
+    index = SearchIndex(key, stored["fields"])
+    index.records = stored["records"]
+    for record_id, tokens in index.records.items():
+        for token in tokens:
+            index.postings.setdefault(token, set()).add(record_id)
+    return index
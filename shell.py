@@ -0,0 +1,373 @@
+import cmd
+import os
+import shlex
+import threading
+
+import click
+
+import audit
+import storage
+from vault import LOCK_TIMEOUT, check_password_strength, generate_password, update_last_access
+
+
+class ShellError(Exception):
+    """A shell command that can't run as typed; the message says why."""
+
+
+class SessionLocked(ShellError):
+    """The session locked itself after LOCK_TIMEOUT idle seconds."""
+
+
+class VaultSession:
+    """
+    A vault decrypted once and kept in memory for a run of commands.
+
+    Reads are answered from memory. Changes are staged and reach the disk only
+    when `commit` writes them all in one atomic write, so a session that dies
+    halfway never leaves a half-updated vault. `lock` commits, then forgets
+    the key and the decrypted vault.
+    """
+
+    def __init__(self, key: bytes, path: str = storage.VAULT_FILE):
+        self.path = path
+        self._lock = threading.RLock()
+        self._open(key)
+
+    def _open(self, key: bytes):
+        self.data = storage.load_vault(key, self.path) if os.path.exists(self.path) else {}
+        self.key = key
+        self.version = storage.vault_version(self.path)
+        self.changes = {}  # site -> creds, or None for a delete
+        self.events = []   # (action, site) to audit once committed
+
+    @property
+    def locked(self) -> bool:
+        return self.key is None
+
+    @property
+    def pending(self) -> int:
+        return len(self.changes)
+
+    def unlock(self, key: bytes):
+        with self._lock:
+            self._open(key)
+
+    def _check(self):
+        if self.key is None:
+            raise SessionLocked("The session is locked.")
+
+    def sites(self) -> list:
+        with self._lock:
+            self._check()
+            return sorted(self.data)
+
+    def get(self, site: str):
+        with self._lock:
+            self._check()
+            return self.data.get(site)
+
+    def search(self, query: str) -> dict:
+        query = query.lower()
+        with self._lock:
+            self._check()
+            return {site: creds for site, creds in sorted(self.data.items())
+                    if query in site.lower() or query in creds.get("username", "").lower()}
+
+    def put(self, site: str, creds: dict):
+        with self._lock:
+            self._check()
+            self.events.append(("EDIT" if site in self.data else "ADD", site))
+            self.data[site] = self.changes[site] = creds
+
+    def delete(self, site: str) -> bool:
+        with self._lock:
+            self._check()
+            if site not in self.data:
+                return False
+            del self.data[site]
+            self.changes[site] = None
+            self.events.append(("DELETE", site))
+            return True
+
+    def commit(self) -> int:
+        """Writes every staged change in one write. Returns how many sites changed."""
+        with self._lock:
+            self._check()
+            if not self.changes:
+                return 0
+            # Only the changed sites are written, so other writers' changes survive;
+            # they are picked up below by reloading
+            changed_elsewhere = storage.vault_version(self.path) != self.version
+            storage.put_records(self.key, self.changes, self.path)
+            for action, site in self.events:
+                audit.log_action(action, site, note="shell")
+            count = len(self.changes)
+            self.changes, self.events = {}, []
+            if changed_elsewhere:
+                self.data = storage.load_vault(self.key, self.path)
+            self.version = storage.vault_version(self.path)
+            update_last_access()
+            return count
+
+    def discard(self) -> int:
+        """Drops the staged changes and reloads the vault. Returns how many were dropped."""
+        with self._lock:
+            self._check()
+            count = len(self.changes)
+            self._open(self.key)
+            return count
+
+    def lock(self):
+        """Commits, then wipes the decrypted vault and the key from memory."""
+        with self._lock:
+            if self.key is None:
+                return
+            self.commit()
+            self.data.clear()
+            self.key = None
+
+
+class VaultShell(cmd.Cmd):
+    """
+    The command loop behind `cli.py shell` and `cli.py batch`.
+
+    Interactive sessions prompt for missing passwords, complete site names on
+    Tab and lock after `timeout` idle seconds; `unlock` is called for a new
+    key when the next command arrives. Batch runs never prompt.
+    """
+
+    prompt = "vault> "
+    intro = "🔓 Vault unlocked. Type `help` for commands; changes are saved on `commit` or `exit`."
+
+    def __init__(self, session: VaultSession, unlock=None, interactive: bool = True,
+                 timeout: float = LOCK_TIMEOUT, **kwargs):
+        super().__init__(**kwargs)
+        self.session = session
+        self.unlock = unlock
+        self.interactive = interactive
+        self.timeout = timeout
+        self.failed = False
+        self._timer = None
+        self._lock_error = None
+
+    # ---------------------
+    # Loop plumbing
+    # ---------------------
+
+    def _arm(self):
+        self._disarm()
+        self._timer = threading.Timer(self.timeout, self._idle_lock)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _disarm(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer.join()  # a lock already under way finishes before the next command runs
+            self._timer = None
+
+    def _idle_lock(self):
+        # On the timer thread: a failed commit leaves the session unlocked with its
+        # changes staged, and is reported by the prompt thread at the next command
+        try:
+            self.session.lock()
+        except Exception as e:
+            self._lock_error = e
+
+    def preloop(self):
+        if self.interactive:
+            self._arm()
+
+    def postloop(self):
+        self._disarm()
+
+    def precmd(self, line):
+        self._disarm()
+        if self._lock_error is not None:
+            error, self._lock_error = self._lock_error, None
+            self.failed = True
+            click.echo(f"⚠️ Couldn't save the staged changes when locking after {self.timeout:.0f}s idle "
+                       f"({error}); the session stayed unlocked. Run `commit` to retry.")
+        if self.session.locked and line.strip():
+            click.echo(f"🔒 Session locked after {self.timeout:.0f}s idle; staged changes were saved.")
+            if self.unlock is None:
+                return "exit"
+            self.session.unlock(self.unlock())
+            click.echo("🔓 Vault unlocked.")
+        return line
+
+    def postcmd(self, stop, line):
+        if not stop and self.interactive:
+            self._arm()
+        return stop
+
+    def onecmd(self, line):
+        try:
+            return super().onecmd(line)
+        except click.Abort:
+            self.failed = True
+            click.echo("\n❌ Cancelled.")
+            return False
+        except Exception as e:
+            self.failed = True
+            click.echo(f"❌ Error: {e}")
+            return False
+
+    def emptyline(self):
+        pass  # cmd would repeat the last command, e.g. a delete
+
+    def default(self, line):
+        raise ShellError(f"Unknown command '{line.split()[0]}'. Type `help` for the list.")
+
+    def _args(self, line: str, usage: str, minimum: int, maximum: int) -> list:
+        args = shlex.split(line)
+        if not minimum <= len(args) <= maximum:
+            raise ShellError(f"Usage: {usage}")
+        return args
+
+    def _complete_site(self, text, line, begidx, endidx):
+        return [site for site in self.session.sites() if site.startswith(text)]
+
+    complete_get = complete_edit = complete_delete = complete_copy = _complete_site
+
+    # ---------------------
+    # Commands
+    # ---------------------
+
+    def do_get(self, line):
+        """get SITE - show the credentials for a site."""
+        site, = self._args(line, "get SITE", 1, 1)
+        creds = self.session.get(site)
+        if creds is None:
+            raise ShellError(f"No credentials found for '{site}'.")
+        click.echo(f"  👤 Username: {creds['username']}")
+        click.echo(f"  🔑 Password: {creds['password']}")
+        audit.log_action("GET", site, note="shell")
+
+    def do_add(self, line):
+        """add SITE USERNAME [PASSWORD] - add or replace a site (prompts for the password if omitted)."""
+        args = self._args(line, "add SITE USERNAME [PASSWORD]", 2 if self.interactive else 3, 3)
+        site, username = args[:2]
+        password = args[2] if len(args) == 3 else click.prompt("Password", hide_input=True, confirmation_prompt=True)
+        self.session.put(site, {"username": username, "password": password})
+        click.echo(f"✅ Credentials for '{site}' staged. 🧠 Password Strength: {check_password_strength(password)}")
+
+    def do_edit(self, line):
+        """edit SITE [USERNAME|- [PASSWORD]] - change a site's username and/or password ("-" keeps the username)."""
+        args = self._args(line, "edit SITE [USERNAME|- [PASSWORD]]", 1 if self.interactive else 2, 3)
+        site = args[0]
+        creds = self.session.get(site)
+        if creds is None:
+            raise ShellError(f"No credentials found for '{site}'.")
+        if len(args) == 1 and self.interactive:
+            args.append(click.prompt("New Username", default="", show_default=False) or "-")
+            args.append(click.prompt("New Password", hide_input=True, confirmation_prompt=True,
+                                     default="", show_default=False))
+        creds = dict(creds)
+        if len(args) > 1 and args[1] != "-":
+            creds["username"] = args[1]
+        if len(args) > 2 and args[2]:
+            creds["password"] = args[2]
+            click.echo(f"🧠 New Password Strength: {check_password_strength(args[2])}")
+        self.session.put(site, creds)
+        click.echo(f"✏️ Credentials for '{site}' staged.")
+
+    def do_delete(self, line):
+        """delete SITE - remove a site."""
+        site, = self._args(line, "delete SITE", 1, 1)
+        if not self.session.delete(site):
+            raise ShellError(f"No credentials found for '{site}'.")
+        click.echo(f"🗑️ Credentials for '{site}' staged for deletion.")
+
+    def do_search(self, line):
+        """search QUERY - sites whose name or username contains QUERY."""
+        query, = self._args(line, "search QUERY", 1, 1)
+        matches = self.session.search(query)
+        if not matches:
+            click.echo(f"⚠️ No matches found for '{query}'.")
+        for site, creds in matches.items():
+            click.echo(f"  🌐 {site}  👤 {creds['username']}")
+
+    def do_list(self, line):
+        """list - all stored sites."""
+        self._args(line, "list", 0, 0)
+        sites = self.session.sites()
+        if not sites:
+            click.echo("⚠️ Vault is empty.")
+        for site in sites:
+            click.echo(f"  - {site}")
+
+    def do_copy(self, line):
+        """copy SITE - copy a site's password to the clipboard."""
+        import pyperclip
+
+        site, = self._args(line, "copy SITE", 1, 1)
+        creds = self.session.get(site)
+        if creds is None:
+            raise ShellError(f"No credentials found for '{site}'.")
+        pyperclip.copy(creds["password"])
+        click.echo(f"📋 Password for '{site}' copied to clipboard!")
+        audit.log_action("COPY", site, note="shell")
+
+    def do_generate(self, line):
+        """generate [LENGTH] - print a random password (default 16 characters)."""
+        args = self._args(line, "generate [LENGTH]", 0, 1)
+        if args and not args[0].isdigit():
+            raise ShellError("Usage: generate [LENGTH]")
+        password = generate_password(int(args[0]) if args else 16)
+        click.echo(f"🔐 Generated Password: {password}")
+        click.echo(f"🧠 Password Strength: {check_password_strength(password)}")
+
+    def do_status(self, line):
+        """status - the changes not yet saved."""
+        changes = self.session.changes
+        click.echo(f"📝 {len(changes)} unsaved change(s).")
+        for site, creds in sorted(changes.items()):
+            click.echo(f"  {'-' if creds is None else '+'} {site}")
+
+    def do_commit(self, line):
+        """commit - save every staged change in one write."""
+        count = self.session.commit()
+        click.echo(f"💾 Saved {count} change(s)." if count else "ℹ️ Nothing to save.")
+
+    def do_discard(self, line):
+        """discard - drop the staged changes and reload the vault."""
+        click.echo(f"↩️ Discarded {self.session.discard()} change(s).")
+
+    def do_exit(self, line):
+        """exit - save the staged changes and leave."""
+        if not self.session.locked:
+            self.do_commit("")
+        return True
+
+    do_quit = do_exit
+
+    def do_EOF(self, line):
+        click.echo()
+        return self.do_exit(line)
+
+
+def run_batch(session: VaultSession, lines, keep_going: bool = False) -> bool:
+    """
+    Runs shell commands from `lines` and commits once at the end. Unless
+    `keep_going`, the first failing line stops the run and nothing it staged
+    is saved. Returns True if every line succeeded.
+    """
+    shell = VaultShell(session, interactive=False)
+    ok = True
+    for number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        shell.failed = False
+        stop = shell.onecmd(line)
+        if shell.failed:
+            ok = False
+            click.echo(f"   (line {number}: {line})")
+            if not keep_going:
+                click.echo(f"❌ Stopped; {session.discard()} staged change(s) were not saved.")
+                return False
+        if stop:
+            return ok
+    shell.do_commit("")
+    return ok
@@ -0,0 +1,1297 @@
+import fcntl
+import hashlib
+import hmac
+import inspect
+import mmap
+import os
+import queue
+import sqlite3
+import struct
+import sys
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import wraps
+
+import metrics
+import recordcodec
+import searchindex
+from vault import (SALT_FILE, encrypt_data, decrypt_data, derive_subkey, derive_key, generate_key,
+                   generate_salt, master_key, new_envelope_header, read_kdf_header, target_kdf, token_signed,
+                   unwrap_key, wrap_key, write_kdf_header)
+
+VAULT_FILE = "vault.json.enc"
+
+# Vault formats:
+#   v1  - one Fernet token over the whole vault: base64 over JSON, or raw bytes
+#         over the binary record encoding (see recordcodec)
+#   v2  - "CVV2" | header length | encrypted index | independently encrypted records
+#         | sorted lookup table | "CVIX" footer
+#   log - "CVLG" | log id | append-only encrypted put/delete frames
+#   sqlite - SQLite database in WAL mode, one row per independently encrypted record
+#   stream - "CVST" | version | HKDF salt | nonce prefix | chunk size, then chunked
+#            AES-GCM over length-prefixed batches of records (see streamcrypt)
+FORMAT_V1 = "v1"
+FORMAT_V2 = "v2"
+FORMAT_LOG = "log"
+FORMAT_SQLITE = "sqlite"
+FORMAT_STREAM = "stream"
+FORMATS = [FORMAT_V1, FORMAT_V2, FORMAT_LOG, FORMAT_SQLITE, FORMAT_STREAM]
+DEFAULT_FORMAT = os.environ.get("VAULT_FORMAT", FORMAT_V2)
+# How v1 vaults serialize the vault before encrypting it; any of them reads back
+DEFAULT_ENCODING = os.environ.get("VAULT_ENCODING", recordcodec.ENCODING_RECORDS)
+
+MAGIC_V2 = b"CVV2"
+MAGIC_LOG = b"CVLG"
+MAGIC_INDEX = b"CVIX"
+MAGIC_SQLITE = b"SQLite format 3\x00"
+MAGIC_STREAM = b"CVST"
+_HEADER = struct.Struct(">4sI")
+_INDEX_ENTRY = struct.Struct(">16sQI")    # site tag, record offset, record length
+_INDEX_FOOTER = struct.Struct(">4sQI16s")  # magic, table offset, entry count, key check
+_LOG_HEADER = struct.Struct(">4s16s")
+_FRAME = struct.Struct(">I")
+_STREAM_HEADER = struct.Struct(">4sB16s7sI")  # magic, version, HKDF salt, nonce prefix, chunk size
+_SEGMENT = struct.Struct(">I")
+
+# A log is compacted automatically once it holds at least this many frames
+# and this share of them is overwritten or deleted records
+COMPACT_MIN_FRAMES = 256
+COMPACT_GARBAGE_RATIO = 0.5
+
+# ---------------------
+# Locking & Versions
+# ---------------------
+# Every reader takes a shared flock and every writer an exclusive one on a
+# "<vault>.lock" sidecar. The vault itself can't carry the lock because most
+# writes replace it with a new file. Locks are re-entrant per thread, so a
+# writer may call the readers below while it holds its exclusive lock.
+# SQLite vaults isolate their readers themselves (WAL snapshots), so reads of
+# those skip the shared lock and never wait for a writer to commit.
+
+LOCK_SUFFIX = ".lock"
+_held = threading.local()
+
+
+class VersionConflict(Exception):
+    """The vault changed since the version the caller based its write on."""
+
+
+@contextmanager
+def vault_lock(path: str = VAULT_FILE, exclusive: bool = False):
+    locks = _held.__dict__.setdefault("locks", {})
+    lock_path = os.path.abspath(path) + LOCK_SUFFIX
+    held = locks.get(lock_path)
+    if held is not None:
+        if exclusive and not held["exclusive"]:
+            raise RuntimeError("A shared vault lock can't be upgraded to an exclusive one.")
+        held["depth"] += 1
+        try:
+            yield
+        finally:
+            held["depth"] -= 1
+        return
+
+    fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        locks[lock_path] = {"exclusive": exclusive, "depth": 1}
+        try:
+            yield
+        finally:
+            del locks[lock_path]
+            fcntl.flock(fd, fcntl.LOCK_UN)
+    finally:
+        os.close(fd)
+
+def _locked(exclusive: bool):
+    """Runs the decorated function holding the lock of the vault named by its `path` argument."""
+    def decorate(func):
+        signature = inspect.signature(func)
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            path = bound.arguments["path"]
+            if not exclusive and _is_sqlite(path):
+                return func(*args, **kwargs)
+            with vault_lock(path, exclusive):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+def vault_version(path: str = VAULT_FILE):
+    """
+    Opaque token identifying the vault file as it is now, or None if there is none.
+
+    Every write either replaces the file (new inode) or appends to it (new
+    size), and always bumps its mtime, so the token changes with each write.
+    SQLite vaults commit to their write-ahead log first, so it is included too.
+    """
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    version = f"{st.st_ino:x}-{st.st_size:x}-{st.st_mtime_ns:x}"
+    try:
+        wal = os.stat(path + "-wal")
+    except FileNotFoundError:
+        return version
+    return f"{version}-{wal.st_size:x}-{wal.st_mtime_ns:x}"
+
+def _check_version(path: str, expected_version):
+    if expected_version is not None and vault_version(path) != expected_version:
+        raise VersionConflict("The vault was changed by someone else.")
+
+def _sync(f, written: int):
+    """Flushes and fsyncs a vault file being written, counting the `written` bytes."""
+    f.flush()
+    with metrics.span("fsync"):
+        os.fsync(f.fileno())
+    metrics.inc("vault_bytes_written_total", written)
+
+def _commit(tmp: str, path: str):
+    """Atomically moves a fully written and fsynced `tmp` over `path`, then syncs the rename itself."""
+    os.replace(tmp, path)
+    fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        with metrics.span("fsync"):
+            os.fsync(fd)
+    finally:
+        os.close(fd)
+
+# ---------------------
+# Format Detection
+# ---------------------
+
+def detect_format(path: str = VAULT_FILE) -> str:
+    with open(path, "rb") as f:
+        magic = f.read(len(MAGIC_SQLITE))
+    if magic[:len(MAGIC_V2)] == MAGIC_V2:
+        return FORMAT_V2
+    if magic[:len(MAGIC_LOG)] == MAGIC_LOG:
+        return FORMAT_LOG
+    if magic == MAGIC_SQLITE:
+        return FORMAT_SQLITE
+    if magic[:len(MAGIC_STREAM)] == MAGIC_STREAM:
+        return FORMAT_STREAM
+    return FORMAT_V1
+
+def _is_sqlite(path: str) -> bool:
+    try:
+        return detect_format(path) == FORMAT_SQLITE
+    except FileNotFoundError:
+        return False
+
+def _format_for_write(path: str) -> str:
+    return detect_format(path) if os.path.exists(path) else DEFAULT_FORMAT
+
+# ---------------------
+# v2 Container
+# ---------------------
+
+def _read_index(f, key: bytes):
+    """
+    Reads the encrypted index at the start of a v2 vault.
+
+    Returns ({site: [offset, length]}, start of the record area).
+    """
+    magic, length = _HEADER.unpack(f.read(_HEADER.size))
+    if magic != MAGIC_V2:
+        raise ValueError("Not a v2 vault file.")
+    header = decrypt_data(f.read(length), key)
+    return header["records"], _HEADER.size + length
+
+def _seal_record(site: str, creds: dict, key: bytes) -> bytes:
+    # The site name is sealed inside the record so records can't be swapped in the index
+    return encrypt_data({"site": site, "creds": creds}, key)
+
+def _open_record(token: bytes, site: str, key: bytes) -> dict:
+    record = decrypt_data(token, key)
+    if record.get("site") != site:
+        raise ValueError("Corrupted vault: record does not match its index entry.")
+    return record["creds"]
+
+def _site_tag(site: str, lookup_key: bytes) -> bytes:
+    return hmac.new(lookup_key, site.encode(), hashlib.sha256).digest()[:16]
+
+def record_id(key: bytes, site: str) -> str:
+    """Opaque, keyed id of a site's record, shared by the lookup table and the search index."""
+    return _site_tag(site, derive_subkey(key, "lookup")).hex()
+
+def _key_check(lookup_key: bytes) -> bytes:
+    return hmac.new(lookup_key, b"key-check", hashlib.sha256).digest()[:16]
+
+def _write_v2(path: str, key: bytes, layout):
+    """
+    Writes a v2 vault from `layout`, a list of (site, length, source) where
+    source is either a new token or the (offset, length) of a record to copy
+    verbatim from the current file.
+    """
+    index, offset = {}, 0
+    for site, length, _ in layout:
+        index[site] = [offset, length]
+        offset += length
+    header = encrypt_data({"version": 2, "records": index}, key)
+
+    # Keyed site tags sorted for binary search, so one record can be located
+    # without decrypting the index (see VaultReader)
+    start = _HEADER.size + len(header)
+    lookup_key = derive_subkey(key, "lookup")
+    table = sorted((_site_tag(site, lookup_key), start + offset, length)
+                   for site, (offset, length) in index.items())
+
+    tmp = path + ".tmp"
+    src = open(path, "rb") if any(not isinstance(s, bytes) for _, _, s in layout) else None
+    try:
+        with open(tmp, "wb") as out:
+            out.write(_HEADER.pack(MAGIC_V2, len(header)))
+            out.write(header)
+            for _, length, source in layout:
+                if isinstance(source, bytes):
+                    out.write(source)
+                else:
+                    src.seek(source[0])
+                    out.write(src.read(length))
+            table_offset = start + offset
+            for entry in table:
+                out.write(_INDEX_ENTRY.pack(*entry))
+            out.write(_INDEX_FOOTER.pack(MAGIC_INDEX, table_offset, len(table), _key_check(lookup_key)))
+            _sync(out, out.tell())
+    finally:
+        if src:
+            src.close()
+    _commit(tmp, path)
+
+def _rewrite_v2(path: str, key: bytes, changes: dict):
+    """
+    Applies {site: creds or None} to a v2 vault. Only the changed records are
+    encrypted; every other record is copied as raw ciphertext.
+    """
+    index, start = {}, 0
+    if os.path.exists(path):
+        with open(path, "rb") as f:
+            index, start = _read_index(f, key)
+
+    layout = []
+    for site, (offset, length) in index.items():
+        if site not in changes:
+            layout.append((site, length, (start + offset, length)))
+        elif changes[site] is not None:
+            token = _seal_record(site, changes[site], key)
+            layout.append((site, len(token), token))
+    for site, creds in changes.items():
+        if site not in index and creds is not None:
+            token = _seal_record(site, creds, key)
+            layout.append((site, len(token), token))
+    _write_v2(path, key, layout)
+
+class VaultReader:
+    """
+    Memory-mapped random access to a v2 vault.
+
+    A lookup binary-searches the sorted tag table at the end of the file and
+    decrypts only the matching record, so the cost of `get` does not grow with
+    the vault: neither the encrypted index nor the other records are read.
+    Vaults written before the table existed fall back to the encrypted index.
+    """
+
+    def __init__(self, path: str, key: bytes):
+        self.key = key
+        self._file = open(path, "rb")
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._table = None
+
+        if len(self._map) >= _INDEX_FOOTER.size:
+            magic, table_offset, count, check = _INDEX_FOOTER.unpack_from(self._map, len(self._map) - _INDEX_FOOTER.size)
+            if magic == MAGIC_INDEX:
+                self._lookup_key = derive_subkey(key, "lookup")
+                if not hmac.compare_digest(check, _key_check(self._lookup_key)):
+                    self.close()
+                    raise ValueError("Incorrect master password or corrupted vault.")
+                self._table, self._count = table_offset, count
+
+    @property
+    def indexed(self) -> bool:
+        return self._table is not None
+
+    def _find(self, tag: bytes):
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            entry_tag, offset, length = _INDEX_ENTRY.unpack_from(self._map, self._table + mid * _INDEX_ENTRY.size)
+            if entry_tag < tag:
+                lo = mid + 1
+            elif entry_tag > tag:
+                hi = mid
+            else:
+                return self._map[offset:offset + length]
+        return None
+
+    def get(self, site: str):
+        if self._table is None:
+            magic, length = _HEADER.unpack_from(self._map, 0)
+            index = decrypt_data(self._map[_HEADER.size:_HEADER.size + length], self.key)["records"]
+            if site not in index:
+                return None
+            offset, size = index[site]
+            start = _HEADER.size + length + offset
+            return _open_record(self._map[start:start + size], site, self.key)
+
+        token = self._find(_site_tag(site, self._lookup_key))
+        return _open_record(token, site, self.key) if token is not None else None
+
+    def get_by_id(self, record_id: str):
+        """Returns (site, creds) for a record id from the lookup table, or None."""
+        token = self._find(bytes.fromhex(record_id))
+        if token is None:
+            return None
+        record = decrypt_data(token, self.key)
+        if _site_tag(record["site"], self._lookup_key).hex() != record_id:
+            raise ValueError("Corrupted vault: record does not match its index entry.")
+        return record["site"], record["creds"]
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+# ---------------------
+# Log-Structured Container
+# ---------------------
+
+# Rough per-record bookkeeping on top of the strings themselves (dicts, tuple slots)
+_RECORD_OVERHEAD = 400
+
+def _record_size(site: str, creds: dict) -> int:
+    return sys.getsizeof(site) + sum(sys.getsizeof(v) for v in creds.values()) + _RECORD_OVERHEAD
+
+def estimate_size(data: dict) -> int:
+    """Approximate bytes held by a decrypted vault dict."""
+    return sum(_record_size(site, creds) for site, creds in data.items())
+
+class _LogState:
+    """Vault state rebuilt from a log, up to byte offset `end`."""
+
+    def __init__(self, log_id: bytes, fingerprint: bytes):
+        self.log_id = log_id
+        self.fingerprint = fingerprint
+        self.end = _LOG_HEADER.size
+        self.frames = 0
+        self.torn = False
+        self.data = {}
+        self.size = 0
+
+    def apply(self, entry: dict):
+        if entry["op"] == "hdr":
+            # First frame of every log; proves the key before anything is appended
+            if entry["log_id"] != self.log_id.hex():
+                raise ValueError("Corrupted vault: log header does not match.")
+            return
+        old = self.data.pop(entry["site"], None)
+        if old is not None:
+            self.size -= _record_size(entry["site"], old)
+        if entry["op"] == "put":
+            self.data[entry["site"]] = entry["creds"]
+            self.size += _record_size(entry["site"], entry["creds"])
+        self.frames += 1
+
+    @property
+    def garbage_ratio(self) -> float:
+        return 1 - len(self.data) / self.frames if self.frames else 0.0
+
+
+# Cached log snapshots by path, so reads only replay frames appended since the last one.
+# Each path has its own lock, which keeps threads sharing a snapshot from replaying
+# into it at the same time without making different vaults wait on each other.
+# Snapshots hold decrypted records, so like VaultCache they are capped by estimated
+# size: the least recently used are dropped first, and one larger than the cap is
+# never kept.
+LOG_CACHE_MAX_BYTES = 32 * 1024 * 1024
+_log_cache = OrderedDict()
+_log_cache_locks = {}
+_log_cache_guard = threading.Lock()
+
+def _cache_lock(path: str) -> threading.RLock:
+    with _log_cache_guard:
+        return _log_cache_locks.setdefault(os.path.abspath(path), threading.RLock())
+
+def clear_cache(path: str = None):
+    """Drops the cached decrypted snapshot (and this thread's connection) of `path`, or of every vault."""
+    with _log_cache_guard:
+        if path is not None:
+            _log_cache.pop(os.path.abspath(path), None)
+        else:
+            _log_cache.clear()
+    _close_sqlite(path)
+
+def _cache_log_state(cache_key: str, state: _LogState):
+    with _log_cache_guard:
+        _log_cache.pop(cache_key, None)
+        if state.size > LOG_CACHE_MAX_BYTES:
+            return
+        _log_cache[cache_key] = state
+        # Cached states grow in place as frames are replayed, so total them up again on every store
+        total = sum(s.size for s in _log_cache.values())
+        while total > LOG_CACHE_MAX_BYTES:
+            _, evicted = _log_cache.popitem(last=False)
+            total -= evicted.size
+
+def _replay_log(path: str, key: bytes) -> _LogState:
+    with _cache_lock(path):
+        fingerprint = hashlib.sha256(key).digest()
+        cache_key = os.path.abspath(path)
+        with open(path, "rb") as f:
+            magic, log_id = _LOG_HEADER.unpack(f.read(_LOG_HEADER.size))
+            if magic != MAGIC_LOG:
+                raise ValueError("Not a log-structured vault file.")
+
+            with _log_cache_guard:
+                state = _log_cache.get(cache_key)
+            if state is None or state.log_id != log_id or state.fingerprint != fingerprint:
+                state = _LogState(log_id, fingerprint)
+
+            f.seek(state.end)
+            state.torn = False
+            while True:
+                head = f.read(_FRAME.size)
+                if not head:
+                    break
+                length = _FRAME.unpack(head)[0] if len(head) == _FRAME.size else -1
+                token = f.read(length) if length >= 0 else b""
+                if length < 0 or len(token) < length:
+                    # An append was interrupted; everything before it is intact
+                    state.torn = True
+                    break
+                state.apply(decrypt_data(token, key))
+                state.end += _FRAME.size + length
+
+        _cache_log_state(cache_key, state)
+        return state
+
+def _frame(entry: dict, key: bytes) -> bytes:
+    token = encrypt_data(entry, key)
+    return _FRAME.pack(len(token)) + token
+
+def _write_log(path: str, key: bytes, data: dict):
+    """Atomically replaces `path` with a fresh log holding one put frame per record."""
+    log_id = os.urandom(16)
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(_LOG_HEADER.pack(MAGIC_LOG, log_id))
+        f.write(_frame({"op": "hdr", "log_id": log_id.hex()}, key))
+        for site, creds in data.items():
+            f.write(_frame({"op": "put", "site": site, "creds": creds}, key))
+        _sync(f, f.tell())
+    _commit(tmp, path)
+    clear_cache(path)
+
+def _append_log(path: str, key: bytes, entries: list):
+    """Appends put/delete frames and fsyncs them once before returning."""
+    with _cache_lock(path):
+        state = _replay_log(path, key)
+        frames = b"".join(_frame(entry, key) for entry in entries)
+        with open(path, "r+b") as f:
+            if state.torn:
+                f.truncate(state.end)
+            f.seek(state.end)
+            f.write(frames)
+            _sync(f, len(frames))
+        for entry in entries:
+            state.apply(entry)
+        state.end += len(frames)
+        _cache_log_state(os.path.abspath(path), state)
+
+        if state.frames >= COMPACT_MIN_FRAMES and state.garbage_ratio >= COMPACT_GARBAGE_RATIO:
+            _write_log(path, key, state.data)
+
+@_locked(exclusive=True)
+def compact_vault(key: bytes, path: str = VAULT_FILE):
+    """
+    Rewrites a log-structured vault as a fresh snapshot of its live records.
+
+    Returns (bytes before, bytes after), or None if the vault is not a log.
+    """
+    if detect_format(path) != FORMAT_LOG:
+        return None
+    before = os.path.getsize(path)
+    _write_log(path, key, _replay_log(path, key).data)
+    return before, os.path.getsize(path)
+
+# ---------------------
+# Streaming Container
+# ---------------------
+# The plaintext is a run of segments, each a length-prefixed batch of records
+# in the binary record encoding, sealed in fixed-size AES-GCM chunks. Reading
+# authenticates and decodes one chunk at a time, so neither side ever holds the
+# whole vault's ciphertext (or a base64 copy of it), and writes hand each chunk
+# to a writer thread while the next one is being encrypted. The header is bound
+# to every chunk as associated data. Chunks are sealed with a key derived from
+# the vault key and a salt fresh for every file, so nonce prefixes never repeat
+# under one key however often the vault is rewritten.
+
+STREAM_VERSION = 1
+STREAM_BATCH = 1024    # records per segment
+STREAM_PIPELINE = 4    # chunks encrypted ahead of the writer thread
+
+def _stream_segments(records):
+    batch = {}
+    for site, creds in records:
+        batch[site] = creds
+        if len(batch) >= STREAM_BATCH:
+            payload = recordcodec.encode(batch, recordcodec.ENCODING_RECORDS)
+            yield _SEGMENT.pack(len(payload)) + payload
+            batch = {}
+    if batch:
+        payload = recordcodec.encode(batch, recordcodec.ENCODING_RECORDS)
+        yield _SEGMENT.pack(len(payload)) + payload
+
+def _write_chunks(f, chunks, depth: int = STREAM_PIPELINE) -> int:
+    """
+    Writes `chunks` to `f` from a second thread, so the file I/O of one chunk
+    overlaps producing the next. Returns the number of bytes written.
+    """
+    pending = queue.Queue(maxsize=depth)
+    failed = []
+
+    def writer():
+        while True:
+            chunk = pending.get()
+            if chunk is None:
+                return
+            if not failed:
+                try:
+                    f.write(chunk)
+                except Exception as e:
+                    failed.append(e)
+
+    thread = threading.Thread(target=writer, name="vault-writer", daemon=True)
+    thread.start()
+    written = 0
+    try:
+        for chunk in chunks:
+            if failed:
+                break
+            pending.put(chunk)
+            written += len(chunk)
+    finally:
+        pending.put(None)
+        thread.join()
+    if failed:
+        raise failed[0]
+    return written
+
+def _write_stream(path: str, key: bytes, records):
+    """Writes (site, creds) pairs, consumed lazily, as a streaming vault."""
+    import streamcrypt
+
+    salt, prefix = os.urandom(16), os.urandom(streamcrypt.NONCE_PREFIX_SIZE)
+    chunk_size = streamcrypt.CHUNK_SIZE
+    header = _STREAM_HEADER.pack(MAGIC_STREAM, STREAM_VERSION, salt, prefix, chunk_size)
+    chunks = streamcrypt.seal_stream(derive_subkey(key, "stream", salt), prefix, _stream_segments(records),
+                                     aad=header, chunk_size=chunk_size)
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(header)
+        written = _write_chunks(f, chunks)
+        _sync(f, len(header) + written)
+    _commit(tmp, path)
+
+def _open_stream(f, key: bytes):
+    """Yields the plaintext chunks of the streaming vault open as `f`, each authenticated before it is yielded."""
+    import streamcrypt
+
+    header = f.read(_STREAM_HEADER.size)
+    if len(header) != _STREAM_HEADER.size:
+        raise ValueError("Not a streaming vault file.")
+    magic, version, salt, prefix, chunk_size = _STREAM_HEADER.unpack(header)
+    if magic != MAGIC_STREAM or version != STREAM_VERSION:
+        raise ValueError("Not a streaming vault file.")
+    chunks = streamcrypt.open_stream(derive_subkey(key, "stream", salt), prefix, f, aad=header, chunk_size=chunk_size)
+    try:
+        for chunk in chunks:
+            metrics.inc("vault_bytes_read_total", len(chunk))
+            yield chunk
+    except ValueError:
+        raise ValueError("Incorrect master password or corrupted vault.")
+
+def _iter_stream(f, key: bytes):
+    """Yields (site, creds) from the streaming vault open as `f`, decoding each segment once it is complete."""
+    buffer = bytearray()
+    for chunk in _open_stream(f, key):
+        buffer += chunk
+        start = 0
+        while len(buffer) - start >= _SEGMENT.size:
+            length, = _SEGMENT.unpack_from(buffer, start)
+            end = start + _SEGMENT.size + length
+            if end > len(buffer):
+                break
+            yield from recordcodec.decode(bytes(buffer[start + _SEGMENT.size:end])).items()
+            start = end
+        del buffer[:start]
+    if buffer:
+        raise ValueError("Corrupted vault: the last record batch is incomplete.")
+
+# ---------------------
+# SQLite Container
+# ---------------------
+# Each record is a row keyed by its keyed site tag (see record_id) and holding
+# the same sealed token as a v2 record, so neither site names nor credentials
+# are stored in the clear. The database runs in WAL mode: readers keep reading
+# their snapshot while a writer commits. Every thread keeps one connection per
+# vault, whose statements sqlite3 prepares once and caches, and reconnects if
+# the file was replaced (a migration) or the process forked.
+
+_SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value BLOB NOT NULL);
+CREATE TABLE IF NOT EXISTS records (
+    id INTEGER PRIMARY KEY,
+    tag BLOB NOT NULL UNIQUE,
+    token BLOB NOT NULL
+);
+"""
+_SQL_GET = "SELECT token FROM records WHERE tag = ?"
+_SQL_SCAN = "SELECT token FROM records ORDER BY id"
+_SQL_PUT = "INSERT INTO records (tag, token) VALUES (?, ?) ON CONFLICT (tag) DO UPDATE SET token = excluded.token"
+_SQL_DELETE = "DELETE FROM records WHERE tag = ?"
+_SQL_KEY_CHECK = "SELECT value FROM meta WHERE name = 'key_check'"
+
+_connections = threading.local()
+
+def _sqlite(path: str) -> sqlite3.Connection:
+    """This thread's connection to the SQLite vault at `path`, opened (and the schema created) on first use."""
+    conns = _connections.__dict__.setdefault("conns", {})
+    path = os.path.abspath(path)
+    cached = conns.get(path)
+    try:
+        ino = os.stat(path).st_ino
+    except FileNotFoundError:
+        ino = None
+    if cached is not None:
+        conn, conn_ino, pid = cached
+        if conn_ino == ino and pid == os.getpid():
+            return conn
+        _close_sqlite(path)
+
+    conn = sqlite3.connect(path, isolation_level=None, cached_statements=32)
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = FULL")
+    conn.execute("PRAGMA busy_timeout = 10000")
+    conn.executescript(_SQLITE_SCHEMA)
+    conns[path] = (conn, os.stat(path).st_ino, os.getpid())
+    return conn
+
+def _close_sqlite(path: str = None):
+    """Closes this thread's connection to `path`, or all of them."""
+    conns = _connections.__dict__.setdefault("conns", {})
+    for name in [os.path.abspath(path)] if path else [*conns]:
+        cached = conns.pop(name, None)
+        # A connection inherited across fork belongs to the parent; leave it alone
+        if cached is not None and cached[2] == os.getpid():
+            cached[0].close()
+
+def _sqlite_lookup_key(conn: sqlite3.Connection, key: bytes) -> bytes:
+    lookup_key = derive_subkey(key, "lookup")
+    row = conn.execute(_SQL_KEY_CHECK).fetchone()
+    if row is not None and not hmac.compare_digest(row[0], _key_check(lookup_key)):
+        raise ValueError("Incorrect master password or corrupted vault.")
+    return lookup_key
+
+def _sqlite_get(path: str, key: bytes, site: str):
+    conn = _sqlite(path)
+    row = conn.execute(_SQL_GET, (_site_tag(site, _sqlite_lookup_key(conn, key)),)).fetchone()
+    return _open_record(row[0], site, key) if row else None
+
+def _sqlite_get_by_id(path: str, key: bytes, record_ids) -> dict:
+    conn = _sqlite(path)
+    lookup_key = _sqlite_lookup_key(conn, key)
+    found = {}
+    for rid in record_ids:
+        row = conn.execute(_SQL_GET, (bytes.fromhex(rid),)).fetchone()
+        if row is None:
+            continue
+        record = decrypt_data(row[0], key)
+        if _site_tag(record["site"], lookup_key).hex() != rid:
+            raise ValueError("Corrupted vault: record does not match its index entry.")
+        found[record["site"]] = record["creds"]
+    return found
+
+def _sqlite_load(path: str, key: bytes) -> dict:
+    conn = _sqlite(path)
+    _sqlite_lookup_key(conn, key)
+    data = {}
+    for (token,) in conn.execute(_SQL_SCAN):
+        record = decrypt_data(token, key)
+        data[record["site"]] = record["creds"]
+    return data
+
+def _sqlite_apply(conn: sqlite3.Connection, key: bytes, changes: dict, replace: bool = False) -> int:
+    """
+    Applies {site: creds or None} in one transaction, after emptying the vault
+    if `replace`. Returns the number of rows deleted.
+    """
+    lookup_key = _sqlite_lookup_key(conn, key)
+    deleted = written = 0
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        if replace:
+            conn.execute("DELETE FROM records")
+        conn.execute("INSERT OR IGNORE INTO meta (name, value) VALUES ('key_check', ?)", (_key_check(lookup_key),))
+        for site, creds in changes.items():
+            tag = _site_tag(site, lookup_key)
+            if creds is None:
+                deleted += conn.execute(_SQL_DELETE, (tag,)).rowcount
+            else:
+                token = _seal_record(site, creds, key)
+                conn.execute(_SQL_PUT, (tag, token))
+                written += len(token)
+        with metrics.span("sqlite_commit"):
+            conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    metrics.inc("vault_bytes_written_total", written)
+    return deleted
+
+def _write_sqlite(path: str, key: bytes, data: dict, rekey: bool = False):
+    """
+    Replaces the vault's contents with `data`: in one transaction if it is
+    already SQLite, else (new or migrated) via a new file. A SQLite vault under
+    another key raises ValueError, unless `rekey` says to rebuild it under `key`.
+    """
+    if _is_sqlite(path):
+        conn = _sqlite(path)
+        if not rekey:
+            _sqlite_apply(conn, key, data, replace=True)
+            return
+        _leave_sqlite(path)
+
+    tmp = path + ".tmp"
+    for leftover in (tmp, tmp + "-wal", tmp + "-shm"):
+        if os.path.exists(leftover):
+            os.remove(leftover)
+    try:
+        _sqlite_apply(_sqlite(tmp), key, data)
+    finally:
+        _close_sqlite(tmp)  # checkpoints the WAL into the file and removes it
+    # A WAL left next to the new file would be replayed into it
+    _drop_sqlite_sidecars(path)
+    _commit(tmp, path)
+
+def _leave_sqlite(path: str):
+    """Folds a SQLite vault's WAL into the file before the file is replaced."""
+    if _is_sqlite(path):
+        _sqlite(path).execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        _close_sqlite(path)
+
+def _drop_sqlite_sidecars(path: str):
+    for sidecar in (path + "-wal", path + "-shm"):
+        if os.path.exists(sidecar):
+            os.remove(sidecar)
+
+# ---------------------
+# Vault Access
+# ---------------------
+
+@_locked(exclusive=False)
+def check_key(key: bytes, path: str = VAULT_FILE) -> bool:
+    """True if `key` opens the vault, checked as cheaply as its format allows."""
+    if not os.path.exists(path):
+        return False
+    try:
+        fmt = detect_format(path)
+        if fmt == FORMAT_V2:
+            with VaultReader(path, key) as reader:
+                if not reader.indexed:
+                    with open(path, "rb") as f:
+                        _read_index(f, key)
+        elif fmt == FORMAT_LOG:
+            with open(path, "rb") as f:
+                f.seek(_LOG_HEADER.size)
+                length = _FRAME.unpack(f.read(_FRAME.size))[0]
+                decrypt_data(f.read(length), key)
+        elif fmt == FORMAT_SQLITE:
+            _sqlite_lookup_key(_sqlite(path), key)
+        elif fmt == FORMAT_STREAM:
+            with open(path, "rb") as f:
+                next(_open_stream(f, key))  # authenticating the first chunk is enough
+        else:
+            with open(path, "rb") as f:
+                return token_signed(f.read(), key)  # no need to decrypt and parse it all
+    except (ValueError, struct.error):
+        return False
+    return True
+
+@_locked(exclusive=False)
+def load_vault(key: bytes, path: str = VAULT_FILE) -> dict:
+    """Decrypts and returns every credential in the vault, whatever its format."""
+    fmt = detect_format(path)
+    if fmt == FORMAT_LOG:
+        return {site: dict(creds) for site, creds in _replay_log(path, key).data.items()}
+    if fmt == FORMAT_SQLITE:
+        return _sqlite_load(path, key)
+    if fmt == FORMAT_STREAM:
+        with open(path, "rb") as f:
+            return dict(_iter_stream(f, key))
+
+    if fmt == FORMAT_V1:
+        with open(path, "rb") as f:
+            return decrypt_data(f.read(), key)
+    return dict(iter_vault(key, path))
+
+def iter_vault(key: bytes, path: str = VAULT_FILE):
+    """
+    Yields (site, creds) in vault order; v2 records are decrypted one at a
+    time as they are reached, streaming vaults one chunk at a time.
+    """
+    fmt = detect_format(path)
+    if fmt not in (FORMAT_V2, FORMAT_STREAM):
+        yield from load_vault(key, path).items()
+        return
+    # Writers replace these files rather than modify them, so once the file is
+    # open the records can be streamed without holding the lock
+    with vault_lock(path):
+        f = open(path, "rb")
+    with f:
+        if fmt == FORMAT_STREAM:
+            yield from _iter_stream(f, key)
+            return
+        index, start = _read_index(f, key)
+        for site, (offset, length) in index.items():
+            f.seek(start + offset)
+            yield site, _open_record(f.read(length), site, key)
+
+@_locked(exclusive=False)
+def get_record(key: bytes, site: str, path: str = VAULT_FILE):
+    """Returns the credentials for one site, or None. v2 vaults decrypt only that record."""
+    fmt = detect_format(path)
+    if fmt == FORMAT_V1:
+        return load_vault(key, path).get(site)
+    if fmt == FORMAT_LOG:
+        creds = _replay_log(path, key).data.get(site)
+        return dict(creds) if creds is not None else None
+    if fmt == FORMAT_SQLITE:
+        return _sqlite_get(path, key, site)
+    if fmt == FORMAT_STREAM:
+        with open(path, "rb") as f:
+            return next((creds for name, creds in _iter_stream(f, key) if name == site), None)
+    with VaultReader(path, key) as reader:
+        return reader.get(site)
+
+@_locked(exclusive=False)
+def get_records_by_id(key: bytes, record_ids, path: str = VAULT_FILE) -> dict:
+    """Returns {site: creds} for the given record ids, decrypting only those records when the format allows it."""
+    fmt = detect_format(path)
+    if fmt == FORMAT_SQLITE:
+        return _sqlite_get_by_id(path, key, record_ids)
+    if fmt == FORMAT_V2:
+        with VaultReader(path, key) as reader:
+            if reader.indexed:
+                found = (reader.get_by_id(record_id) for record_id in record_ids)
+                return dict(record for record in found if record is not None)
+    wanted = set(record_ids)
+    return {site: creds for site, creds in load_vault(key, path).items() if record_id(key, site) in wanted}
+
+@_locked(exclusive=False)
+def search_records(key: bytes, query: str, path: str = VAULT_FILE) -> dict:
+    """
+    Returns {site: creds} for sites whose name (or username, if indexed) contains `query`.
+
+    With a search index only the candidate records are decrypted; without one,
+    or for queries shorter than a trigram, every record is scanned.
+    """
+    index = searchindex.load(key, searchindex.index_path(path))
+    if index is None or len(query) < searchindex.NGRAM:
+        index = index or searchindex.SearchIndex(key)
+        candidates = load_vault(key, path)
+    else:
+        candidates = get_records_by_id(key, index.lookup(query), path)
+    return {site: creds for site, creds in candidates.items() if index.matches(query, site, creds)}
+
+@_locked(exclusive=True)
+def reindex_vault(key: bytes, path: str = VAULT_FILE, fields=None) -> int:
+    """Rebuilds the search index from scratch. Returns the number of records indexed."""
+    idx_path = searchindex.index_path(path)
+    if fields is None:
+        existing = searchindex.load(key, idx_path)
+        fields = existing.fields if existing else ["site"]
+    index = searchindex.SearchIndex(key, fields)
+    data = load_vault(key, path)
+    for site, creds in data.items():
+        index.add(record_id(key, site), site, creds)
+    index.save(idx_path)
+    return len(data)
+
+def _update_index(key: bytes, path: str, changes: dict):
+    """Keeps an existing search index in step with {site: creds, or None for a delete}."""
+    idx_path = searchindex.index_path(path)
+    index = searchindex.load(key, idx_path)
+    if index is None:
+        return
+    for site, creds in changes.items():
+        if creds is None:
+            index.remove(record_id(key, site))
+        else:
+            index.add(record_id(key, site), site, creds)
+    index.save(idx_path)
+
+@_locked(exclusive=False)
+def list_sites(key: bytes, path: str = VAULT_FILE) -> list:
+    """Returns the site names in the vault; v2 vaults decrypt only the index."""
+    fmt = detect_format(path)
+    if fmt == FORMAT_V2:
+        with open(path, "rb") as f:
+            return [*_read_index(f, key)[0]]
+    if fmt == FORMAT_LOG:
+        return [*_replay_log(path, key).data]
+    if fmt == FORMAT_STREAM:
+        with open(path, "rb") as f:
+            return [site for site, _ in _iter_stream(f, key)]
+    return [*load_vault(key, path)]
+
+@_locked(exclusive=True)
+def save_vault(data: dict, key: bytes, path: str = VAULT_FILE, fmt: str = None, expected_version: str = None,
+               rekey: bool = False):
+    """
+    Encrypts and writes the whole vault, keeping the file's current format by default.
+
+    Like every write, it raises VersionConflict if `expected_version` is given
+    and no longer matches the file (see vault_version). `rekey` is for moving
+    the vault to a new key: without it, a SQLite vault refuses a key it
+    wasn't written with.
+    """
+    _check_version(path, expected_version)
+    fmt = fmt or _format_for_write(path)
+    if fmt == FORMAT_SQLITE:
+        _write_sqlite(path, key, data, rekey)
+        return
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown vault format: {fmt}")
+
+    _leave_sqlite(path)
+    if fmt == FORMAT_V1:
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(encrypt_data(data, key, DEFAULT_ENCODING))
+            _sync(f, f.tell())
+        _commit(tmp, path)
+    elif fmt == FORMAT_V2:
+        layout = []
+        for site, creds in data.items():
+            token = _seal_record(site, creds, key)
+            layout.append((site, len(token), token))
+        _write_v2(path, key, layout)
+    elif fmt == FORMAT_STREAM:
+        _write_stream(path, key, data.items())
+    else:
+        _write_log(path, key, data)
+    _drop_sqlite_sidecars(path)
+
+@_locked(exclusive=True)
+def put_records(key: bytes, records: dict, path: str = VAULT_FILE, expected_version: str = None):
+    """Adds or replaces the credentials for many sites in a single write; a None value removes the site."""
+    _check_version(path, expected_version)
+    fmt = _format_for_write(path)
+    if fmt == FORMAT_LOG and os.path.exists(path):
+        _append_log(path, key, [{"op": "put", "site": site, "creds": creds} if creds is not None
+                                else {"op": "del", "site": site} for site, creds in records.items()])
+    elif fmt == FORMAT_SQLITE:
+        _sqlite_apply(_sqlite(path), key, records)
+    elif fmt == FORMAT_V2:
+        _rewrite_v2(path, key, records)
+    else:
+        data = load_vault(key, path) if os.path.exists(path) else {}
+        for site, creds in records.items():
+            if creds is None:
+                data.pop(site, None)
+            else:
+                data[site] = creds
+        save_vault(data, key, path)
+    _update_index(key, path, records)
+
+def put_record(key: bytes, site: str, creds: dict, path: str = VAULT_FILE, expected_version: str = None):
+    """Adds or replaces the credentials for one site."""
+    put_records(key, {site: creds}, path, expected_version)
+
+@_locked(exclusive=True)
+def delete_record(key: bytes, site: str, path: str = VAULT_FILE, expected_version: str = None) -> bool:
+    """Removes one site. Returns False if it was not in the vault."""
+    _check_version(path, expected_version)
+    fmt = detect_format(path)
+    if fmt == FORMAT_LOG:
+        if site not in _replay_log(path, key).data:
+            return False
+        _append_log(path, key, [{"op": "del", "site": site}])
+        _update_index(key, path, {site: None})
+        return True
+
+    if fmt == FORMAT_SQLITE:
+        if not _sqlite_apply(_sqlite(path), key, {site: None}):
+            return False
+        _update_index(key, path, {site: None})
+        return True
+
+    if fmt == FORMAT_V2:
+        with open(path, "rb") as f:
+            index, _ = _read_index(f, key)
+        if site not in index:
+            return False
+        _rewrite_v2(path, key, {site: None})
+        _update_index(key, path, {site: None})
+        return True
+
+    data = load_vault(key, path)
+    if site not in data:
+        return False
+    del data[site]
+    save_vault(data, key, path)
+    _update_index(key, path, {site: None})
+    return True
+
+@_locked(exclusive=True)
+def migrate_vault(key: bytes, path: str = VAULT_FILE, fmt: str = DEFAULT_FORMAT):
+    """Re-encrypts the vault into `fmt`. Returns the format it was in before."""
+    old_fmt = detect_format(path)
+    if old_fmt != fmt and fmt == FORMAT_STREAM and old_fmt != FORMAT_SQLITE:
+        # Straight from the old file into the new one, without the whole vault in memory
+        _write_stream(path, key, iter_vault(key, path))
+    elif old_fmt != fmt:
+        save_vault(load_vault(key, path), key, path, fmt)
+    return old_fmt
+
+# ---------------------
+# Re-keying
+# ---------------------
+
+@_locked(exclusive=True)
+def rekey_vault(old_key: bytes, new_key: bytes, path: str = VAULT_FILE):
+    """Re-encrypts every record, and the search index if there is one, under `new_key`, keeping the format."""
+    index = searchindex.load(old_key, searchindex.index_path(path))
+    fmt = detect_format(path)
+    if fmt == FORMAT_STREAM:
+        _write_stream(path, new_key, iter_vault(old_key, path))
+    else:
+        save_vault(load_vault(old_key, path), new_key, path, fmt, rekey=True)
+    clear_cache(path)
+    if index is not None:
+        reindex_vault(new_key, path, index.fields)
+
+def _promote(header: dict, pending: dict) -> dict:
+    return {"salt": pending["salt"], "kdf": pending["kdf"],
+            "history": header["history"] + [{"salt": header["salt"], "kdf": header["kdf"]}]}
+
+def unlock(master_password: str, path: str = VAULT_FILE, salt_file: str = SALT_FILE) -> bytes:
+    """
+    Returns the vault key for the master password, creating a new vault's
+    random data key (see vault.new_envelope_header) on first use.
+
+    If the header's KDF parameters are not the ones this host is configured
+    for, vaults with a data key just have it rewrapped. Older vaults are
+    re-encrypted; the new parameters are recorded in the header as pending
+    first, so a re-key cut short is finished (or dropped, if the vault was
+    never rewritten) by the next unlock. Raises ValueError if the password
+    can't unwrap the data key.
+    """
+    header = read_kdf_header(salt_file)
+    if header is None:
+        with vault_lock(path, exclusive=True):
+            header = read_kdf_header(salt_file)  # another process may have created it meanwhile
+            if header is None:
+                header, data_key = new_envelope_header(master_password)
+                write_kdf_header(header, salt_file)
+                return data_key
+    if "dek" in header:
+        return _unlock_envelope(master_password, path, salt_file, header)
+    if not os.path.exists(path):
+        return generate_key(master_password, salt_file)
+    if "pending" not in header and header["kdf"] == target_kdf():
+        return derive_key(master_password, bytes.fromhex(header["salt"]), header["kdf"])
+
+    with vault_lock(path, exclusive=True):
+        header = read_kdf_header(salt_file)  # another process may have re-keyed meanwhile
+        key = derive_key(master_password, bytes.fromhex(header["salt"]), header["kdf"])
+        pending = header.pop("pending", None)
+        if pending is not None:
+            new_key = derive_key(master_password, bytes.fromhex(pending["salt"]), pending["kdf"])
+            if check_key(new_key, path):
+                write_kdf_header(_promote(header, pending), salt_file)
+                return new_key
+            if check_key(key, path):
+                write_kdf_header(header, salt_file)
+
+        # Only the right password may re-key; a wrong one fails later as usual
+        if header["kdf"] == target_kdf() or not check_key(key, path):
+            return key
+        pending = {"salt": generate_salt().hex(), "kdf": target_kdf()}
+        write_kdf_header({**header, "pending": pending}, salt_file)
+        new_key = derive_key(master_password, bytes.fromhex(pending["salt"]), pending["kdf"])
+        rekey_vault(key, new_key, path)
+        write_kdf_header(_promote(header, pending), salt_file)
+        return new_key
+
+def _unlock_envelope(master_password: str, path: str, salt_file: str, header: dict) -> bytes:
+    data_key = unwrap_key(header["dek"], master_key(master_password, header))
+    if "rotating" not in header and header["kdf"] == target_kdf():
+        return data_key
+
+    with vault_lock(path, exclusive=True):
+        header = read_kdf_header(salt_file)
+        wrapping_key = master_key(master_password, header)
+        data_key = unwrap_key(header["dek"], wrapping_key)
+        rotating = header.get("rotating")
+        if rotating is not None and os.path.exists(path) and not check_key(data_key, path):
+            # A rotation was cut short after the vault was rewritten: finish it
+            new_key = unwrap_key(rotating["dek"], wrapping_key)
+            if check_key(new_key, path):
+                header = _rotated(header)
+                write_kdf_header(header, salt_file)
+                data_key = new_key
+        if header["kdf"] != target_kdf():
+            write_kdf_header(_rewrapped(header, master_password, master_password), salt_file)
+        return data_key
+
+def _rewrapped(header: dict, old_password: str, new_password: str) -> dict:
+    """
+    The header with every key in it wrapped by `new_password` under a fresh
+    salt and this host's KDF. The vault itself is untouched.
+
+    A header without a data key gets one: the key the old password derives,
+    which encrypts the vault already. So do the keys of earlier re-keys, which
+    no longer derive from the new password.
+    """
+    old_wrapping_key = master_key(old_password, header)
+    new = {"salt": generate_salt().hex(), "kdf": target_kdf()}
+    new_wrapping_key = master_key(new_password, new)
+
+    def rewrap(entry: dict) -> str:
+        key = unwrap_key(entry["dek"], old_wrapping_key) if "dek" in entry else master_key(old_password, entry)
+        return wrap_key(key, new_wrapping_key)
+
+    new["dek"] = rewrap(header) if "dek" in header else wrap_key(old_wrapping_key, new_wrapping_key)
+    if header.get("derived") or "dek" not in header:
+        new["derived"] = True
+    new["history"] = [{"dek": rewrap(old)} for old in header["history"]]
+    if "rotating" in header:
+        new["rotating"] = {**header["rotating"], "dek": rewrap(header["rotating"])}
+    return new
+
+@_locked(exclusive=True)
+def change_master_password(old_password: str, new_password: str, path: str = VAULT_FILE,
+                           salt_file: str = SALT_FILE):
+    """
+    Makes `new_password` the one that unlocks the vault by rewrapping its data
+    key; the vault is not re-encrypted. Raises ValueError if `old_password` is wrong.
+    """
+    key = unlock(old_password, path, salt_file)  # settles any pending re-key first
+    if os.path.exists(path) and not check_key(key, path):
+        raise ValueError("Incorrect master password.")
+    write_kdf_header(_rewrapped(read_kdf_header(salt_file), old_password, new_password), salt_file)
+
+# ---------------------
+# Data Key Rotation
+# ---------------------
+# Rotating the data key re-encrypts every record under a new random key. The
+# new key is recorded in the header first (wrapped, as "rotating"), then the
+# records are streamed out of the vault into a log-structured side file under
+# the new key, one fsynced batch at a time. A rotation cut short resumes from
+# the side file, unless the vault has been written since. Once every record is
+# there, the side file replaces the vault (converted back to the vault's
+# format), and the old data key moves to the header's history.
+
+ROTATE_SUFFIX = ".rotate"
+ROTATE_BATCH = 1000
+
+def _rotated(header: dict) -> dict:
+    """The header once its rotation is done: the new data key in use, the old one in the history."""
+    rotated = {name: value for name, value in header.items() if name not in ("rotating", "derived")}
+    rotated["history"] = header["history"] + [{"dek": header["dek"]}]
+    rotated["dek"] = header["rotating"]["dek"]
+    return rotated
+
+def _reencrypt(old_key: bytes, new_key: bytes, path: str, resume: bool, batch_size: int, progress) -> int:
+    """Copies every record into the side file under `new_key`, skipping those a previous run copied."""
+    side = path + ROTATE_SUFFIX
+    clear_cache(side)
+    if resume and os.path.exists(side):
+        done = set(_replay_log(side, new_key).data)
+    else:
+        _write_log(side, new_key, {})
+        done = set()
+
+    count, batch = len(done), []
+    for site, creds in iter_vault(old_key, path):
+        if site in done:
+            continue
+        batch.append({"op": "put", "site": site, "creds": creds})
+        if len(batch) >= batch_size:
+            _append_log(side, new_key, batch)
+            count += len(batch)
+            batch = []
+            if progress:
+                progress(count)
+    if batch:
+        _append_log(side, new_key, batch)
+        count += len(batch)
+    return count
+
+def _install(side: str, new_key: bytes, path: str, fmt: str):
+    """Replaces the vault with the side file's records, in the vault's own format."""
+    if fmt == FORMAT_LOG:
+        _commit(side, path)
+    else:
+        records = _replay_log(side, new_key).data
+        if fmt == FORMAT_STREAM:
+            _write_stream(path, new_key, records.items())
+        else:
+            save_vault(records, new_key, path, fmt, rekey=True)
+        os.remove(side)
+    clear_cache(side)
+    clear_cache(path)
+
+@_locked(exclusive=True)
+def rotate_data_key(master_password: str, path: str = VAULT_FILE, salt_file: str = SALT_FILE,
+                    batch_size: int = ROTATE_BATCH, progress=None):
+    """
+    Re-encrypts the vault, and its search index, under a new random data key.
+    `progress`, if given, is called with the number of records copied so far.
+
+    Returns (new key, records re-encrypted). Raises ValueError for a wrong password.
+    """
+    from cryptography.fernet import Fernet
+
+    key = unlock(master_password, path, salt_file)
+    if os.path.exists(path) and not check_key(key, path):
+        raise ValueError("Incorrect master password.")
+    header = read_kdf_header(salt_file)
+    if "dek" not in header:
+        header = _rewrapped(header, master_password, master_password)
+    wrapping_key = master_key(master_password, header)
+
+    version = vault_version(path)
+    rotating = header.get("rotating")
+    resume = rotating is not None and rotating.get("version") == version
+    if rotating is None:
+        new_key = Fernet.generate_key()
+        rotating = {"dek": wrap_key(new_key, wrapping_key)}
+    else:
+        new_key = unwrap_key(rotating["dek"], wrapping_key)
+    # A side file from before the vault was last written may be missing changes
+    header["rotating"] = {**rotating, "version": version}
+    write_kdf_header(header, salt_file)
+
+    count = 0
+    if os.path.exists(path):
+        index = searchindex.load(key, searchindex.index_path(path))
+        fmt = detect_format(path)
+        count = _reencrypt(key, new_key, path, resume, batch_size, progress)
+        _install(path + ROTATE_SUFFIX, new_key, path, fmt)
+        if index is not None:
+            reindex_vault(new_key, path, index.fields)
+    write_kdf_header(_rotated(header), salt_file)
+    return new_key, count
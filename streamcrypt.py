@@ -0,0 +1,66 @@
+import struct
+
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+CHUNK_SIZE = 64 * 1024
+NONCE_PREFIX_SIZE = 7
+TAG_SIZE = 16
+
+# ---------------------
+# Chunked AES-GCM (STREAM construction)
+# ---------------------
+# Each chunk is sealed on its own with nonce = prefix | chunk counter | last-chunk flag.
+# Reordering, dropping or duplicating chunks breaks the counter, and cutting the
+# stream short leaves no chunk sealed as "last", so truncation is detected too.
+
+def _nonce(prefix: bytes, counter: int, last: bool) -> bytes:
+    return prefix + struct.pack(">IB", counter, 1 if last else 0)
+
+def _rechunk(pieces, size: int):
+    """Regroups an iterable of byte strings into `size`-byte chunks (the final one may be shorter)."""
+    buffer = bytearray()
+    for piece in pieces:
+        buffer += piece
+        while len(buffer) >= size:
+            yield bytes(buffer[:size])
+            del buffer[:size]
+    yield bytes(buffer)
+
+def seal_stream(key: bytes, nonce_prefix: bytes, pieces, aad: bytes = b"", chunk_size: int = CHUNK_SIZE):
+    """
+    Encrypts an iterable of plaintext byte strings, yielding ciphertext chunks
+    as soon as each is full, so the plaintext never has to be held in memory.
+    """
+    aesgcm = AESGCM(key)
+    counter = 0
+    pending = None
+    for chunk in _rechunk(pieces, chunk_size):
+        if pending is not None:
+            yield aesgcm.encrypt(_nonce(nonce_prefix, counter, False), pending, aad)
+            counter += 1
+        pending = chunk
+    yield aesgcm.encrypt(_nonce(nonce_prefix, counter, True), pending, aad)
+
+def open_stream(key: bytes, nonce_prefix: bytes, fileobj, aad: bytes = b"", chunk_size: int = CHUNK_SIZE):
+    """
+    Decrypts chunks written by `seal_stream` from `fileobj`, yielding each
+    plaintext chunk once it has been authenticated.
+
+    Raises ValueError if any chunk was altered, reordered or the stream was cut short.
+    """
+    aesgcm = AESGCM(key)
+    size = chunk_size + TAG_SIZE
+    counter = 0
+    chunk = fileobj.read(size)
+    while True:
+        following = fileobj.read(size) if len(chunk) == size else b""
+        last = not following
+        try:
+            yield aesgcm.decrypt(_nonce(nonce_prefix, counter, last), chunk, aad)
+        except InvalidTag:
+            raise ValueError("Encrypted stream is corrupted or truncated.")
+        if last:
+            return
+        chunk = following
+        counter += 1
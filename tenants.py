@@ -0,0 +1,126 @@
+import hashlib
+import os
+import re
+import tempfile
+
+import bcrypt
+
+import audit
+import metrics
+import searchindex
+import storage
+import totp
+import vault
+
+# Each user of the web app gets a directory of their own under TENANTS_DIR,
+# holding everything the single-user layout keeps in the working directory:
+# salt, master password hash, TOTP secret, vault and audit log. Directories are
+# sharded by a hash of the user ID ("ab/cd/abcd...") so no directory grows
+# large, and the ID itself never appears on disk.
+TENANTS_DIR = os.environ.get("VAULT_TENANTS_DIR", "tenants")
+MASTER_HASH_FILE = "master.hash"
+
+_USER_ID = re.compile(r"^[a-z0-9][a-z0-9._@+-]{0,127}$")
+
+
+def normalize_user_id(user_id: str) -> str:
+    """Canonical form of a user ID; raises ValueError if it isn't acceptable."""
+    normalized = (user_id or "").strip().lower()
+    if not _USER_ID.match(normalized):
+        raise ValueError("User IDs are 1-128 letters, digits or . _ @ + - characters.")
+    return normalized
+
+def shard_path(user_id: str, root: str = None) -> str:
+    digest = hashlib.sha256(normalize_user_id(user_id).encode()).hexdigest()
+    return os.path.join(root or TENANTS_DIR, digest[:2], digest[2:4], digest)
+
+
+class Tenant:
+    """The files belonging to one user. `user_id` is None for the single-user layout."""
+
+    def __init__(self, directory: str, user_id: str = None):
+        self.directory = directory
+        self.user_id = user_id
+        if user_id is None:
+            self.vault_file = storage.VAULT_FILE
+            self.salt_file = vault.SALT_FILE
+            self.master_hash_file = MASTER_HASH_FILE
+            self.totp_secret_file = None  # TOTP_SECRET may override it (see totp.py)
+            self.audit_log = None  # the default writer's log
+            self.last_access_file = vault.LOCK_FILE
+        else:
+            self.vault_file = os.path.join(directory, "vault.json.enc")
+            self.salt_file = os.path.join(directory, "salt.bin")
+            self.master_hash_file = os.path.join(directory, "master.hash")
+            self.totp_secret_file = os.path.join(directory, "totp_secret.txt")
+            self.audit_log = os.path.join(directory, "vault_audit.log")
+            self.last_access_file = os.path.join(directory, ".last_access")
+
+    @classmethod
+    def for_user(cls, user_id: str, root: str = None) -> "Tenant":
+        return cls(shard_path(user_id, root), normalize_user_id(user_id))
+
+    @classmethod
+    def legacy(cls, **paths) -> "Tenant":
+        """The single-user layout in the working directory; `paths` override its file names."""
+        tenant = cls(".")
+        for name, path in paths.items():
+            setattr(tenant, name, path)
+        return tenant
+
+    @property
+    def audit_path(self) -> str:
+        return self.audit_log or audit.AUDIT_LOG_FILE
+
+    def exists(self) -> bool:
+        return os.path.exists(self.master_hash_file)
+
+    def create(self, master_password: str):
+        """
+        Creates the user's directory and master password hash; the rest is created on first use.
+
+        Raises FileExistsError if someone else created it first.
+        """
+        with metrics.span("bcrypt"):
+            hashed = bcrypt.hashpw(master_password.encode(), bcrypt.gensalt())
+        os.makedirs(self.directory, mode=0o700, exist_ok=True)
+        # The hash appears complete or not at all: written aside, then linked
+        # into place, which fails if the name is taken
+        fd, tmp = tempfile.mkstemp(dir=self.directory, prefix=".master.hash.")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(hashed)
+                f.flush()
+                os.fsync(f.fileno())
+            os.link(tmp, self.master_hash_file)
+        finally:
+            os.remove(tmp)
+
+    def set_master_password(self, master_password: str):
+        """Replaces the master password hash (see storage.change_master_password for the vault's side)."""
+        with metrics.span("bcrypt"):
+            hashed = bcrypt.hashpw(master_password.encode(), bcrypt.gensalt())
+        tmp = self.master_hash_file + ".tmp"
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "wb") as f:
+            f.write(hashed)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.master_hash_file)
+
+    def verify_master_password(self, master_password: str) -> bool:
+        with open(self.master_hash_file, "rb") as f:
+            hashed = f.read()
+        with metrics.span("bcrypt"):
+            return bcrypt.checkpw(master_password.encode(), hashed)
+
+    def totp_secret(self) -> str:
+        return totp.get_or_create_totp_secret(self.totp_secret_file)
+
+    def log_action(self, action: str, site: str = None, status: str = "SUCCESS", note: str = ""):
+        audit.log_action(action, site, status, note, log_file=self.audit_log)
+
+    def vault_files(self) -> list:
+        """The files a vault reset removes; the master password and TOTP secret are kept."""
+        return [self.vault_file, self.vault_file + "-wal", self.vault_file + "-shm", self.salt_file,
+                searchindex.index_path(self.vault_file), *audit.log_files(self.audit_path)]
@@ -0,0 +1,82 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+from cryptography.fernet import Fernet
+
+import agent
+import storage
+from vault import encrypt_data
+
+
+class TestVaultAgent(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.sock = os.path.join(self.tmp.name, "agent.sock")
+        self.vault_file = os.path.join(self.tmp.name, "vault.json.enc")
+        self.key = Fernet.generate_key()
+        self.write_vault({"github.com": {"username": "nick", "password": "pw"}})
+
+    def tearDown(self):
+        agent.request("stop", path=self.sock)
+        storage.clear_cache()
+        self.tmp.cleanup()
+
+    def write_vault(self, data):
+        with open(self.vault_file, "wb") as f:
+            f.write(encrypt_data(data, self.key))
+
+    def serve(self, idle_timeout=60):
+        server = agent.VaultAgent(self.key, vault_file=self.vault_file, idle_timeout=idle_timeout)
+        thread = threading.Thread(target=server.serve, args=(self.sock,), daemon=True)
+        thread.start()
+        while not os.path.exists(self.sock):
+            time.sleep(0.01)
+        return thread
+
+    def test_no_agent_returns_none(self):
+        self.assertIsNone(agent.request("status", path=self.sock))
+
+    def test_socket_is_private(self):
+        self.serve()
+        self.assertEqual(os.stat(self.sock).st_mode & 0o777, 0o600)
+
+    def test_serves_key_and_records(self):
+        self.serve()
+        self.assertEqual(agent.request("key", path=self.sock)["key"].encode(), self.key)
+        reply = agent.request("get", path=self.sock, site="github.com")
+        self.assertEqual(reply["creds"], {"username": "nick", "password": "pw"})
+        self.assertIsNone(agent.request("get", path=self.sock, site="missing")["creds"])
+
+    def test_reloads_after_external_write(self):
+        self.serve()
+        self.assertEqual(agent.request("status", path=self.sock)["entries"], 1)
+        self.write_vault({"a": {"username": "u", "password": "p"}, "b": {"username": "u", "password": "p"}})
+        self.assertEqual(sorted(agent.request("dump", path=self.sock)["data"]), ["a", "b"])
+
+    def test_reloads_after_a_sqlite_commit(self):
+        # Commits land in the write-ahead log and leave the main file as it was
+        storage.save_vault({"a": {"username": "u", "password": "p"}}, self.key, self.vault_file, storage.FORMAT_SQLITE)
+        self.serve()
+        self.assertEqual(sorted(agent.request("dump", path=self.sock)["data"]), ["a"])
+        storage.put_record(self.key, "b", {"username": "u", "password": "p"}, self.vault_file)
+        self.assertEqual(sorted(agent.request("dump", path=self.sock)["data"]), ["a", "b"])
+        self.assertEqual(agent.request("get", path=self.sock, site="b")["creds"]["username"], "u")
+
+    def test_stop_and_idle_timeout(self):
+        thread = self.serve()
+        agent.request("stop", path=self.sock)
+        thread.join(timeout=5)
+        self.assertFalse(os.path.exists(self.sock))
+
+        thread = self.serve(idle_timeout=0.2)
+        thread.join(timeout=5)
+        self.assertFalse(thread.is_alive())
+        self.assertIsNone(agent.request("status", path=self.sock))
+
+
+if __name__ == '__main__':
+    unittest.main()
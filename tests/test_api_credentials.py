@@ -0,0 +1,111 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from cryptography.fernet import Fernet
+
+import flask_app
+import storage
+
+
+class TestCredentialsApi(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "vault.json.enc")
+        self.key = Fernet.generate_key()
+        self.data = {f"site{i:02d}.com": {"username": f"user{i % 3}", "password": f"pw{i}"} for i in range(25)}
+        storage.save_vault(self.data, self.key, self.path)
+
+        self.client = flask_app.app.test_client()
+        with self.client.session_transaction() as sess:
+            sess["master"] = "pw"
+            sess["2fa_passed"] = True
+        self.patches = [patch.object(flask_app, "VAULT_FILE", self.path),
+                        patch.object(flask_app, "get_vault_key", return_value=self.key)]
+        for p in self.patches:
+            p.start()
+
+    def tearDown(self):
+        for p in self.patches:
+            p.stop()
+        self.tmp.cleanup()
+
+    def get(self, query=""):
+        resp = self.client.get(f"/api/credentials{query}")
+        return resp.status_code, resp.get_json()
+
+    def walk(self, query):
+        sites, cursor = [], None
+        while True:
+            sep = "&" if query else ""
+            _, body = self.get(f"?{query}{sep}limit=7" + (f"&cursor={cursor}" if cursor else ""))
+            sites += [c["site"] for c in body["credentials"]]
+            cursor = body["next_cursor"]
+            if not cursor:
+                return sites
+
+    def test_default_projection_hides_passwords(self):
+        status, body = self.get()
+        self.assertEqual(status, 200)
+        self.assertEqual(len(body["credentials"]), 25)
+        self.assertEqual(set(body["credentials"][0]), {"site", "username"})
+
+        _, body = self.get("?fields=site,password&limit=1")
+        self.assertEqual(body["credentials"], [{"site": "site00.com", "password": "pw0"}])
+
+    def test_cursor_pagination_covers_everything_once(self):
+        self.assertEqual(self.walk(""), sorted(self.data))
+        self.assertEqual(self.walk("sort=-site"), sorted(self.data, reverse=True))
+        by_user = self.walk("sort=username")
+        self.assertEqual(sorted(by_user), sorted(self.data))
+        self.assertEqual([self.data[s]["username"] for s in by_user],
+                         sorted(self.data[s]["username"] for s in self.data))
+
+    def test_pages_are_stable_across_inserts(self):
+        _, first = self.get("?limit=5")
+        storage.put_record(self.key, "aaa.com", {"username": "x", "password": "y"}, self.path)
+        _, second = self.get(f"?limit=5&cursor={first['next_cursor']}")
+        self.assertEqual(second["credentials"][0]["site"], "site05.com")
+
+    def test_filters(self):
+        _, body = self.get("?username=USER1")
+        self.assertTrue(all(c["username"] == "user1" for c in body["credentials"]))
+        _, body = self.get("?prefix=site1")
+        self.assertEqual(len(body["credentials"]), 10)
+        _, body = self.get("?q=e24")
+        self.assertEqual([c["site"] for c in body["credentials"]], ["site24.com"])
+
+    def test_invalid_parameters(self):
+        for query in ("?limit=0", "?limit=abc", "?fields=secret", "?sort=password", "?cursor=nope"):
+            self.assertEqual(self.get(query)[0], 400, query)
+        _, body = self.get("?limit=5")
+        self.assertEqual(self.get(f"?sort=-site&cursor={body['next_cursor']}")[0], 400)
+
+    def test_single_credential_endpoint(self):
+        resp = self.client.get("/api/credentials/site03.com")
+        self.assertEqual(resp.get_json(), {"site": "site03.com", "username": "user0", "password": "pw3"})
+        self.assertEqual(self.client.get("/api/credentials/missing.com").status_code, 404)
+
+    def test_stale_if_match_gets_412(self):
+        etag = self.client.get("/api/credentials").headers["ETag"]
+        self.assertEqual(etag.strip('"'), storage.vault_version(self.path))
+
+        new = {"site": "new.com", "username": "u", "password": "p"}
+        resp = self.client.post("/add-credential", json=new, headers={"If-Match": etag})
+        self.assertEqual(resp.status_code, 200)
+        self.assertNotEqual(resp.headers["ETag"], etag)
+
+        resp = self.client.post("/edit/site01.com", json={"password": "x"}, headers={"If-Match": etag})
+        self.assertEqual(resp.status_code, 412)
+        resp = self.client.post("/delete/site01.com", headers={"If-Match": etag})
+        self.assertEqual(resp.status_code, 412)
+        self.assertEqual(storage.get_record(self.key, "site01.com", self.path)["password"], "pw1")
+
+        resp = self.client.post("/edit/site01.com", json={"password": "x"})
+        self.assertEqual(resp.status_code, 200)
+
+
+if __name__ == '__main__':
+    unittest.main()
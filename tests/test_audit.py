@@ -0,0 +1,411 @@
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import unittest
+from unittest.mock import patch
+
+from cryptography.fernet import Fernet
+
+import audit
+import flask_app
+from audit import AuditWriter
+
+
+CHAIN_KEY = audit.chain_key(Fernet.generate_key())
+
+
+def keyed_writer(path, **options):
+    """A writer that chains its entries straight into the log, as after an unlock."""
+    writer = AuditWriter(path, **options)
+    writer.chain_key = CHAIN_KEY
+    return writer
+
+
+class TestAuditWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "audit.log")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def read(self):
+        with open(self.path, encoding="utf-8") as f:
+            return f.read().splitlines()
+
+    def test_lines_are_written_in_batches(self):
+        writer = keyed_writer(self.path, batch_size=50, flush_interval=60)
+        for i in range(120):
+            writer.write(audit.make_event("ADD", site=f"site{i}"))
+        writer.close()
+        lines = self.read()
+        self.assertEqual(len(lines), 120)
+        self.assertEqual(json.loads(lines[-1])["site"], "site119")
+        self.assertLessEqual(writer.stats()["batches"], 4)
+
+    def test_flush_waits_for_queued_lines(self):
+        writer = keyed_writer(self.path, flush_interval=60)
+        writer.write(audit.make_event("GET", site="a.com"))
+        self.assertTrue(writer.flush(timeout=5))
+        self.assertEqual(len(self.read()), 1)
+        writer.close()
+
+    def test_interval_flush_without_explicit_flush(self):
+        writer = keyed_writer(self.path, flush_interval=0.05)
+        writer.write(audit.make_event("LIST"))
+        for _ in range(100):
+            if os.path.exists(self.path):
+                break
+            threading.Event().wait(0.02)
+        self.assertEqual(len(self.read()), 1)
+        writer.close()
+
+    def test_drop_policy_counts_and_reports_drops(self):
+        writer = keyed_writer(self.path, max_queue=5, batch_size=1, flush_interval=60, backpressure="drop")
+        writer._ensure_started()
+        release = threading.Event()
+        with patch.object(writer, "_append", side_effect=lambda lines: release.wait(5) and AuditWriter._append(writer, lines)):
+            for i in range(50):
+                writer.write(audit.make_event("GET", site=f"s{i}"))
+            self.assertGreater(writer.dropped, 0)
+            release.set()
+            writer.flush(timeout=5)
+        writer.close()
+        lines = self.read()
+        self.assertTrue(any("AUDIT_DROPPED" in line for line in lines))
+        self.assertEqual(writer.stats()["dropped"], 50 + 1 - len(lines))
+
+    def test_fsync_policy(self):
+        with patch("audit.os.fsync") as fsync:
+            writer = keyed_writer(self.path, fsync="never")
+            writer.write(audit.make_event("GET"))
+            writer.close()
+            fsync.assert_not_called()
+
+            writer = keyed_writer(self.path, fsync="batch")
+            writer.write(audit.make_event("GET"))
+            writer.close()
+            fsync.assert_called()
+
+    def test_invalid_policies(self):
+        with self.assertRaises(ValueError):
+            AuditWriter(self.path, fsync="sometimes")
+        with self.assertRaises(ValueError):
+            AuditWriter(self.path, backpressure="shrug")
+
+
+class TestAuditSegments(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "audit.log")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def log(self, events, segment_bytes=10 ** 9):
+        writer = keyed_writer(self.path, batch_size=1, segment_bytes=segment_bytes, segment_seconds=10 ** 9)
+        for ts, action, site in events:
+            writer.write({"ts": ts, "action": action, "status": "SUCCESS", "site": site})
+        writer.close()
+
+    def day(self, d, n=0):
+        return f"2026-01-{d:02d}T00:00:{n:02d}Z"
+
+    def fill(self):
+        # Three sealed segments of 20 events (one day each) plus the active one
+        for d in (1, 2, 3):
+            self.log([(self.day(d, i), "GET" if i % 2 else "ADD", f"s{i}.com") for i in range(20)])
+            with audit._SegmentLock(self.path, exclusive=True):
+                audit.rotate_segment(self.path)
+        self.log([(self.day(4, i), "DELETE", "x.com") for i in range(5)])
+
+    def test_rotation_seals_gzip_segments_with_sidecars(self):
+        self.fill()
+        sealed = audit.sealed_segments(self.path)
+        self.assertEqual([seq for seq, _ in sealed], [1, 2, 3])
+        self.assertTrue(all(segment.endswith(".gz") for _, segment in sealed))
+        index = audit.read_index(self.path, 2)
+        self.assertEqual(index["first"], self.day(2, 0))
+        self.assertEqual(index["last"], self.day(2, 19))
+        self.assertEqual(index["actions"], {"ADD": 10, "GET": 10})
+
+    def test_size_based_rotation(self):
+        self.log([(self.day(1, i), "GET", "a.com") for i in range(30)], segment_bytes=500)
+        self.assertGreater(len(audit.sealed_segments(self.path)), 1)
+        self.assertEqual(len(list(audit.iter_events(self.path))), 30)
+
+    def test_time_based_rotation(self):
+        self.log([(self.day(1), "GET", "a.com")])
+        writer = keyed_writer(self.path, segment_seconds=3600)
+        writer.write(audit.make_event("GET", site="b.com"))
+        writer.close()
+        self.assertEqual(len(audit.sealed_segments(self.path)), 1)
+        self.assertEqual([e["site"] for _, e in audit.iter_events(self.path)], ["a.com", "b.com"])
+
+    def test_filters_only_open_relevant_segments(self):
+        self.fill()
+        with patch("audit.gzip.open", wraps=gzip.open) as opened:
+            events = [e for _, e in audit.iter_events(self.path, since=self.day(2), until=self.day(2, 59))]
+        self.assertEqual(len(events), 20)
+        self.assertEqual(opened.call_count, 1)
+
+        with patch("audit.gzip.open", wraps=gzip.open) as opened:
+            events = [e for _, e in audit.iter_events(self.path, action="delete")]
+        self.assertEqual(len(events), 5)
+        opened.assert_not_called()
+
+        events = [e for _, e in audit.iter_events(self.path, action="ADD", site="S4.com")]
+        self.assertEqual(len(events), 3)
+
+    def test_tail_reads_back_only_as_far_as_needed(self):
+        self.fill()
+        with patch("audit.gzip.open", wraps=gzip.open) as opened:
+            events = audit.tail_events(10, self.path)
+        self.assertEqual([e["ts"] for e in events], [self.day(3, i) for i in range(15, 20)] +
+                         [self.day(4, i) for i in range(5)])
+        self.assertEqual(opened.call_count, 1)
+        self.assertEqual(len(audit.tail_events(1000, self.path)), 65)
+
+    def test_pages_survive_rotation(self):
+        self.log([(self.day(1, i), "GET", "a.com") for i in range(10)])
+        first, cursor = audit.page_events(4, path=self.path)
+        with audit._SegmentLock(self.path, exclusive=True):
+            audit.rotate_segment(self.path)
+        self.log([(self.day(2, i), "GET", "a.com") for i in range(3)])
+        seen = list(first)
+        while cursor:
+            page, cursor = audit.page_events(4, cursor, path=self.path)
+            seen += page
+        self.assertEqual([e["ts"] for e in seen],
+                         [self.day(1, i) for i in range(10)] + [self.day(2, i) for i in range(3)])
+
+    def test_early_stops_close_every_file(self):
+        self.log([(self.day(1, i), "GET", "a.com") for i in range(10)])
+        with open(audit.pending_path(self.path), "w", encoding="utf-8") as f:
+            f.write(json.dumps({"ts": self.day(2), "action": "GET", "status": "FAILURE"}) + "\n")
+        opened = []
+
+        def tracked_open(*args, **kwargs):
+            opened.append(open(*args, **kwargs))
+            return opened[-1]
+
+        with patch("audit.open", tracked_open, create=True):
+            events, cursor = audit.page_events(3, path=self.path)
+            generator = audit.iter_events(self.path)
+            next(generator)
+            generator.close()
+        self.assertEqual((len(events), cursor is not None), (3, True))
+        self.assertGreaterEqual(len(opened), 4)
+        self.assertTrue(all(f.closed for f in opened))
+
+    def test_legacy_text_lines_are_read(self):
+        with open(self.path, "w", encoding="utf-8") as f:
+            f.write("[2025-05-01 10:00:00] ACTION: DELETE | SITE: old.com | STATUS: FAILURE (Site not found)\n")
+        (event,) = [e for _, e in audit.iter_events(self.path)]
+        self.assertEqual((event["action"], event["site"], event["status"], event["note"]),
+                         ("DELETE", "old.com", "FAILURE", "Site not found"))
+
+    def test_follow_picks_up_new_events_across_rotation(self):
+        self.log([(self.day(1), "GET", "old.com")])
+        follower = audit.follow_events(self.path, poll=0.01, action="ADD")
+        received = []
+        thread = threading.Thread(target=lambda: received.extend(next(follower) for _ in range(2)), daemon=True)
+        thread.start()
+        threading.Event().wait(0.05)
+        self.log([(self.day(2), "ADD", "a.com")])
+        with audit._SegmentLock(self.path, exclusive=True):
+            audit.rotate_segment(self.path)
+        self.log([(self.day(3), "ADD", "b.com")])
+        thread.join(5)
+        self.assertEqual([e["site"] for e in received], ["a.com", "b.com"])
+
+
+class TestAuditChain(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "audit.log")
+        self.key = Fernet.generate_key()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def log(self, count, keyed=True, **options):
+        writer = AuditWriter(self.path, batch_size=7, checkpoint_every=10, segment_seconds=10 ** 9, **options)
+        writer.chain_key = audit.chain_key(self.key) if keyed else None
+        for i in range(count):
+            writer.write(audit.make_event("GET", site=f"s{i}.com"))
+        writer.close()
+
+    def rewrite(self, edit):
+        with open(self.path, encoding="utf-8") as f:
+            lines = f.readlines()
+        with open(self.path, "w", encoding="utf-8") as f:
+            f.writelines(edit(lines))
+
+    def verify(self, full=False):
+        return audit.verify_chain(self.key, self.path, full=full)
+
+    def test_intact_chain_verifies_from_latest_checkpoint(self):
+        self.log(25)
+        report = self.verify()
+        self.assertTrue(report["ok"], report)
+        self.assertEqual((report["from"], report["checked"], report["last"]), (20, 5, 25))
+        report = self.verify(full=True)
+        self.assertEqual((report["from"], report["checked"]), (0, 25))
+
+    def test_chain_continues_across_writers_and_rotations(self):
+        self.log(8)
+        self.log(8, segment_bytes=1)
+        self.log(8)
+        self.assertGreater(len(audit.sealed_segments(self.path)), 1)
+        report = self.verify(full=True)
+        self.assertTrue(report["ok"], report)
+        self.assertEqual(report["checked"], 24)
+
+    def test_altered_entry_is_reported(self):
+        self.log(25)
+        self.rewrite(lambda lines: [line.replace("s22.com", "evil.com") for line in lines])
+        report = self.verify()
+        self.assertFalse(report["ok"])
+        self.assertEqual(report["at"]["n"], 23)
+        self.assertEqual(report["at"]["line"], 23)
+
+    def test_removed_or_reordered_entries_are_reported(self):
+        self.log(15)
+        self.rewrite(lambda lines: lines[:12] + lines[13:])
+        self.assertEqual(self.verify()["at"]["n"], 14)
+
+        os.remove(self.path)
+        os.remove(audit.checkpoints_path(self.path))
+        self.log(5)
+        self.rewrite(lambda lines: [lines[0], lines[2], lines[1], *lines[3:]])
+        self.assertEqual(self.verify()["at"]["n"], 3)
+
+    def test_history_before_checkpoint_needs_full(self):
+        self.log(25)
+        self.rewrite(lambda lines: [line.replace("s3.com", "evil.com") for line in lines])
+        self.assertTrue(self.verify()["ok"])
+        report = self.verify(full=True)
+        self.assertFalse(report["ok"])
+        self.assertEqual(report["at"]["n"], 4)
+
+    def test_truncation_past_a_checkpoint_is_reported(self):
+        self.log(25)
+        self.rewrite(lambda lines: lines[:15])
+        report = self.verify()
+        self.assertFalse(report["ok"])
+        self.assertIn("checkpointed entry 20", report["error"])
+        self.assertIn("truncated", self.verify(full=True)["error"])
+
+    def test_forged_checkpoint_is_reported(self):
+        self.log(25)
+        with open(audit.checkpoints_path(self.path), "a", encoding="utf-8") as f:
+            f.write(json.dumps({"n": 30, "mac": "00", "ts": "", "sig": "00"}) + "\n")
+        self.assertIn("bad signature", self.verify()["error"])
+
+    def test_wrong_key_fails(self):
+        self.log(5)
+        self.key = Fernet.generate_key()
+        self.assertFalse(self.verify()["ok"])
+
+    def test_unkeyed_entries_wait_for_the_key(self):
+        self.log(3)
+        self.log(2, keyed=False)
+        report = self.verify(full=True)
+        self.assertTrue(report["ok"], report)
+        self.assertEqual((report["checked"], report["pending"]), (3, 2))
+        self.assertEqual([event["site"] for _, event in audit.iter_events(self.path)],
+                         ["s0.com", "s1.com", "s2.com", "s0.com", "s1.com"])
+
+        self.log(3)
+        self.assertFalse(os.path.exists(audit.pending_path(self.path)))
+        report = self.verify(full=True)
+        self.assertTrue(report["ok"], report)
+        self.assertEqual((report["checked"], report["pending"]), (8, 0))
+
+    def test_flush_with_the_key_chains_pending_entries(self):
+        self.log(2, keyed=False)
+        writer = AuditWriter(self.path)
+        writer.chain_key = audit.chain_key(self.key)
+        writer.flush()
+        writer.close()
+        self.assertFalse(os.path.exists(audit.pending_path(self.path)))
+        self.assertEqual(self.verify(full=True)["checked"], 2)
+
+    def test_rechained_without_the_key_is_rejected(self):
+        # Alter an entry, then recompute every later link as an unkeyed SHA-256 link
+        self.log(5)
+
+        def forge(lines):
+            events = [json.loads(line) for line in lines]
+            prev = events[1]["mac"]
+            for event in events[2:]:
+                event.pop("mac")
+                if event["n"] == 3:
+                    event["site"] = "evil.com"
+                data = prev.encode() + b"\n" + audit._canonical(event).encode()
+                event["mac"] = prev = "u:" + hashlib.sha256(data).hexdigest()
+            return [json.dumps(event) + "\n" for event in events]
+
+        self.rewrite(forge)
+        for full in (False, True):
+            report = self.verify(full=full)
+            self.assertFalse(report["ok"])
+            self.assertEqual(report["at"]["n"], 3)
+            self.assertIn("without the vault key", report["error"])
+
+    def test_legacy_lines_before_the_chain(self):
+        with open(self.path, "w", encoding="utf-8") as f:
+            f.write("[2025-05-01 10:00:00] ACTION: LIST | STATUS: SUCCESS\n")
+        self.log(3)
+        report = self.verify(full=True)
+        self.assertTrue(report["ok"], report)
+        self.assertEqual(report["legacy"], 1)
+
+        self.rewrite(lambda lines: lines + ["[2025-05-01 10:00:00] ACTION: LIST | STATUS: SUCCESS\n"])
+        self.assertFalse(self.verify(full=True)["ok"])
+
+
+class TestAuditApi(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmp = tempfile.TemporaryDirectory()
+        os.chdir(self.tmp.name)
+        self.client = flask_app.app.test_client()
+        with self.client.session_transaction() as sess:
+            sess["master"] = "pw"
+            sess["2fa_passed"] = True
+
+    def tearDown(self):
+        audit.flush()
+        os.chdir(self.cwd)
+        self.tmp.cleanup()
+
+    def test_paginated_and_filtered(self):
+        for i in range(7):
+            audit.log_action("ADD" if i % 2 else "GET", site=f"s{i}.com")
+        resp = self.client.get("/api/audit?limit=3&action=add")
+        body = resp.get_json()
+        self.assertEqual([e["site"] for e in body["events"]], ["s1.com", "s3.com", "s5.com"])
+        self.assertIsNone(body["next_cursor"])
+
+        body = self.client.get("/api/audit?limit=5").get_json()
+        self.assertEqual(len(body["events"]), 5)
+        body = self.client.get(f"/api/audit?limit=5&cursor={body['next_cursor']}").get_json()
+        self.assertEqual([e["site"] for e in body["events"]], ["s5.com", "s6.com"])
+
+    def test_bad_parameters(self):
+        self.assertEqual(self.client.get("/api/audit?limit=0").status_code, 400)
+        self.assertEqual(self.client.get("/api/audit?since=yesterday").status_code, 400)
+        self.assertEqual(self.client.get("/api/audit?cursor=zzz").status_code, 400)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+import unittest
+
+from benchmarks import suite
+from benchmarks.synthetic import synthetic_entries, synthetic_vault
+
+
+def run(**medians):
+    return {"results": {name: {"median_ms": ms} for name, ms in medians.items()}}
+
+
+class TestSyntheticVault(unittest.TestCase):
+
+    def test_same_seed_same_vault(self):
+        self.assertEqual(synthetic_vault(50), synthetic_vault(50))
+        self.assertNotEqual(synthetic_vault(50, seed=1), synthetic_vault(50))
+        # A smaller vault is a prefix of a larger one with the same seed
+        self.assertEqual([*synthetic_vault(10)], [*synthetic_vault(50)][:10])
+
+    def test_field_lengths_and_unique_sorted_sites(self):
+        data = synthetic_vault(200, site_length=30, username_length=5, password_length=40)
+        self.assertEqual(len(data), 200)
+        self.assertEqual([*data], sorted(data))
+        for site, creds in data.items():
+            self.assertEqual(len(site), 30 + len(".example.com"))
+            self.assertEqual(len(creds["username"]), 5)
+            self.assertEqual(len(creds["password"]), 40)
+
+    def test_size_limits(self):
+        for size in (0, 1_000_001):
+            with self.assertRaises(ValueError):
+                next(synthetic_entries(size))
+
+
+class TestCompare(unittest.TestCase):
+
+    def test_flags_regressions_beyond_threshold(self):
+        rows = suite.compare_results(run(a=10, b=10, c=10, d=10, gone=1), run(a=13, b=11, c=5, d=10, added=1),
+                                     threshold=0.2)
+        status = {name: status for name, *_, status in rows}
+        self.assertEqual(status, {"a": "regression", "b": "ok", "c": "improved", "d": "ok",
+                                  "gone": "missing", "added": "new"})
+
+    def test_ignores_tiny_absolute_changes(self):
+        rows = suite.compare_results(run(fast=0.001), run(fast=0.004), threshold=0.2, min_delta_ms=0.05)
+        self.assertEqual(rows[0][-1], "ok")
+
+    def test_measure_reports_per_call_times(self):
+        calls = []
+        stats = suite.measure(lambda: calls.append(1), repeat=3, setup=lambda: None)
+        self.assertEqual((stats["repeat"], stats["number"]), (3, 1))
+        self.assertEqual(len(calls), 4)  # one warm-up call
+        self.assertLessEqual(stats["min_ms"], stats["median_ms"])
+        self.assertLessEqual(stats["median_ms"], stats["max_ms"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from click.testing import CliRunner
+
+import agent
+import audit
+import cli
+import storage
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class TestCliStartup(unittest.TestCase):
+
+    def test_import_defers_heavy_modules(self):
+        heavy = ["cryptography", "audit", "agent", "socket", "pyperclip", "exporter", "importer"]
+        probe = f"import sys, cli; print(' '.join(m for m in {heavy!r} if m in sys.modules))"
+        result = subprocess.run([sys.executable, "-c", probe], cwd=ROOT, capture_output=True, text=True, check=True)
+        self.assertEqual(result.stdout.strip(), "")
+
+    def test_help_runs_in_process(self):
+        with patch.object(subprocess, "run", side_effect=AssertionError("help started a subprocess")):
+            result = CliRunner().invoke(cli.cli, ["help"])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn("Usage:", result.output)
+        self.assertIn("migrate", result.output)
+        self.assertEqual(result.output, CliRunner().invoke(cli.cli, ["--help"]).output)
+
+    def test_version(self):
+        result = CliRunner().invoke(cli.cli, ["--version"])
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn(cli.__version__, result.output)
+
+
+class TestResolveKey(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cwd = os.getcwd()
+        os.chdir(self.tmp.name)  # the vault, its header and the audit log are relative paths
+        self.key = storage.unlock("master")
+        storage.save_vault({"a.com": {"username": "alice", "password": "pw"}}, self.key, storage.VAULT_FILE,
+                           storage.FORMAT_V1)
+        self.chain_key = audit.writer_for().chain_key
+
+    def tearDown(self):
+        audit.flush()
+        audit.writer_for().chain_key = self.chain_key
+        os.chdir(self.cwd)
+        storage.clear_cache()
+        self.tmp.cleanup()
+
+    def test_unwrapped_data_key_is_not_checked_again(self):
+        with patch.object(agent, "request", return_value=None), \
+                patch.object(storage, "check_key", wraps=storage.check_key) as check:
+            self.assertEqual(cli.resolve_key("master"), self.key)
+        check.assert_not_called()
+        self.assertEqual(audit.writer_for().chain_key, audit.chain_key(self.key))
+
+    def test_agent_key_is_checked_without_decrypting_the_vault(self):
+        audit.writer_for().chain_key = None
+        reply = {"ok": True, "key": self.key.decode()}
+        with patch.object(agent, "request", return_value=reply), \
+                patch.object(storage, "decrypt_data", side_effect=AssertionError("vault decrypted")):
+            self.assertEqual(cli.resolve_key(None), self.key)
+        self.assertEqual(audit.writer_for().chain_key, audit.chain_key(self.key))
+
+
+if __name__ == '__main__':
+    unittest.main()
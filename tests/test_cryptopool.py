@@ -0,0 +1,130 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+from unittest.mock import patch
+
+import flask_app
+from cryptopool import CryptoPool, PoolBusy
+
+
+def _square(x):
+    return x * x
+
+
+class TestCryptoPool(unittest.TestCase):
+
+    def setUp(self):
+        self.release = threading.Event()
+        self.pool = CryptoPool(workers=1, max_queue=1, timeout=5)
+
+    def tearDown(self):
+        self.release.set()
+        self.pool.shutdown()
+
+    def block(self):
+        self.release.wait(5)
+        return "done"
+
+    def fill(self, jobs):
+        threads = [threading.Thread(target=self.pool.run, args=(self.block,)) for _ in range(jobs)]
+        for thread in threads:
+            thread.start()
+        while self.pool.stats()["depth"] < jobs:
+            time.sleep(0.01)
+        return threads
+
+    def test_runs_jobs_and_reports_stats(self):
+        self.assertEqual(self.pool.run(_square, 7), 49)
+        with self.assertRaises(ZeroDivisionError):
+            self.pool.run(lambda: 1 / 0)
+        stats = self.pool.stats()
+        self.assertEqual((stats["submitted"], stats["completed"], stats["depth"]), (2, 1, 0))
+        self.assertGreaterEqual(stats["wait_ms_max"], 0)
+
+    def test_saturated_pool_refuses_at_once(self):
+        threads = self.fill(2)
+        self.assertEqual(self.pool.stats()["queued"], 1)
+        start = time.monotonic()
+        with self.assertRaises(PoolBusy) as ctx:
+            self.pool.run(_square, 2)
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertGreaterEqual(ctx.exception.retry_after, 1)
+        self.assertEqual(self.pool.stats()["rejected"], 1)
+
+        self.release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.pool.stats()["depth"], 0)
+        self.assertEqual(self.pool.run(_square, 3), 9)
+
+    def test_slow_job_times_out(self):
+        self.pool.timeout = 0.05
+        with self.assertRaises(PoolBusy):
+            self.pool.run(self.block)
+        self.assertEqual(self.pool.stats()["timeouts"], 1)
+
+    def test_process_pool(self):
+        pool = CryptoPool(workers=1, max_queue=1, kind="process")
+        try:
+            self.assertEqual(pool.run(_square, 5), 25)
+        finally:
+            pool.shutdown()
+
+
+class TestFlaskCryptoPool(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.release = threading.Event()
+        self.pool = CryptoPool(workers=1, max_queue=0, timeout=5)
+        self.patches = [patch.object(flask_app, "crypto_pool", self.pool),
+                        patch.object(flask_app, "MASTER_HASH_FILE", os.path.join(self.tmp.name, "master.hash"))]
+        for p in self.patches:
+            p.start()
+
+    def tearDown(self):
+        self.release.set()
+        self.pool.shutdown()
+        for p in self.patches:
+            p.stop()
+        self.tmp.cleanup()
+
+    def test_busy_pool_returns_503_but_never_blocks_cheap_requests(self):
+        client = flask_app.app.test_client()
+        flask_app.key_cache.put("cached", b"k")
+
+        blocker = threading.Thread(target=self.pool.run, args=(self.release.wait, 5))
+        blocker.start()
+        while self.pool.stats()["depth"] < 1:
+            time.sleep(0.01)
+
+        resp = flask_app.app.test_client().post("/", data={"master": "pw"})
+        self.assertEqual(resp.status_code, 503)
+        self.assertGreaterEqual(int(resp.headers["Retry-After"]), 1)
+
+        self.assertEqual(client.get("/").status_code, 200)
+        with patch.object(flask_app, "is_vault_locked", return_value=False):
+            with flask_app.app.test_request_context():
+                from flask import session
+                session.update(master="pw", sid="cached")
+                self.assertEqual(flask_app.get_vault_key(), b"k")
+        self.assertEqual(client.get("/api/crypto-pool").status_code, 401)
+        with client.session_transaction() as sess:
+            sess.update(master="pw", sid="cached")
+            sess["2fa_passed"] = True
+        self.assertEqual(client.get("/api/crypto-pool").get_json()["depth"], 1)
+
+        # Deriving an encrypted export's key waits for the pool like any other derivation
+        resp = client.post("/export?format=encrypted", json={"passphrase": "correct horse"})
+        self.assertEqual(resp.status_code, 503)
+        self.assertIn("Retry-After", resp.headers)
+
+        self.release.set()
+        blocker.join()
+        flask_app.key_cache.evict("cached")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+import csv
+import io
+import json
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from cryptography.fernet import Fernet
+
+import exporter
+import storage
+import streamcrypt
+
+
+RECORDS = [
+    ("github.com", {"username": "nick", "password": "p,w\"1"}),
+    ("gitlab.com", {"username": "alice", "password": "pw2"}),
+]
+
+
+def export_bytes(fmt, records=RECORDS, passphrase=None):
+    return b"".join(exporter.export_chunks(iter(records), fmt, passphrase))
+
+
+class TestExporter(unittest.TestCase):
+
+    def test_plaintext_formats(self):
+        txt = export_bytes("txt").decode()
+        self.assertIn("Site: github.com\n  Username: nick\n", txt)
+
+        rows = list(csv.reader(io.StringIO(export_bytes("csv").decode())))
+        self.assertEqual(rows[0], ["site", "username", "password"])
+        self.assertEqual(rows[1], ["github.com", "nick", 'p,w"1'])
+
+        lines = export_bytes("ndjson").decode().splitlines()
+        self.assertEqual(json.loads(lines[1]), {"site": "gitlab.com", "username": "alice", "password": "pw2"})
+
+    def test_records_are_consumed_lazily(self):
+        def records():
+            for i in range(10_000):
+                yield f"site{i}", {"username": "u", "password": "p" * 20}
+        chunks = exporter.export_chunks(records(), "ndjson")
+        first = next(chunks)
+        self.assertLessEqual(len(first), exporter.BATCH_SIZE + 100)
+
+    def test_encrypted_export_round_trip(self):
+        with patch.object(exporter, "ITERATIONS", 1000):
+            blob = export_bytes("encrypted", passphrase="correct horse")
+        self.assertNotIn(b"github.com", blob)
+        self.assertEqual(list(exporter.read_encrypted_export(io.BytesIO(blob), "correct horse")), RECORDS)
+        with self.assertRaises(ValueError):
+            list(exporter.read_encrypted_export(io.BytesIO(blob), "wrong"))
+        with self.assertRaises(ValueError):
+            export_bytes("encrypted")
+
+    def test_export_from_the_vault_file(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "vault.json.enc")
+            key = Fernet.generate_key()
+            storage.save_vault(dict(RECORDS), key, path)
+            ndjson = export_bytes("ndjson", storage.iter_vault(key, path))
+        self.assertEqual(len(ndjson.splitlines()), 2)
+
+
+class TestExportEndpoint(unittest.TestCase):
+
+    def test_export_streams_the_requested_format(self):
+        import flask_app
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "vault.json.enc")
+            key = Fernet.generate_key()
+            storage.save_vault(dict(RECORDS), key, path)
+            client = flask_app.app.test_client()
+            with client.session_transaction() as sess:
+                sess["master"] = "pw"
+                sess["2fa_passed"] = True
+            with patch.object(flask_app, "VAULT_FILE", path), \
+                    patch.object(flask_app, "get_vault_key", return_value=key):
+                resp = client.get("/export?format=csv")
+                self.assertTrue(resp.is_streamed)
+                self.assertEqual(resp.data.decode().splitlines()[0], "site,username,password")
+                self.assertEqual(client.get("/export?format=encrypted").status_code, 400)
+                with patch.object(flask_app.crypto_pool, "run", wraps=flask_app.crypto_pool.run) as pooled:
+                    resp = client.post("/export?format=encrypted", json={"passphrase": "correct horse"})
+                    blob = resp.data
+                pooled.assert_called_once_with(exporter.export_key, "correct horse")
+                self.assertEqual(list(exporter.read_encrypted_export(io.BytesIO(blob), "correct horse")), RECORDS)
+
+
+class TestStreamCrypt(unittest.TestCase):
+
+    def setUp(self):
+        self.key = os.urandom(32)
+        self.prefix = os.urandom(streamcrypt.NONCE_PREFIX_SIZE)
+        self.plain = os.urandom(1000)
+
+    def seal(self, chunk_size=100):
+        return b"".join(streamcrypt.seal_stream(self.key, self.prefix, [self.plain[:333], self.plain[333:]],
+                                                chunk_size=chunk_size))
+
+    def open(self, blob, chunk_size=100):
+        return b"".join(streamcrypt.open_stream(self.key, self.prefix, io.BytesIO(blob), chunk_size=chunk_size))
+
+    def test_round_trip_including_exact_multiples(self):
+        self.assertEqual(self.open(self.seal()), self.plain)
+        self.assertEqual(self.open(self.seal(chunk_size=300), chunk_size=300), self.plain)
+
+    def test_truncation_and_tampering_are_detected(self):
+        blob = self.seal()
+        chunk = 100 + streamcrypt.TAG_SIZE
+        for broken in (blob[:chunk * 5], blob[:-1], blob[:chunk] + blob[chunk * 2:],
+                       blob[:10] + bytes([blob[10] ^ 1]) + blob[11:], b""):
+            with self.assertRaises(ValueError):
+                self.open(broken)
+
+
+if __name__ == '__main__':
+    unittest.main()
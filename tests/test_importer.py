@@ -0,0 +1,114 @@
+import io
+import json
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from cryptography.fernet import Fernet
+
+import importer
+import storage
+
+
+class TestImporter(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "vault.json.enc")
+        self.key = Fernet.generate_key()
+        storage.save_vault({"github.com": {"username": "old", "password": "old"}}, self.key, self.path)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def run_import(self, text, fmt="csv", on_conflict="skip"):
+        return importer.import_credentials(self.key, io.StringIO(text), fmt, on_conflict, self.path)
+
+    def test_csv_import_with_rejected_rows(self):
+        report = self.run_import("site,username,password\n"
+                                 "gitlab.com,nick,pw1\n"
+                                 ",nick,pw2\n"
+                                 "example.org,nick,\n")
+        self.assertEqual(report.imported, 1)
+        self.assertEqual(report.rejected, [(3, "missing site"), (4, "missing password")])
+        self.assertEqual(storage.get_record(self.key, "gitlab.com", self.path), {"username": "nick", "password": "pw1"})
+
+    def test_conflict_policies(self):
+        rows = "site,username,password\ngithub.com,new,new\ngithub.com,newer,newer\n"
+        self.assertEqual(self.run_import(rows, on_conflict="skip").skipped, 2)
+        self.assertEqual(storage.get_record(self.key, "github.com", self.path)["username"], "old")
+
+        report = self.run_import(rows, on_conflict="rename")
+        self.assertEqual(report.renamed, 2)
+        self.assertEqual(sorted(storage.list_sites(self.key, self.path)),
+                         ["github.com", "github.com (2)", "github.com (3)"])
+
+        self.run_import(rows, on_conflict="overwrite")
+        self.assertEqual(storage.get_record(self.key, "github.com", self.path)["username"], "newer")
+
+    def test_json_bitwarden_and_keepass_formats(self):
+        self.run_import(json.dumps({"a.com": {"username": "u", "password": "p"}}), fmt="json")
+        self.run_import(json.dumps([{"site": "b.com", "username": "u", "password": "p"}]), fmt="json")
+        self.run_import(json.dumps({"items": [
+            {"name": "c.com", "login": {"username": "u", "password": "p", "uris": []}},
+            {"name": "secure note", "type": 2},
+        ]}), fmt="bitwarden-json")
+        self.run_import('"Group","Title","Username","Password","URL","Notes"\n'
+                        '"Root","d.com","u","p","https://d.com",""\n', fmt="keepass-csv")
+        self.assertEqual(sorted(storage.list_sites(self.key, self.path)),
+                         ["a.com", "b.com", "c.com", "d.com", "github.com"])
+
+    def test_json_of_the_wrong_shape_is_rejected(self):
+        for fmt, body in [("bitwarden-json", []), ("bitwarden-json", 5), ("bitwarden-json", {"items": "x"}),
+                          ("json", 5), ("json", "a.com")]:
+            with self.subTest(fmt=fmt, body=body), self.assertRaises(ValueError):
+                self.run_import(json.dumps(body), fmt=fmt)
+        report = self.run_import(json.dumps({"items": [5, {"name": "e.com", "login": "u"},
+                                                       {"login": {"password": "p", "uris": [None]}}]}),
+                                 fmt="bitwarden-json")
+        self.assertEqual(len(report.rejected), 3)
+
+    def test_single_write_for_the_whole_import(self):
+        rows = "site,username,password\n" + "".join(f"site{i},u,p\n" for i in range(50))
+        with patch.object(storage, "put_records", wraps=storage.put_records) as put:
+            report = self.run_import(rows)
+        self.assertEqual(put.call_count, 1)
+        self.assertEqual(report.imported, 50)
+        self.assertGreater(report.rows_per_second, 0)
+
+
+class TestImportEndpoint(unittest.TestCase):
+
+    def test_api_import_reuses_the_pipeline(self):
+        import flask_app
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "vault.json.enc")
+            key = Fernet.generate_key()
+            client = flask_app.app.test_client()
+            with client.session_transaction() as sess:
+                sess["master"] = "pw"
+                sess["2fa_passed"] = True
+            with patch.object(flask_app, "VAULT_FILE", path), \
+                    patch.object(flask_app, "get_vault_key", return_value=key):
+                resp = client.post("/api/import", data={
+                    "format": "csv",
+                    "file": (io.BytesIO(b"site,username,password\na.com,u,p\n"), "export.csv"),
+                })
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(resp.get_json()["imported"], 1)
+            self.assertEqual(storage.list_sites(key, path), ["a.com"])
+
+            with patch.object(flask_app, "VAULT_FILE", path), \
+                    patch.object(flask_app, "get_vault_key", return_value=key):
+                resp = client.post("/api/import", data={
+                    "format": "bitwarden-json",
+                    "file": (io.BytesIO(b"[1, 2, 3]"), "export.json"),
+                })
+            self.assertEqual(resp.status_code, 400)
+            self.assertIn("items", resp.get_json()["error"])
+
+
+if __name__ == '__main__':
+    unittest.main()
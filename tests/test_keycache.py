@@ -0,0 +1,98 @@
+import unittest
+from unittest.mock import patch
+
+from cryptography.fernet import Fernet
+
+from keycache import KeyCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestKeyCache(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.cache = KeyCache(max_entries=2, ttl=60, clock=self.clock)
+
+    def test_derives_once_per_session(self):
+        calls = []
+        derive = lambda: calls.append(1) or b"key"
+        for _ in range(5):
+            self.assertEqual(self.cache.get_or_derive("sid", derive), b"key")
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(self.cache.stats(), {"hits": 4, "misses": 1, "size": 1})
+
+    def test_least_recently_used_entry_is_evicted(self):
+        self.cache.put("a", b"1")
+        self.cache.put("b", b"2")
+        self.cache.get("a")
+        self.cache.put("c", b"3")
+        self.assertIsNone(self.cache.get("b"))
+        self.assertEqual(self.cache.get("a"), b"1")
+        self.assertEqual(self.cache.get("c"), b"3")
+
+    def test_idle_entries_expire(self):
+        self.cache.put("a", b"1")
+        self.clock.now = 30
+        self.assertEqual(self.cache.get("a"), b"1")
+        self.clock.now = 89
+        self.assertEqual(self.cache.get("a"), b"1")
+        self.clock.now = 150
+        self.assertIsNone(self.cache.get("a"))
+        self.assertEqual(self.cache.stats()["size"], 0)
+
+    def test_evict_and_clear(self):
+        self.cache.put("a", b"1")
+        self.cache.put("b", b"2")
+        self.cache.evict("a")
+        self.assertIsNone(self.cache.get("a"))
+        self.cache.clear()
+        self.assertIsNone(self.cache.get("b"))
+
+
+class TestFlaskKeyAccessor(unittest.TestCase):
+
+    def test_routes_share_one_derivation_per_login(self):
+        import flask_app
+        from flask import session
+
+        flask_app.key_cache.clear()
+        key = Fernet.generate_key()
+        with patch.object(flask_app.storage, "unlock", return_value=key) as derive, \
+                patch.object(flask_app, "is_vault_locked", return_value=False):
+            with flask_app.app.test_request_context():
+                session["master"] = "pw"
+                flask_app.start_key_session()
+                for _ in range(3):
+                    self.assertEqual(flask_app.get_vault_key(), key)
+                flask_app.start_key_session()
+                flask_app.get_vault_key()
+        self.assertEqual(derive.call_count, 2)
+
+    def test_idle_lock_forgets_only_the_idle_sessions_key(self):
+        import flask_app
+        from flask import session
+
+        flask_app.key_cache.clear()
+        flask_app.key_cache.put("other-user", b"other key")
+        key = Fernet.generate_key()
+        with patch.object(flask_app.storage, "unlock", return_value=key) as derive:
+            with flask_app.app.test_request_context():
+                session["master"] = "pw"
+                flask_app.start_key_session()
+                with patch.object(flask_app, "is_vault_locked", return_value=False):
+                    flask_app.get_vault_key()
+                with patch.object(flask_app, "is_vault_locked", return_value=True):
+                    flask_app.get_vault_key()
+        self.assertEqual(derive.call_count, 2)
+        self.assertEqual(flask_app.key_cache.get("other-user"), b"other key")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+import multiprocessing
+import os
+import tempfile
+import threading
+import unittest
+
+from cryptography.fernet import Fernet
+
+import storage
+
+WRITERS = 6
+RECORDS_PER_WRITER = 15
+
+
+def _write_records(key, path, writer):
+    for i in range(RECORDS_PER_WRITER):
+        storage.put_record(key, f"w{writer}-{i}.com", {"username": f"u{writer}", "password": str(i)}, path)
+
+
+class TestConcurrentWrites(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "vault.json.enc")
+        self.key = Fernet.generate_key()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def assert_nothing_lost(self):
+        data = storage.load_vault(self.key, self.path)
+        self.assertEqual(len(data), WRITERS * RECORDS_PER_WRITER)
+        for writer in range(WRITERS):
+            for i in range(RECORDS_PER_WRITER):
+                self.assertEqual(data[f"w{writer}-{i}.com"]["password"], str(i))
+
+    def test_parallel_processes_lose_no_updates(self):
+        ctx = multiprocessing.get_context("fork")
+        for fmt in storage.FORMATS:
+            with self.subTest(fmt=fmt):
+                storage.save_vault({}, self.key, self.path, fmt)
+                storage.reindex_vault(self.key, self.path)
+                procs = [ctx.Process(target=_write_records, args=(self.key, self.path, w)) for w in range(WRITERS)]
+                for p in procs:
+                    p.start()
+                for p in procs:
+                    p.join()
+                    self.assertEqual(p.exitcode, 0)
+                self.assertEqual(storage.detect_format(self.path), fmt)
+                self.assert_nothing_lost()
+                self.assertEqual(len(storage.search_records(self.key, "w3-", self.path)), RECORDS_PER_WRITER)
+
+    def test_parallel_threads_lose_no_updates(self):
+        storage.save_vault({}, self.key, self.path, storage.FORMAT_LOG)
+        threads = [threading.Thread(target=_write_records, args=(self.key, self.path, w)) for w in range(WRITERS)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        storage.clear_cache()
+        self.assert_nothing_lost()
+
+    def test_no_temp_file_left_behind(self):
+        storage.save_vault({"a.com": {"username": "u", "password": "p"}}, self.key, self.path)
+        self.assertFalse(os.path.exists(self.path + ".tmp"))
+
+
+class TestVersions(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "vault.json.enc")
+        self.key = Fernet.generate_key()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_every_write_changes_the_version(self):
+        self.assertIsNone(storage.vault_version(self.path))
+        for fmt in storage.FORMATS:
+            storage.save_vault({}, self.key, self.path, fmt)
+            seen = {storage.vault_version(self.path)}
+            storage.put_record(self.key, "a.com", {"username": "u", "password": "p"}, self.path)
+            seen.add(storage.vault_version(self.path))
+            storage.delete_record(self.key, "a.com", self.path)
+            seen.add(storage.vault_version(self.path))
+            self.assertEqual(len(seen), 3, fmt)
+
+    def test_stale_version_is_rejected(self):
+        storage.save_vault({}, self.key, self.path)
+        version = storage.vault_version(self.path)
+        storage.put_record(self.key, "a.com", {"username": "u", "password": "p"}, self.path, expected_version=version)
+        with self.assertRaises(storage.VersionConflict):
+            storage.put_record(self.key, "b.com", {"username": "u", "password": "p"}, self.path,
+                               expected_version=version)
+        with self.assertRaises(storage.VersionConflict):
+            storage.delete_record(self.key, "a.com", self.path, expected_version=version)
+        self.assertEqual([*storage.load_vault(self.key, self.path)], ["a.com"])
+
+    def test_locks_are_reentrant_but_not_upgradable(self):
+        storage.save_vault({}, self.key, self.path)
+        with storage.vault_lock(self.path, exclusive=True):
+            storage.put_record(self.key, "a.com", {"username": "u", "password": "p"}, self.path)
+            self.assertIn("a.com", storage.load_vault(self.key, self.path))
+        with storage.vault_lock(self.path):
+            with self.assertRaises(RuntimeError):
+                storage.put_record(self.key, "b.com", {"username": "u", "password": "p"}, self.path)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from click.testing import CliRunner
+from cryptography.fernet import Fernet
+
+import audit
+import cli
+import flask_app
+import metrics
+import storage
+import vault
+from metrics import Registry
+
+
+class TestRegistry(unittest.TestCase):
+
+    def test_histogram_buckets_are_cumulative(self):
+        registry = Registry(buckets=(0.01, 0.1))
+        for seconds in (0.005, 0.05, 0.05, 3):
+            registry.observe("vault_stage_seconds", seconds, stage="kdf")
+        text = registry.render()
+        self.assertIn("# TYPE vault_stage_seconds histogram", text)
+        self.assertIn('vault_stage_seconds_bucket{stage="kdf",le="0.01"} 1', text)
+        self.assertIn('vault_stage_seconds_bucket{stage="kdf",le="0.1"} 3', text)
+        self.assertIn('vault_stage_seconds_bucket{stage="kdf",le="+Inf"} 4', text)
+        self.assertIn('vault_stage_seconds_count{stage="kdf"} 4', text)
+        self.assertEqual(registry.summary()["kdf"][0], 4)
+
+    def test_counters_and_label_escaping(self):
+        registry = Registry()
+        registry.inc("vault_kdf_total", kdf="scrypt")
+        registry.inc("vault_kdf_total", 2, kdf="scrypt")
+        registry.inc("custom", route='a"b\\c')
+        text = registry.render()
+        self.assertIn('vault_kdf_total{kdf="scrypt"} 3', text)
+        self.assertIn("# TYPE custom untyped", text)
+        self.assertIn('custom{route="a\\"b\\\\c"} 1', text)
+
+    def test_hot_paths_are_timed(self):
+        metrics.registry.clear()
+        key = Fernet.generate_key()
+        vault.decrypt_data(vault.encrypt_data({"a": 1}, key), key)
+        vault.derive_key("pw", b"\0" * 16, vault.DEFAULT_KDF)
+        stages = metrics.registry.summary()
+        for stage in ("json_encode", "encrypt", "decrypt", "json_parse", "kdf"):
+            self.assertEqual(stages[stage][0], 1, stage)
+        self.assertEqual(metrics.registry.value("vault_kdf_total", kdf=vault.KDF_PBKDF2), 1)
+        self.assertGreater(metrics.registry.value("vault_bytes_read_total"), 0)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            storage.put_record(key, "a.com", {"username": "u", "password": "p"}, os.path.join(tmp, "vault"))
+        self.assertGreater(metrics.registry.value("vault_bytes_written_total"), 0)
+        self.assertGreaterEqual(metrics.registry.summary()["fsync"][0], 2)
+
+
+class TestMetricsEndpoint(unittest.TestCase):
+
+    def test_requires_token_or_login(self):
+        client = flask_app.app.test_client()
+        client.get("/")
+        self.assertEqual(client.get("/metrics").status_code, 401)
+        with patch.object(flask_app, "METRICS_TOKEN", "scrape-me"):
+            self.assertEqual(client.get("/metrics", headers={"Authorization": "Bearer wrong"}).status_code, 401)
+            resp = client.get("/metrics", headers={"Authorization": "Bearer scrape-me"})
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(resp.content_type.startswith("text/plain"))
+        text = resp.get_data(as_text=True)
+        self.assertIn('vault_http_requests_total{method="GET",route="/",status="200"}', text)
+        self.assertIn('vault_cache_hits_total{cache="key"}', text)
+
+    def test_routes_are_labelled_by_pattern(self):
+        client = flask_app.app.test_client()
+        client.post("/delete/secret-site.com")
+        text = metrics.registry.render()
+        self.assertIn('route="/delete/<site>"', text)
+        self.assertNotIn("secret-site", text)
+
+
+class TestProfileFlag(unittest.TestCase):
+
+    def test_prints_stage_breakdown(self):
+        cwd = os.getcwd()
+        with tempfile.TemporaryDirectory() as tmp:
+            os.chdir(tmp)
+            try:
+                result = CliRunner().invoke(cli.cli, ["--profile", "init", "--master", "pw"])
+                audit.flush()
+            finally:
+                os.chdir(cwd)
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn("Profile", result.output)
+        self.assertRegex(result.output, r"kdf\s+1\s")
+
+
+if __name__ == '__main__':
+    unittest.main()
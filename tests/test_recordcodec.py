@@ -0,0 +1,81 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from cryptography.fernet import Fernet
+
+import recordcodec
+import storage
+from vault import decrypt_data, encrypt_data
+
+
+class TestRecordCodec(unittest.TestCase):
+
+    def setUp(self):
+        self.data = {
+            "github.com": {"username": "alice", "password": "p@ss"},
+            "gitlab.com": {"username": "bob", "password": "ünïcødé 🔑"},
+            "bank.com": {"username": "carol", "password": "x", "notes": "pin \x00 1234"},
+            "empty.com": {},
+            "other.com": {"password": "only", "username": "reordered"},
+        }
+
+    def test_round_trip_in_every_encoding(self):
+        for encoding in recordcodec.ENCODINGS:
+            payload = recordcodec.encode(self.data, encoding)
+            self.assertEqual(recordcodec.payload_encoding(payload), encoding)
+            self.assertEqual(recordcodec.decode(payload), self.data, encoding)
+            self.assertEqual(recordcodec.decode(recordcodec.encode({}, encoding)), {}, encoding)
+
+    def test_smaller_than_json(self):
+        data = {f"site-{i}.example.com": {"username": f"user{i}", "password": "correct horse"} for i in range(500)}
+        sizes = [len(recordcodec.encode(data, encoding)) for encoding in recordcodec.ENCODINGS]
+        self.assertLess(sizes[1], sizes[0] * 0.7)
+        self.assertLess(sizes[2], sizes[1])
+
+    def test_other_payloads_fall_back_to_json(self):
+        for data in ({"version": 2, "records": {"a": [0, 10]}}, {"a": {"username": "u", "tags": ["x"]}}):
+            payload = recordcodec.encode(data, recordcodec.ENCODING_RECORDS_ZLIB)
+            self.assertEqual(recordcodec.payload_encoding(payload), recordcodec.ENCODING_JSON)
+            self.assertEqual(recordcodec.decode(payload), data)
+
+    def test_corrupted_payloads_raise_value_error(self):
+        payload = recordcodec.encode(self.data, recordcodec.ENCODING_RECORDS)
+        for broken in (b"", b"\x07abc", payload[:-3], payload[:8], b"\x81not zlib"):
+            with self.assertRaises(ValueError):
+                recordcodec.decode(broken)
+        with self.assertRaises(ValueError):
+            recordcodec.encode(self.data, "msgpack")
+
+
+class TestEncryptedPayloads(unittest.TestCase):
+
+    def setUp(self):
+        self.key = Fernet.generate_key()
+        self.data = {"github.com": {"username": "alice", "password": "p@ss"}}
+
+    def test_binary_encodings_store_raw_tokens(self):
+        legacy = encrypt_data(self.data, self.key)
+        self.assertTrue(legacy.startswith(b"gAAAAA"))
+        for encoding in recordcodec.ENCODINGS[1:]:
+            token = encrypt_data(self.data, self.key, encoding)
+            self.assertEqual(token[:1], b"\x80")
+            self.assertEqual(decrypt_data(token, self.key), self.data)
+        self.assertEqual(decrypt_data(legacy, self.key), self.data)
+        with self.assertRaises(ValueError):
+            decrypt_data(encrypt_data(self.data, self.key, "records"), Fernet.generate_key())
+
+    def test_v1_vaults_in_any_encoding_load(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "vault.json.enc")
+            for encoding in recordcodec.ENCODINGS:
+                with patch.object(storage, "DEFAULT_ENCODING", encoding):
+                    storage.save_vault(self.data, self.key, path, storage.FORMAT_V1)
+                self.assertEqual(storage.detect_format(path), storage.FORMAT_V1)
+                self.assertEqual(storage.load_vault(self.key, path), self.data, encoding)
+                self.assertTrue(storage.check_key(self.key, path))
+
+
+if __name__ == '__main__':
+    unittest.main()
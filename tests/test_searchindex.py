@@ -0,0 +1,77 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from cryptography.fernet import Fernet
+
+import searchindex
+import storage
+
+
+class TestSearchIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "vault.json.enc")
+        self.key = Fernet.generate_key()
+        storage.save_vault({
+            "github.com": {"username": "nick", "password": "pw1"},
+            "gitlab.com": {"username": "alice", "password": "pw2"},
+            "example.org": {"username": "nick", "password": "pw3"},
+        }, self.key, self.path)
+        storage.reindex_vault(self.key, self.path)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_index_file_is_blind(self):
+        with open(searchindex.index_path(self.path), encoding="utf-8") as f:
+            raw = f.read()
+        for text in ("git", "github", "example", "nick"):
+            self.assertNotIn(text, raw)
+
+    def test_vaults_in_one_directory_keep_their_own_index(self):
+        other = os.path.join(self.tmp.name, "work.enc")
+        storage.save_vault({"jira.example.com": {"username": "nick", "password": "pw"}}, self.key, other)
+        storage.reindex_vault(self.key, other)
+        self.assertNotEqual(searchindex.index_path(other), searchindex.index_path(self.path))
+        with patch.object(storage, "load_vault", side_effect=AssertionError("full scan")):
+            self.assertEqual(sorted(storage.search_records(self.key, "git", self.path)), ["github.com", "gitlab.com"])
+            self.assertEqual(list(storage.search_records(self.key, "jira", other)), ["jira.example.com"])
+
+    def test_search_decrypts_only_candidates(self):
+        with patch.object(storage, "load_vault", side_effect=AssertionError("full scan")):
+            self.assertEqual(sorted(storage.search_records(self.key, "GIT", self.path)), ["github.com", "gitlab.com"])
+            self.assertEqual(sorted(storage.search_records(self.key, "hub.c", self.path)), ["github.com"])
+            self.assertEqual(storage.search_records(self.key, "nothing", self.path), {})
+
+    def test_short_queries_fall_back_to_a_scan(self):
+        self.assertEqual(sorted(storage.search_records(self.key, "gi", self.path)), ["github.com", "gitlab.com"])
+
+    def test_incremental_updates(self):
+        storage.put_record(self.key, "bitbucket.org", {"username": "nick", "password": "x"}, self.path)
+        self.assertEqual(list(storage.search_records(self.key, "bucket", self.path)), ["bitbucket.org"])
+        storage.delete_record(self.key, "github.com", self.path)
+        self.assertEqual(list(storage.search_records(self.key, "git", self.path)), ["gitlab.com"])
+
+        rebuilt = searchindex.SearchIndex(self.key)
+        for site, creds in storage.load_vault(self.key, self.path).items():
+            rebuilt.add(storage.record_id(self.key, site), site, creds)
+        self.assertEqual(searchindex.load(self.key, searchindex.index_path(self.path)).records, rebuilt.records)
+
+    def test_username_indexing_is_optional(self):
+        self.assertEqual(storage.search_records(self.key, "alice", self.path), {})
+        storage.reindex_vault(self.key, self.path, fields=["site", "username"])
+        self.assertEqual(list(storage.search_records(self.key, "alice", self.path)), ["gitlab.com"])
+        storage.put_record(self.key, "new.com", {"username": "alicia", "password": "p"}, self.path)
+        self.assertEqual(sorted(storage.search_records(self.key, "ali", self.path)), ["gitlab.com", "new.com"])
+
+    def test_log_vaults_use_the_index_too(self):
+        storage.migrate_vault(self.key, self.path, storage.FORMAT_LOG)
+        storage.put_record(self.key, "gitea.io", {"username": "n", "password": "p"}, self.path)
+        self.assertEqual(sorted(storage.search_records(self.key, "git", self.path)), ["gitea.io", "github.com", "gitlab.com"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,149 @@
+import io
+import os
+import tempfile
+import time
+import unittest
+from unittest.mock import patch
+
+from click.testing import CliRunner
+from cryptography.fernet import Fernet
+
+import audit
+import cli
+import storage
+from shell import SessionLocked, VaultSession, VaultShell, run_batch
+
+
+class ShellTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cwd = os.getcwd()
+        os.chdir(self.tmp.name)  # audit log and last-access file
+        self.path = os.path.join(self.tmp.name, "vault.json.enc")
+        self.key = Fernet.generate_key()
+        storage.save_vault({"a.com": {"username": "alice", "password": "pw-a"},
+                            "b.com": {"username": "bob", "password": "pw-b"}}, self.key, self.path)
+        self.session = VaultSession(self.key, self.path)
+
+    def tearDown(self):
+        audit.flush()
+        os.chdir(self.cwd)
+        storage.clear_cache()
+        self.tmp.cleanup()
+
+    def on_disk(self):
+        return storage.load_vault(self.key, self.path)
+
+
+class TestVaultSession(ShellTestCase):
+
+    def test_changes_are_staged_until_one_commit(self):
+        self.session.put("c.com", {"username": "carol", "password": "pw-c"})
+        self.session.put("a.com", {"username": "alice", "password": "new"})
+        self.assertTrue(self.session.delete("b.com"))
+        self.assertFalse(self.session.delete("nope.com"))
+        self.assertEqual(self.session.sites(), ["a.com", "c.com"])
+        self.assertEqual(sorted(self.on_disk()), ["a.com", "b.com"])
+
+        with patch.object(storage, "put_records", wraps=storage.put_records) as put:
+            self.assertEqual(self.session.commit(), 3)
+        put.assert_called_once()
+        self.assertEqual(self.on_disk(), {"a.com": {"username": "alice", "password": "new"},
+                                          "c.com": {"username": "carol", "password": "pw-c"}})
+        self.assertEqual(self.session.commit(), 0)
+
+    def test_commit_keeps_other_writers_changes(self):
+        storage.put_record(self.key, "other.com", {"username": "o", "password": "p"}, self.path)
+        self.session.delete("a.com")
+        self.session.commit()
+        self.assertEqual(self.session.sites(), ["b.com", "other.com"])
+        self.assertEqual(sorted(self.on_disk()), ["b.com", "other.com"])
+
+    def test_discard_and_search(self):
+        self.session.delete("a.com")
+        self.assertEqual(self.session.discard(), 1)
+        self.assertEqual([*self.session.search("BOB")], ["b.com"])
+        self.assertEqual([*self.session.search(".com")], ["a.com", "b.com"])
+
+    def test_lock_saves_then_forgets(self):
+        self.session.put("c.com", {"username": "carol", "password": "pw-c"})
+        self.session.lock()
+        self.assertIn("c.com", self.on_disk())
+        self.assertTrue(self.session.locked)
+        with self.assertRaises(SessionLocked):
+            self.session.get("a.com")
+        self.session.unlock(self.key)
+        self.assertEqual(self.session.get("c.com")["username"], "carol")
+
+
+class TestVaultShell(ShellTestCase):
+
+    def test_idle_session_locks_and_asks_to_unlock(self):
+        shell = VaultShell(self.session, unlock=lambda: self.key, timeout=0.05, stdout=io.StringIO())
+        shell.preloop()
+        self.session.put("c.com", {"username": "carol", "password": "pw-c"})
+        deadline = time.monotonic() + 5
+        while not self.session.locked and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertTrue(self.session.locked)
+        self.assertIn("c.com", self.on_disk())
+
+        line = shell.precmd("get a.com")
+        self.assertFalse(self.session.locked)
+        shell.onecmd(line)
+        shell.postloop()
+        self.assertFalse(shell.failed)
+
+    def test_failed_idle_commit_is_reported_and_keeps_the_session(self):
+        shell = VaultShell(self.session, unlock=lambda: self.key, timeout=0.01, stdout=io.StringIO())
+        self.session.put("c.com", {"username": "carol", "password": "pw-c"})
+        with patch.object(storage, "put_records", side_effect=OSError("disk full")), \
+                patch("shell.click.echo") as echo:
+            shell.preloop()
+            time.sleep(0.1)
+            shell.precmd("list")
+        shell.postloop()
+        self.assertIn("disk full", echo.call_args_list[0].args[0])
+        self.assertTrue(shell.failed)
+        self.assertFalse(self.session.locked)
+        self.assertEqual(self.session.pending, 1)
+        self.assertNotIn("c.com", self.on_disk())
+
+    def test_completes_site_names(self):
+        shell = VaultShell(self.session)
+        self.assertEqual(shell.complete_get("a", "get a", 4, 5), ["a.com"])
+        self.assertEqual(shell.complete_delete("", "delete ", 7, 7), ["a.com", "b.com"])
+
+
+class TestBatch(ShellTestCase):
+
+    def test_script_runs_and_commits_once(self):
+        script = ["# cleanup", "add c.com carol 'pw with spaces'", "edit a.com - newpw", "delete b.com", "", "list"]
+        self.assertTrue(run_batch(self.session, script))
+        self.assertEqual(self.on_disk(), {"a.com": {"username": "alice", "password": "newpw"},
+                                          "c.com": {"username": "carol", "password": "pw with spaces"}})
+
+    def test_failure_saves_nothing_unless_keep_going(self):
+        script = ["delete a.com", "get missing.com", "delete b.com"]
+        self.assertFalse(run_batch(self.session, script))
+        self.assertEqual(sorted(self.on_disk()), ["a.com", "b.com"])
+
+        self.assertFalse(run_batch(self.session, script, keep_going=True))
+        self.assertEqual(self.on_disk(), {})
+
+    def test_batch_never_prompts(self):
+        self.assertFalse(run_batch(self.session, ["add c.com carol"]))
+        self.assertNotIn("c.com", self.on_disk())
+
+    def test_cli_batch_reads_stdin(self):
+        # The default vault path is relative, so it resolves to self.path in the temp dir
+        with patch.object(cli, "resolve_key", return_value=self.key):
+            result = CliRunner().invoke(cli.cli, ["batch", "--master", "pw"], input="delete a.com\nbogus\n")
+        self.assertEqual(result.exit_code, 1, result.output)
+        self.assertIn("line 2", result.output)
+        self.assertEqual(sorted(self.on_disk()), ["a.com", "b.com"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,559 @@
+import os
+import tempfile
+import threading
+import unittest
+from unittest.mock import patch
+
+from cryptography.fernet import Fernet
+
+import audit
+import searchindex
+import storage
+import vault
+from vault import encrypt_data
+
+
+class TestStorage(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "vault.json.enc")
+        self.key = Fernet.generate_key()
+        self.data = {
+            "github.com": {"username": "nick", "password": "pw1"},
+            "gitlab.com": {"username": "nick", "password": "pw2"},
+        }
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def write_v1(self, data):
+        with open(self.path, "wb") as f:
+            f.write(encrypt_data(data, self.key))
+
+    def test_new_vaults_use_v2(self):
+        storage.save_vault(self.data, self.key, self.path)
+        self.assertEqual(storage.detect_format(self.path), storage.FORMAT_V2)
+        self.assertEqual(storage.load_vault(self.key, self.path), self.data)
+
+    def test_get_record_reads_only_its_record(self):
+        storage.save_vault(self.data, self.key, self.path)
+        with open(self.path, "rb") as f:
+            index, start = storage._read_index(f, self.key)
+        offset, length = index["gitlab.com"]
+        with open(self.path, "r+b") as f:
+            f.seek(start + offset)
+            f.write(b"x" * length)
+
+        self.assertEqual(storage.get_record(self.key, "github.com", self.path), self.data["github.com"])
+        self.assertIsNone(storage.get_record(self.key, "missing", self.path))
+        with self.assertRaises(ValueError):
+            storage.get_record(self.key, "gitlab.com", self.path)
+
+    def test_get_record_with_wrong_key_fails(self):
+        storage.save_vault(self.data, self.key, self.path)
+        with self.assertRaises(ValueError):
+            storage.get_record(Fernet.generate_key(), "github.com", self.path)
+
+    def test_reader_falls_back_without_lookup_table(self):
+        storage.save_vault(self.data, self.key, self.path)
+        with open(self.path, "rb") as f:
+            f.seek(-storage._INDEX_FOOTER.size, os.SEEK_END)
+            _, table_offset, _, _ = storage._INDEX_FOOTER.unpack(f.read())
+        with open(self.path, "r+b") as f:
+            f.truncate(table_offset)
+
+        with storage.VaultReader(self.path, self.key) as reader:
+            self.assertEqual(reader.get("gitlab.com"), self.data["gitlab.com"])
+            self.assertIsNone(reader.get("missing"))
+
+    def test_put_and_delete_keep_order_and_other_records(self):
+        storage.save_vault(self.data, self.key, self.path)
+        storage.put_record(self.key, "github.com", {"username": "new", "password": "pw3"}, self.path)
+        storage.put_record(self.key, "example.com", {"username": "e", "password": "pw4"}, self.path)
+        self.assertEqual(list(storage.load_vault(self.key, self.path)), ["github.com", "gitlab.com", "example.com"])
+        self.assertEqual(storage.get_record(self.key, "github.com", self.path)["username"], "new")
+
+        self.assertTrue(storage.delete_record(self.key, "gitlab.com", self.path))
+        self.assertFalse(storage.delete_record(self.key, "gitlab.com", self.path))
+        self.assertEqual(list(storage.load_vault(self.key, self.path)), ["github.com", "example.com"])
+
+    def test_v1_vaults_are_read_and_written_in_place(self):
+        self.write_v1(self.data)
+        self.assertEqual(storage.get_record(self.key, "github.com", self.path), self.data["github.com"])
+        storage.put_record(self.key, "example.com", {"username": "e", "password": "p"}, self.path)
+        self.assertEqual(storage.detect_format(self.path), storage.FORMAT_V1)
+        self.assertIn("example.com", storage.load_vault(self.key, self.path))
+
+    def test_migrate_v1_to_v2(self):
+        self.write_v1(self.data)
+        self.assertEqual(storage.migrate_vault(self.key, self.path), storage.FORMAT_V1)
+        self.assertEqual(storage.detect_format(self.path), storage.FORMAT_V2)
+        self.assertEqual(storage.load_vault(self.key, self.path), self.data)
+
+    def test_wrong_key_fails(self):
+        storage.save_vault(self.data, self.key, self.path)
+        with self.assertRaises(ValueError):
+            storage.load_vault(Fernet.generate_key(), self.path)
+
+    def test_check_key(self):
+        self.assertFalse(storage.check_key(self.key, self.path))
+        for fmt in storage.FORMATS:
+            storage.save_vault(self.data, self.key, self.path, fmt)
+            self.assertTrue(storage.check_key(self.key, self.path), fmt)
+            self.assertFalse(storage.check_key(Fernet.generate_key(), self.path), fmt)
+
+    def test_put_records_applies_puts_and_deletes_in_one_write(self):
+        for fmt in storage.FORMATS:
+            storage.save_vault(self.data, self.key, self.path, fmt)
+            storage.put_records(self.key, {"github.com": None, "new.com": {"username": "n", "password": "p"},
+                                           "missing.com": None}, self.path)
+            self.assertEqual(storage.load_vault(self.key, self.path),
+                             {"gitlab.com": self.data["gitlab.com"], "new.com": {"username": "n", "password": "p"}}, fmt)
+            storage.clear_cache()
+
+
+
+class TestLogStorage(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "vault.json.enc")
+        self.key = Fernet.generate_key()
+        storage.clear_cache()
+        storage.save_vault({"a": {"username": "u", "password": "1"}}, self.key, self.path, storage.FORMAT_LOG)
+
+    def tearDown(self):
+        storage.clear_cache()
+        self.tmp.cleanup()
+
+    def test_mutations_append_to_the_log(self):
+        size = os.path.getsize(self.path)
+        storage.put_record(self.key, "b", {"username": "u", "password": "2"}, self.path)
+        self.assertGreater(os.path.getsize(self.path), size)
+        self.assertTrue(storage.delete_record(self.key, "a", self.path))
+        self.assertFalse(storage.delete_record(self.key, "a", self.path))
+
+        storage.clear_cache()
+        self.assertEqual(storage.load_vault(self.key, self.path), {"b": {"username": "u", "password": "2"}})
+        self.assertEqual(storage.detect_format(self.path), storage.FORMAT_LOG)
+
+    def test_torn_tail_is_ignored_and_overwritten(self):
+        storage.put_record(self.key, "b", {"username": "u", "password": "2"}, self.path)
+        with open(self.path, "ab") as f:
+            f.write(b"\x00\x00\x01\x00partial")
+        storage.clear_cache()
+        self.assertEqual(sorted(storage.load_vault(self.key, self.path)), ["a", "b"])
+
+        storage.put_record(self.key, "c", {"username": "u", "password": "3"}, self.path)
+        storage.clear_cache()
+        self.assertEqual(sorted(storage.load_vault(self.key, self.path)), ["a", "b", "c"])
+
+    def test_wrong_key_fails_even_on_empty_log(self):
+        storage.save_vault({}, self.key, self.path, storage.FORMAT_LOG)
+        with self.assertRaises(ValueError):
+            storage.put_record(Fernet.generate_key(), "x", {"username": "u", "password": "p"}, self.path)
+
+    def test_compaction(self):
+        for i in range(10):
+            storage.put_record(self.key, "a", {"username": "u", "password": str(i)}, self.path)
+        before, after = storage.compact_vault(self.key, self.path)
+        self.assertLess(after, before)
+        self.assertEqual(storage.get_record(self.key, "a", self.path)["password"], "9")
+
+    def test_automatic_compaction_threshold(self):
+        old = storage.COMPACT_MIN_FRAMES
+        storage.COMPACT_MIN_FRAMES = 8
+        try:
+            for i in range(8):
+                storage.put_record(self.key, "a", {"username": "u", "password": str(i)}, self.path)
+        finally:
+            storage.COMPACT_MIN_FRAMES = old
+        storage.clear_cache()
+        state = storage._replay_log(self.path, self.key)
+        self.assertLess(state.frames, 8)
+        self.assertEqual(state.data["a"]["password"], "7")
+
+    def test_snapshot_cache_is_bounded(self):
+        other = os.path.join(self.tmp.name, "other.json.enc")
+        storage.save_vault({"b": {"username": "u", "password": "2"}}, self.key, other, storage.FORMAT_LOG)
+        storage.put_record(self.key, "c", {"username": "u", "password": "3"}, self.path)
+        size = storage._replay_log(self.path, self.key).size
+        self.assertEqual(size, storage.estimate_size(storage.load_vault(self.key, self.path)))
+
+        with patch.object(storage, "LOG_CACHE_MAX_BYTES", size):
+            storage._replay_log(self.path, self.key)
+            storage._replay_log(other, self.key)
+            self.assertEqual(list(storage._log_cache), [os.path.abspath(other)])
+
+            storage.put_record(self.key, "d", {"username": "u", "password": "4"}, self.path)
+            self.assertNotIn(os.path.abspath(self.path), storage._log_cache)
+            self.assertEqual(sorted(storage.load_vault(self.key, self.path)), ["a", "c", "d"])
+            self.assertEqual(storage.load_vault(self.key, other), {"b": {"username": "u", "password": "2"}})
+
+
+class TestSQLiteStorage(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "vault.json.enc")
+        self.key = Fernet.generate_key()
+        self.data = {f"site{i}.com": {"username": f"user{i}", "password": f"pw{i}"} for i in range(5)}
+        storage.save_vault(self.data, self.key, self.path, storage.FORMAT_SQLITE)
+
+    def tearDown(self):
+        storage.clear_cache()
+        self.tmp.cleanup()
+
+    def test_rows_are_encrypted_one_per_record(self):
+        self.assertEqual(storage.detect_format(self.path), storage.FORMAT_SQLITE)
+        self.assertEqual(storage.load_vault(self.key, self.path), self.data)
+        rows = storage._sqlite(self.path).execute("SELECT tag, token FROM records").fetchall()
+        self.assertEqual(len(rows), 5)
+        self.assertEqual({tag.hex() for tag, _ in rows}, {storage.record_id(self.key, s) for s in self.data})
+        storage.clear_cache()
+        with open(self.path, "rb") as f:
+            self.assertNotIn(b"site1.com", f.read())
+
+    def test_point_operations(self):
+        self.assertEqual(storage.get_record(self.key, "site3.com", self.path), self.data["site3.com"])
+        self.assertIsNone(storage.get_record(self.key, "missing", self.path))
+
+        version = storage.vault_version(self.path)
+        storage.put_record(self.key, "site3.com", {"username": "u", "password": "new"}, self.path)
+        self.assertNotEqual(storage.vault_version(self.path), version)
+        self.assertEqual(storage.get_record(self.key, "site3.com", self.path)["password"], "new")
+        self.assertEqual(storage.list_sites(self.key, self.path), [*self.data])
+
+        self.assertTrue(storage.delete_record(self.key, "site0.com", self.path))
+        self.assertFalse(storage.delete_record(self.key, "site0.com", self.path))
+        ids = [storage.record_id(self.key, "site1.com"), storage.record_id(self.key, "site0.com")]
+        self.assertEqual(storage.get_records_by_id(self.key, ids, self.path), {"site1.com": self.data["site1.com"]})
+
+    def test_wrong_key_fails(self):
+        other = Fernet.generate_key()
+        with self.assertRaises(ValueError):
+            storage.get_record(other, "site1.com", self.path)
+        with self.assertRaises(ValueError):
+            storage.put_record(other, "x", {"username": "u", "password": "p"}, self.path)
+
+    def test_readers_do_not_wait_for_a_writer(self):
+        result = []
+        with storage.vault_lock(self.path, exclusive=True):
+            reader = threading.Thread(target=lambda: result.append(
+                storage.get_record(self.key, "site2.com", self.path)))
+            reader.start()
+            reader.join(5)
+            self.assertFalse(reader.is_alive())
+        self.assertEqual(result, [self.data["site2.com"]])
+
+    def test_migrate_to_and_from_sqlite(self):
+        storage.put_record(self.key, "extra.com", {"username": "u", "password": "p"}, self.path)
+        expected = {**self.data, "extra.com": {"username": "u", "password": "p"}}
+        self.assertEqual(storage.migrate_vault(self.key, self.path, storage.FORMAT_V2), storage.FORMAT_SQLITE)
+        self.assertFalse(os.path.exists(self.path + "-wal"))
+        self.assertEqual(storage.load_vault(self.key, self.path), expected)
+
+        self.assertEqual(storage.migrate_vault(self.key, self.path, storage.FORMAT_SQLITE), storage.FORMAT_V2)
+        self.assertEqual(storage.detect_format(self.path), storage.FORMAT_SQLITE)
+        self.assertEqual(storage.load_vault(self.key, self.path), expected)
+
+    def test_save_with_the_wrong_key_fails(self):
+        with self.assertRaises(ValueError):
+            storage.save_vault({"evil.com": {"username": "x", "password": "y"}}, Fernet.generate_key(), self.path)
+        self.assertEqual(storage.load_vault(self.key, self.path), self.data)
+
+    def test_rekey_rewrites_the_file(self):
+        new_key = Fernet.generate_key()
+        storage.save_vault(self.data, new_key, self.path, rekey=True)
+        self.assertEqual(storage.load_vault(new_key, self.path), self.data)
+        self.assertFalse(storage.check_key(self.key, self.path))
+
+
+class TestStreamStorage(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "vault.json.enc")
+        self.key = Fernet.generate_key()
+        self.data = {f"site{i}.com": {"username": f"user{i}", "password": f"pw{i}"} for i in range(50)}
+        # Small chunks and batches, so a vault this size spans many of both
+        with patch("streamcrypt.CHUNK_SIZE", 128), patch.object(storage, "STREAM_BATCH", 4):
+            storage.save_vault(self.data, self.key, self.path, storage.FORMAT_STREAM)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def truncate(self, size):
+        with open(self.path, "r+b") as f:
+            f.truncate(size)
+
+    def test_chunks_are_encrypted_and_bound_to_the_header(self):
+        self.assertEqual(storage.detect_format(self.path), storage.FORMAT_STREAM)
+        self.assertEqual(storage.load_vault(self.key, self.path), self.data)
+        with open(self.path, "rb") as f:
+            blob = f.read()
+        self.assertNotIn(b"site1.com", blob)
+        self.assertGreater(len(blob), 10 * 128)
+        for offset in (5, storage._STREAM_HEADER.size + 300):  # the version byte, then a chunk
+            tampered = bytearray(blob)
+            tampered[offset] ^= 1
+            with open(self.path, "wb") as f:
+                f.write(tampered)
+            with self.assertRaises(ValueError):
+                storage.load_vault(self.key, self.path)
+
+    def test_records_stream_before_the_file_is_read(self):
+        size = os.path.getsize(self.path)
+        self.truncate(size - 144)  # drops the final chunk
+        records = storage.iter_vault(self.key, self.path)
+        self.assertEqual(next(records), ("site0.com", self.data["site0.com"]))
+        with self.assertRaises(ValueError):
+            list(records)
+        with self.assertRaises(ValueError):
+            storage.load_vault(self.key, self.path)
+
+    def test_point_operations_and_wrong_key(self):
+        self.assertEqual(storage.get_record(self.key, "site7.com", self.path), self.data["site7.com"])
+        self.assertIsNone(storage.get_record(self.key, "missing", self.path))
+        storage.put_records(self.key, {"site7.com": {"username": "u", "password": "new"}, "site8.com": None}, self.path)
+        self.assertEqual(storage.detect_format(self.path), storage.FORMAT_STREAM)
+        self.assertEqual(storage.get_record(self.key, "site7.com", self.path)["password"], "new")
+        self.assertEqual(len(storage.list_sites(self.key, self.path)), 49)
+        self.assertTrue(storage.check_key(self.key, self.path))
+        self.assertFalse(storage.check_key(Fernet.generate_key(), self.path))
+
+    def test_migrate_and_rekey_stream_file_to_file(self):
+        self.assertEqual(storage.migrate_vault(self.key, self.path, storage.FORMAT_V2), storage.FORMAT_STREAM)
+        self.assertEqual(storage.migrate_vault(self.key, self.path, storage.FORMAT_STREAM), storage.FORMAT_V2)
+        new_key = Fernet.generate_key()
+        storage.rekey_vault(self.key, new_key, self.path)
+        self.assertEqual(storage.detect_format(self.path), storage.FORMAT_STREAM)
+        self.assertEqual(storage.load_vault(new_key, self.path), self.data)
+        self.assertFalse(storage.check_key(self.key, self.path))
+
+    def test_writer_errors_surface(self):
+        class Full:
+            def write(self, chunk):
+                raise OSError("No space left on device")
+
+        with self.assertRaises(OSError):
+            storage._write_chunks(Full(), (b"x" * 10 for _ in range(100)))
+
+
+class TestRekeyOnUnlock(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "vault.json.enc")
+        self.salt_file = os.path.join(self.tmp.name, "salt.bin")
+        self.patch = patch.object(vault, "KDF_CONFIG_FILE", os.path.join(self.tmp.name, "kdf.json"))
+        self.patch.start()
+        self.data = {"github.com": {"username": "nick", "password": "pw1"}}
+        # A header from before envelope encryption: the derived key encrypts the vault
+        vault.load_or_create_kdf_header(self.salt_file)
+        self.key = storage.unlock("master", self.path, self.salt_file)
+        self.faster = {"kdf": vault.KDF_SCRYPT, "n": 2 ** 14, "r": 8, "p": 1}
+
+    def tearDown(self):
+        storage.clear_cache()
+        self.patch.stop()
+        self.tmp.cleanup()
+
+    def test_outdated_vault_is_rekeyed(self):
+        for fmt in storage.FORMATS:
+            with self.subTest(fmt=fmt):
+                storage.save_vault(self.data, self.key, self.path, fmt)
+                storage.reindex_vault(self.key, self.path, ["site", "username"])
+                vault.save_target_kdf(self.faster)
+
+                new_key = storage.unlock("master", self.path, self.salt_file)
+                self.assertNotEqual(new_key, self.key)
+                self.assertEqual(storage.detect_format(self.path), fmt)
+                self.assertEqual(storage.load_vault(new_key, self.path), self.data)
+                self.assertFalse(storage.check_key(self.key, self.path))
+                self.assertEqual(vault.read_kdf_header(self.salt_file)["kdf"], self.faster)
+                self.assertEqual(vault.previous_keys("master", self.salt_file)[0], self.key)
+                self.assertEqual(searchindex.load(new_key, searchindex.index_path(self.path)).fields,
+                                 ["site", "username"])
+                self.assertEqual(storage.search_records(new_key, "nick", self.path), self.data)
+                self.assertEqual(storage.unlock("master", self.path, self.salt_file), new_key)
+
+                vault.save_target_kdf(vault.DEFAULT_KDF)
+                self.key = storage.unlock("master", self.path, self.salt_file)
+
+    def test_wrong_password_never_rekeys(self):
+        storage.save_vault(self.data, self.key, self.path)
+        vault.save_target_kdf(self.faster)
+        storage.unlock("wrong", self.path, self.salt_file)
+        self.assertTrue(vault.kdf_outdated(self.salt_file))
+        self.assertTrue(storage.check_key(self.key, self.path))
+
+    def test_interrupted_rekey_is_finished_or_dropped(self):
+        storage.save_vault(self.data, self.key, self.path)
+        vault.save_target_kdf(self.faster)
+        header = vault.read_kdf_header(self.salt_file)
+        pending = {"salt": "ab" * 16, "kdf": self.faster}
+
+        # Cut short before the vault was rewritten: the pending parameters are dropped, then applied afresh
+        vault.write_kdf_header({**header, "pending": pending}, self.salt_file)
+        key = storage.unlock("master", self.path, self.salt_file)
+        self.assertEqual(storage.load_vault(key, self.path), self.data)
+        self.assertNotIn("pending", vault.read_kdf_header(self.salt_file))
+
+        # Cut short after the vault was rewritten: the header is brought up to date
+        header = vault.read_kdf_header(self.salt_file)
+        vault.save_target_kdf(vault.DEFAULT_KDF)
+        target = vault.derive_key("master", b"\xab" * 16, vault.DEFAULT_KDF)
+        storage.rekey_vault(key, target, self.path)
+        vault.write_kdf_header({**header, "pending": {"salt": "ab" * 16, "kdf": vault.DEFAULT_KDF}}, self.salt_file)
+        self.assertEqual(storage.unlock("master", self.path, self.salt_file), target)
+        self.assertEqual(vault.read_kdf_header(self.salt_file)["salt"], "ab" * 16)
+
+    def test_audit_chain_verifies_across_a_rekey(self):
+        log = os.path.join(self.tmp.name, "audit.log")
+        writer = audit.AuditWriter(log, flush_interval=0.01)
+        writer.chain_key = audit.chain_key(self.key)
+        storage.save_vault(self.data, self.key, self.path)
+        writer.write(audit.make_event("ADD", "github.com"))
+        writer.flush()
+
+        vault.save_target_kdf(self.faster)
+        new_key = storage.unlock("master", self.path, self.salt_file)
+        writer.chain_key = audit.chain_key(new_key)
+        writer.write(audit.make_event("GET", "github.com"))
+        writer.close()
+
+        self.assertFalse(audit.verify_chain(new_key, log, full=True)["ok"])
+        previous = vault.previous_keys("master", self.salt_file)
+        report = audit.verify_chain(new_key, log, full=True, previous_keys=previous)
+        self.assertTrue(report["ok"], report)
+        self.assertEqual(report["checked"], 2)
+
+
+class TestEnvelopeKeys(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "vault.json.enc")
+        self.salt_file = os.path.join(self.tmp.name, "salt.bin")
+        self.patch = patch.object(vault, "KDF_CONFIG_FILE", os.path.join(self.tmp.name, "kdf.json"))
+        self.patch.start()
+        self.data = {f"site{i}.com": {"username": f"user{i}", "password": f"pw{i}"} for i in range(25)}
+        self.key = storage.unlock("master", self.path, self.salt_file)
+        storage.save_vault(self.data, self.key, self.path)
+
+    def tearDown(self):
+        storage.clear_cache()
+        self.patch.stop()
+        self.tmp.cleanup()
+
+    def unlock(self, password):
+        return storage.unlock(password, self.path, self.salt_file)
+
+    def test_new_vaults_use_a_random_data_key(self):
+        header = vault.read_kdf_header(self.salt_file)
+        self.assertIn("dek", header)
+        self.assertNotEqual(self.key, vault.master_key("master", header))
+        self.assertEqual(self.unlock("master"), self.key)
+        self.assertEqual(vault.generate_key("master", self.salt_file), self.key)
+        with self.assertRaises(ValueError):
+            self.unlock("wrong")
+
+    def test_password_change_only_rewraps_the_key(self):
+        version = storage.vault_version(self.path)
+        storage.change_master_password("master", "new master", self.path, self.salt_file)
+        self.assertEqual(storage.vault_version(self.path), version)
+        self.assertEqual(self.unlock("new master"), self.key)
+        with self.assertRaises(ValueError):
+            self.unlock("master")
+        with self.assertRaises(ValueError):
+            storage.change_master_password("master", "other", self.path, self.salt_file)
+        self.assertNotIn("derived", vault.read_kdf_header(self.salt_file))
+
+    def test_outdated_kdf_only_rewraps_the_key(self):
+        version = storage.vault_version(self.path)
+        faster = {"kdf": vault.KDF_SCRYPT, "n": 2 ** 14, "r": 8, "p": 1}
+        vault.save_target_kdf(faster)
+        self.assertEqual(self.unlock("master"), self.key)
+        self.assertEqual(vault.read_kdf_header(self.salt_file)["kdf"], faster)
+        self.assertEqual(storage.vault_version(self.path), version)
+
+    def test_older_vaults_adopt_their_derived_key(self):
+        os.remove(self.salt_file)
+        vault.load_or_create_kdf_header(self.salt_file)
+        legacy_key = self.unlock("master")
+        storage.save_vault(self.data, legacy_key, self.path)
+
+        with self.assertRaises(ValueError):
+            storage.change_master_password("wrong", "new master", self.path, self.salt_file)
+        storage.change_master_password("master", "new master", self.path, self.salt_file)
+        self.assertEqual(self.unlock("new master"), legacy_key)
+        self.assertTrue(vault.read_kdf_header(self.salt_file)["derived"])
+
+        key, count = storage.rotate_data_key("new master", self.path, self.salt_file)
+        self.assertEqual(count, 25)
+        self.assertNotIn("derived", vault.read_kdf_header(self.salt_file))
+        self.assertEqual(vault.previous_keys("new master", self.salt_file), [legacy_key])
+
+    def test_rotation_re_encrypts_every_format(self):
+        for fmt in storage.FORMATS:
+            with self.subTest(fmt=fmt):
+                storage.migrate_vault(self.key, self.path, fmt)
+                storage.reindex_vault(self.key, self.path, ["site", "username"])
+                key, count = storage.rotate_data_key("master", self.path, self.salt_file, batch_size=10)
+                self.assertEqual(count, 25)
+                self.assertNotEqual(key, self.key)
+                self.assertEqual(storage.detect_format(self.path), fmt)
+                self.assertEqual(storage.load_vault(key, self.path), self.data)
+                self.assertFalse(storage.check_key(self.key, self.path))
+                self.assertEqual(storage.search_records(key, "user7", self.path), {"site7.com": self.data["site7.com"]})
+                self.assertFalse(os.path.exists(self.path + storage.ROTATE_SUFFIX))
+                self.assertEqual(self.unlock("master"), key)
+                self.assertEqual(vault.previous_keys("master", self.salt_file)[0], self.key)
+                self.key = key
+
+    def test_interrupted_rotation_resumes(self):
+        copied = []
+        append = storage._append_log
+
+        def crash_after_one_batch(path, key, entries):
+            if copied:
+                raise KeyboardInterrupt
+            append(path, key, entries)
+            copied.extend(entries)
+
+        with patch.object(storage, "_append_log", crash_after_one_batch):
+            with self.assertRaises(KeyboardInterrupt):
+                storage.rotate_data_key("master", self.path, self.salt_file, batch_size=10)
+        self.assertEqual(self.unlock("master"), self.key)  # the vault is untouched meanwhile
+
+        progress = []
+        key, count = storage.rotate_data_key("master", self.path, self.salt_file, batch_size=10,
+                                             progress=progress.append)
+        self.assertEqual(progress, [20])  # the first batch was not copied again
+        self.assertEqual(count, 25)
+        self.assertEqual(storage.load_vault(key, self.path), self.data)
+
+    def test_rotation_cut_short_after_the_vault_was_replaced(self):
+        writes = []
+
+        def crash_on_promotion(header, salt_file):
+            if writes:
+                raise KeyboardInterrupt
+            vault.write_kdf_header(header, salt_file)
+            writes.append(header)
+
+        with patch.object(storage, "write_kdf_header", crash_on_promotion):
+            with self.assertRaises(KeyboardInterrupt):
+                storage.rotate_data_key("master", self.path, self.salt_file)
+        self.assertFalse(storage.check_key(self.key, self.path))
+        # The header still names the old key in use; unlocking finishes the rotation
+        new_key = self.unlock("master")
+        self.assertNotEqual(new_key, self.key)
+        self.assertEqual(storage.load_vault(new_key, self.path), self.data)
+        self.assertNotIn("rotating", vault.read_kdf_header(self.salt_file))
+
+
+if __name__ == '__main__':
+    unittest.main()
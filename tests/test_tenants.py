@@ -0,0 +1,184 @@
+import os
+import tempfile
+import threading
+import unittest
+from unittest.mock import patch
+
+import pyotp
+
+import audit
+import flask_app
+import storage
+import tenants
+import vault
+from tenants import Tenant
+
+
+class TestTenantLayout(unittest.TestCase):
+
+    def test_user_ids_are_normalized_and_validated(self):
+        self.assertEqual(tenants.normalize_user_id("  Alice@Example.com "), "alice@example.com")
+        for bad in ["", "   ", "../etc", "a/b", "x" * 200]:
+            with self.assertRaises(ValueError):
+                tenants.normalize_user_id(bad)
+
+    def test_directories_are_sharded_by_hash(self):
+        path = tenants.shard_path("Alice", root="root")
+        first, second, digest = path.split(os.sep)[1:]
+        self.assertEqual(len(digest), 64)
+        self.assertEqual((first, second), (digest[:2], digest[2:4]))
+        self.assertNotIn("alice", path)
+        self.assertEqual(path, tenants.shard_path("alice", root="root"))
+        self.assertNotEqual(path, tenants.shard_path("bob", root="root"))
+
+    def test_every_file_lives_in_the_users_directory(self):
+        tenant = Tenant.for_user("alice", root="root")
+        for path in [tenant.vault_file, tenant.salt_file, tenant.master_hash_file,
+                     tenant.totp_secret_file, tenant.audit_log, tenant.last_access_file]:
+            self.assertEqual(os.path.dirname(path), tenant.directory)
+
+
+class TestTenantIsolation(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.patch = patch.object(tenants, "TENANTS_DIR", self.tmp.name)
+        self.patch.start()
+        self.signup = patch.object(flask_app, "ALLOW_SIGNUP", True)
+        self.signup.start()
+
+    def tearDown(self):
+        self.signup.stop()
+        self.patch.stop()
+        self.tmp.cleanup()
+
+    def login(self, username, master):
+        client = flask_app.app.test_client()
+        resp = client.post("/", data={"username": username, "master": master})
+        if resp.status_code != 200:
+            return client, resp.status_code
+        code = pyotp.TOTP(Tenant.for_user(username).totp_secret()).now()
+        resp = client.post("/verify-2fa", data={"code": code})
+        return client, resp.status_code
+
+    def sites(self, client):
+        return [c["site"] for c in client.get("/api/credentials").get_json()["credentials"]]
+
+    def test_users_only_see_their_own_vault(self):
+        alice, status = self.login("alice", "alice-pw")
+        self.assertEqual(status, 200)
+        bob, status = self.login("bob", "bob-pw")
+        self.assertEqual(status, 200)
+
+        alice.post("/add-credential", json={"site": "a.com", "username": "a", "password": "1"})
+        bob.post("/add-credential", json={"site": "b.com", "username": "b", "password": "2"})
+        self.assertEqual(self.sites(alice), ["a.com"])
+        self.assertEqual(self.sites(bob), ["b.com"])
+        self.assertEqual(bob.get("/api/credentials/a.com").status_code, 404)
+
+        alice_tenant, bob_tenant = Tenant.for_user("alice"), Tenant.for_user("bob")
+        self.assertNotEqual(alice_tenant.totp_secret(), bob_tenant.totp_secret())
+        events = alice.get("/api/audit").get_json()["events"]
+        self.assertEqual([(e["action"], e.get("site")) for e in events], [("ADD", "a.com")])
+        report = audit.verify_chain(vault.generate_key("alice-pw", alice_tenant.salt_file), alice_tenant.audit_log)
+        self.assertTrue(report["ok"])
+        self.assertEqual(report["pending"], 0)
+
+        bob.post("/reset-vault")
+        self.assertEqual(self.sites(alice), ["a.com"])
+        self.assertFalse(os.path.exists(bob_tenant.vault_file))
+
+    def test_wrong_password_and_bad_username(self):
+        self.login("alice", "alice-pw")
+        _, status = self.login("ALICE", "wrong")
+        self.assertEqual(status, 401)
+        _, status = self.login("ALICE", "alice-pw")
+        self.assertEqual(status, 200)
+        client = flask_app.app.test_client()
+        self.assertEqual(client.post("/", data={"username": "../x", "master": "pw"}).status_code, 400)
+
+    def test_change_master_password(self):
+        client, _ = self.login("alice", "alice-pw")
+        client.post("/add-credential", json={"site": "a.com", "username": "a", "password": "1"})
+        tenant = Tenant.for_user("alice")
+        version = storage.vault_version(tenant.vault_file)
+
+        self.assertEqual(client.post("/change-master", json={"current": "alice-pw"}).status_code, 400)
+        resp = client.post("/change-master", json={"current": "wrong", "new": "new-pw"})
+        self.assertEqual(resp.status_code, 401)
+        resp = client.post("/change-master", json={"current": "alice-pw", "new": "new-pw"})
+        self.assertEqual(resp.status_code, 200, resp.get_json())
+        self.assertEqual(storage.vault_version(tenant.vault_file), version)  # only the key was rewrapped
+        self.assertEqual(self.sites(client), ["a.com"])
+
+        _, status = self.login("alice", "alice-pw")
+        self.assertEqual(status, 401)
+        other, status = self.login("alice", "new-pw")
+        self.assertEqual(status, 200)
+        self.assertEqual(self.sites(other), ["a.com"])
+
+    def test_single_user_logout_keeps_other_users_cached(self):
+        alice, _ = self.login("alice", "alice-pw")
+        alice.post("/add-credential", json={"site": "a.com", "username": "a", "password": "1"})
+        self.sites(alice)
+        cached = flask_app.vault_cache.stats()["size"]
+        self.assertGreater(cached, 0)
+        with flask_app.app.test_request_context():
+            flask_app.forget_tenant(Tenant.legacy(vault_file=flask_app.VAULT_FILE))
+        self.assertEqual(flask_app.vault_cache.stats()["size"], cached)
+
+    def test_qr_code_only_while_enrolling_or_after_2fa(self):
+        client = flask_app.app.test_client()
+        self.assertEqual(client.post("/", data={"username": "alice", "master": "pw"}).status_code, 200)
+        self.assertEqual(client.get("/qrcode").status_code, 200)
+
+        # Knowing the password is not enough to see the secret again
+        client = flask_app.app.test_client()
+        self.assertEqual(client.post("/", data={"username": "alice", "master": "pw"}).status_code, 200)
+        self.assertEqual(client.get("/qrcode").status_code, 401)
+        code = pyotp.TOTP(Tenant.for_user("alice").totp_secret()).now()
+        client.post("/verify-2fa", data={"code": code})
+        self.assertEqual(client.get("/qrcode").status_code, 200)
+
+    def test_failed_hashing_leaves_no_account(self):
+        tenant = Tenant.for_user("alice")
+        with patch.object(tenants.bcrypt, "hashpw", side_effect=RuntimeError("out of memory")):
+            with self.assertRaises(RuntimeError):
+                tenant.create("pw")
+        self.assertFalse(tenant.exists())
+        tenant.create("pw")
+        self.assertTrue(tenant.verify_master_password("pw"))
+        with self.assertRaises(FileExistsError):
+            tenant.create("other")
+        self.assertTrue(tenant.verify_master_password("pw"))
+        self.assertEqual(os.listdir(tenant.directory), ["master.hash"])
+
+    def test_signup_can_be_disabled(self):
+        with patch.object(flask_app, "ALLOW_SIGNUP", False):
+            _, status = self.login("carol", "pw")
+        self.assertEqual(status, 401)
+        self.assertFalse(Tenant.for_user("carol").exists())
+
+
+class TestPerUserLocking(unittest.TestCase):
+
+    def test_one_users_write_lock_does_not_block_another(self):
+        with tempfile.TemporaryDirectory() as root:
+            alice, bob = (Tenant.for_user(name, root=root) for name in ("alice", "bob"))
+            for tenant in (alice, bob):
+                os.makedirs(tenant.directory)
+            key = b"0" * 43 + b"="
+
+            done = threading.Event()
+            with storage.vault_lock(alice.vault_file, exclusive=True):
+                worker = threading.Thread(target=lambda: (
+                    storage.put_record(key, "b.com", {"username": "b", "password": "2"}, bob.vault_file),
+                    done.set()))
+                worker.start()
+                self.assertTrue(done.wait(5))
+            worker.join()
+            self.assertEqual(storage.list_sites(key, bob.vault_file), ["b.com"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,5 +1,9 @@
 import unittest
 import os
+import tempfile
+from unittest.mock import patch
+import audit
+import vault
 from vault import (
     generate_key,
     encrypt_data,
@@ -60,8 +64,15 @@ class TestVault(unittest.TestCase):
         if os.path.exists(self.log_file):
             with open(self.log_file, "w") as f:
                 f.truncate(0)
+        if os.path.exists(audit.pending_path(self.log_file)):
+            os.remove(audit.pending_path(self.log_file))
+        # Whether an earlier test keyed the default writer must not matter
+        self.chain_key = audit.writer_for().chain_key
+        audit.writer_for().chain_key = None
 
     def tearDown(self):
+        audit.flush()
+        audit.writer_for().chain_key = self.chain_key
         if os.path.exists(self.test_file):
             os.remove(self.test_file)
 
@@ -79,10 +90,10 @@ class TestVault(unittest.TestCase):
     def test_log_action_creates_entry(self):
         action = "TEST ACTION"
         log_action(action)
-        self.assertTrue(os.path.exists(self.log_file))
-        with open(self.log_file, "r") as f:
-            lines = f.readlines()
-            self.assertTrue(any(action in line for line in lines))
+        audit.flush()
+        # Without the vault key the entry waits, unchained, in the pending file
+        self.assertTrue(os.path.exists(audit.pending_path(self.log_file)))
+        self.assertIn(action, [event["action"] for _, event in audit.iter_events(self.log_file)])
 
     def test_read_audit_log_returns_string(self):
         log_action("TEST READ LOG")
@@ -100,6 +111,51 @@ class TestVault(unittest.TestCase):
         key2 = generate_key("differentpass")
         self.assertNotEqual(key1, key2)
 
+class TestKdfHeader(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.salt_file = os.path.join(self.tmp.name, "salt.bin")
+        self.patch = patch.object(vault, "KDF_CONFIG_FILE", os.path.join(self.tmp.name, "kdf.json"))
+        self.patch.start()
+
+    def tearDown(self):
+        self.patch.stop()
+        self.tmp.cleanup()
+
+    def test_bare_salt_is_legacy_pbkdf2(self):
+        with open(self.salt_file, "wb") as f:
+            f.write(b"s" * 16)
+        header = vault.read_kdf_header(self.salt_file)
+        self.assertEqual(header["kdf"], {"kdf": vault.KDF_PBKDF2, "iterations": vault.ITERATIONS})
+        self.assertEqual(generate_key("pw", self.salt_file),
+                         vault.derive_key("pw", b"s" * 16, vault.DEFAULT_KDF))
+        self.assertFalse(vault.kdf_outdated(self.salt_file))
+
+    def test_new_vaults_use_the_configured_kdf(self):
+        params = {"kdf": vault.KDF_SCRYPT, "n": 2 ** 14, "r": 8, "p": 1}
+        vault.save_target_kdf(params)
+        key = generate_key("pw", self.salt_file)
+        header = vault.read_kdf_header(self.salt_file)
+        self.assertEqual(header["kdf"], params)
+        self.assertEqual(key, vault.derive_key("pw", bytes.fromhex(header["salt"]), params))
+        self.assertNotEqual(key, vault.derive_key("pw", bytes.fromhex(header["salt"]), vault.DEFAULT_KDF))
+
+        vault.save_target_kdf(vault.DEFAULT_KDF)
+        self.assertTrue(vault.kdf_outdated(self.salt_file))
+
+    def test_calibration_respects_the_floor(self):
+        params, measured = vault.calibrate_kdf(1, vault.KDF_PBKDF2)
+        self.assertEqual(params["iterations"], vault.MIN_PBKDF2_ITERATIONS)
+        params, _ = vault.calibrate_kdf(1, vault.KDF_SCRYPT)
+        self.assertEqual(params["n"], vault.MIN_SCRYPT_N)
+        params, measured = vault.calibrate_kdf(400, vault.KDF_PBKDF2)
+        self.assertGreaterEqual(params["iterations"], vault.MIN_PBKDF2_ITERATIONS)
+        self.assertEqual(params["iterations"] % 1000, 0)
+        self.assertGreater(measured, 0)
+        with self.assertRaises(ValueError):
+            vault.calibrate_kdf(100, "md5")
+
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
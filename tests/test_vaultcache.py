@@ -0,0 +1,74 @@
+import os
+import tempfile
+import unittest
+
+from cryptography.fernet import Fernet
+
+import storage
+from vaultcache import VaultCache, estimate_size
+
+
+class TestVaultCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "vault.json.enc")
+        self.key = Fernet.generate_key()
+        storage.save_vault({"github.com": {"username": "octo", "password": "pw"}}, self.key, self.path)
+        self.cache = VaultCache()
+        self.loads = 0
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def load(self, key=None):
+        key = key or self.key
+
+        def _load():
+            self.loads += 1
+            return storage.load_vault(key, self.path)
+        return self.cache.get_or_load(key, self.path, _load)
+
+    def test_decrypts_once_while_file_unchanged(self):
+        for _ in range(5):
+            self.assertIn("github.com", self.load())
+        self.assertEqual(self.loads, 1)
+        self.assertEqual(self.cache.stats()["hits"], 4)
+
+    def test_external_write_is_picked_up(self):
+        self.load()
+        storage.put_record(self.key, "gitlab.com", {"username": "u", "password": "p"}, self.path)
+        self.assertIn("gitlab.com", self.load())
+        self.assertEqual(self.loads, 2)
+
+    def test_entries_are_per_key(self):
+        self.load()
+        with self.assertRaises(Exception):
+            self.load(Fernet.generate_key())
+        self.assertEqual(self.loads, 2)
+
+    def test_invalidate_forces_reload(self):
+        self.load()
+        self.cache.invalidate(self.path)
+        self.load()
+        self.assertEqual(self.loads, 2)
+
+    def test_clear_drops_entries_without_touching_handed_out_data(self):
+        data = self.load()
+        self.cache.clear()
+        self.assertIn("github.com", data)  # another request may still be reading it
+        self.assertEqual(self.cache.stats()["size"], 0)
+        self.load()
+        self.assertEqual(self.loads, 2)
+
+    def test_memory_cap(self):
+        data = storage.load_vault(self.key, self.path)
+        self.cache.max_bytes = estimate_size(data) - 1
+        self.load()
+        self.load()
+        self.assertEqual(self.loads, 2)
+        self.assertEqual(self.cache.stats()["bytes"], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -4,23 +4,25 @@ import pyotp
 # File to persist the secret; in CI/tests you can override via TOTP_SECRET_FILE
 SECRET_FILE = os.environ.get("TOTP_SECRET_FILE", "totp_secret.txt")
 
-def get_or_create_totp_secret() -> str:
-    # 1) env‐override
+def get_or_create_totp_secret(secret_file: str = None) -> str:
+    # 1) env‐override (only for the single-user secret file)
     env = os.environ.get("TOTP_SECRET")
-    if env:
+    if env and secret_file is None:
         # make sure the file exists for file-based tests
         if not os.path.exists(SECRET_FILE):
             with open(SECRET_FILE, "w") as f:
                 f.write(env)
         return env
+    secret_file = secret_file or SECRET_FILE
 
     # 2) existing on disk?
-    if os.path.exists(SECRET_FILE):
-        return open(SECRET_FILE, "r").read().strip()
+    if os.path.exists(secret_file):
+        return open(secret_file, "r").read().strip()
 
     # 3) generate & persist
     secret = pyotp.random_base32()
-    with open(SECRET_FILE, "w") as f:
+    fd = os.open(secret_file, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, "w") as f:
         f.write(secret)
     return secret
 
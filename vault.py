@@ -1,20 +1,58 @@
-from datetime import datetime
 import os
 import base64
+import hmac
 import json
 import string
 import time
-from cryptography.fernet import Fernet, InvalidToken
-from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
-from cryptography.hazmat.primitives import hashes
-from cryptography.hazmat.backends import default_backend
+
+import metrics
+
+# `cryptography` is imported by the functions that use it, not here: every
+# CLI invocation imports this module, and most never derive or decrypt
+# anything before exiting (--help, generate, kdf status...).
+
+# Audit logging lives in audit.py; re-exported for existing callers, and only
+# imported when one of them asks for it
+_AUDIT_EXPORTS = ("AUDIT_LOG_FILE", "log_action", "read_audit_log")
+
+def __getattr__(name):
+    if name in _AUDIT_EXPORTS:
+        import audit
+        return getattr(audit, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 # Constants
 LOCK_TIMEOUT = 300  # 5 minutes
 LOCK_FILE = ".last_access"
 SALT_FILE = "salt.bin"
 ITERATIONS = 100_000
-AUDIT_LOG_FILE = "vault_audit.log"
+
+# The salt file is the vault's KDF header: "CVKD" followed by JSON naming the
+# salt, the KDF and its parameters, and the ones the vault used before it was
+# last re-keyed. A bare 16-byte salt (older vaults) means PBKDF2 at ITERATIONS.
+# New vaults, and vaults unlocked with outdated parameters, use the parameters
+# in KDF_CONFIG_FILE, written by `kdf calibrate` for this host.
+MAGIC_KDF = b"CVKD"
+KDF_PBKDF2 = "pbkdf2-sha256"
+KDF_SCRYPT = "scrypt"
+KDFS = [KDF_PBKDF2, KDF_SCRYPT]
+KDF_CONFIG_FILE = os.environ.get("VAULT_KDF_CONFIG", "kdf.json")
+DEFAULT_KDF = {"kdf": KDF_PBKDF2, "iterations": ITERATIONS}
+
+# Vaults created since envelope encryption are encrypted with a random data
+# key, stored in the header wrapped (Fernet-encrypted) by the key the master
+# password derives. Changing the password or the KDF only rewraps it. In older
+# vaults the derived key encrypts the vault itself; `passwd` adopts it as the
+# data key and marks the header "derived" until `rotate-dek` replaces it.
+
+# Calibration never goes below these, however slow the host
+MIN_PBKDF2_ITERATIONS = 100_000
+MIN_SCRYPT_N = 2 ** 14
+MAX_SCRYPT_N = 2 ** 20  # 1 GiB of memory at r=8
+
+# A Fernet token's first byte is its version, 0x80. Base64 tokens start with
+# "g" instead, so the two forms can't be confused.
+RAW_TOKEN_VERSION = b"\x80"
 
 # ---------------------
 # Key Derivation
@@ -23,47 +61,226 @@ AUDIT_LOG_FILE = "vault_audit.log"
 def generate_salt():
     return os.urandom(16)
 
-def load_or_create_salt():
-    if os.path.exists(SALT_FILE):
-        with open(SALT_FILE, "rb") as f:
-            return f.read()
+def target_kdf() -> dict:
+    """The KDF parameters this host wants vaults to use."""
+    if os.path.exists(KDF_CONFIG_FILE):
+        with open(KDF_CONFIG_FILE, "r") as f:
+            return json.load(f)
+    return dict(DEFAULT_KDF)
+
+def save_target_kdf(params: dict):
+    with open(KDF_CONFIG_FILE, "w") as f:
+        json.dump(params, f, indent=2)
+
+def read_kdf_header(salt_file: str = SALT_FILE):
+    """
+    Returns the vault's {"salt", "kdf", "history"[, "dek", "derived", "rotating", "pending"]}
+    header, or None if there is none.
+    """
+    if not os.path.exists(salt_file):
+        return None
+    with open(salt_file, "rb") as f:
+        raw = f.read()
+    if not raw.startswith(MAGIC_KDF):
+        return {"salt": raw.hex(), "kdf": dict(DEFAULT_KDF), "history": []}
+    return json.loads(raw[len(MAGIC_KDF):])
+
+def write_kdf_header(header: dict, salt_file: str = SALT_FILE):
+    tmp = salt_file + ".tmp"
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "wb") as f:
+        f.write(MAGIC_KDF + json.dumps(header).encode())
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, salt_file)
+
+def new_kdf_header() -> dict:
+    return {"salt": generate_salt().hex(), "kdf": target_kdf(), "history": []}
+
+def load_or_create_kdf_header(salt_file: str = SALT_FILE) -> dict:
+    header = read_kdf_header(salt_file)
+    if header is None:
+        header = new_kdf_header()
+        write_kdf_header(header, salt_file)
+    return header
+
+def new_envelope_header(master_password: str):
+    """A header for a new vault and its random data key, wrapped by `master_password`: (header, data key)."""
+    from cryptography.fernet import Fernet
+
+    header = new_kdf_header()
+    data_key = Fernet.generate_key()
+    header["dek"] = wrap_key(data_key, derive_key(master_password, bytes.fromhex(header["salt"]), header["kdf"]))
+    return header, data_key
+
+def load_or_create_salt(salt_file: str = SALT_FILE):
+    return bytes.fromhex(load_or_create_kdf_header(salt_file)["salt"])
+
+def derive_key(master_password: str, salt: bytes, params: dict) -> bytes:
+    """Derives a Fernet key from the master password with the given salt and KDF parameters."""
+    from cryptography.hazmat.backends import default_backend
+    from cryptography.hazmat.primitives import hashes
+    from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+    from cryptography.hazmat.primitives.kdf.scrypt import Scrypt
+
+    if params["kdf"] == KDF_PBKDF2:
+        kdf = PBKDF2HMAC(
+            algorithm=hashes.SHA256(),
+            length=32,
+            salt=salt,
+            iterations=params["iterations"],
+            backend=default_backend()
+        )
+    elif params["kdf"] == KDF_SCRYPT:
+        kdf = Scrypt(salt=salt, length=32, n=params["n"], r=params["r"], p=params["p"], backend=default_backend())
+    else:
+        raise ValueError(f"Unknown KDF: {params['kdf']}")
+    metrics.inc("vault_kdf_total", kdf=params["kdf"])
+    with metrics.span("kdf"):
+        return base64.urlsafe_b64encode(kdf.derive(master_password.encode()))
+
+def master_key(master_password: str, header: dict) -> bytes:
+    """The key the master password derives with the header's salt and KDF."""
+    return derive_key(master_password, bytes.fromhex(header["salt"]), header["kdf"])
+
+def wrap_key(data_key: bytes, wrapping_key: bytes) -> str:
+    from cryptography.fernet import Fernet
+
+    return Fernet(wrapping_key).encrypt(data_key).decode()
+
+def unwrap_key(wrapped: str, wrapping_key: bytes) -> bytes:
+    from cryptography.fernet import Fernet, InvalidToken
+
+    try:
+        return Fernet(wrapping_key).decrypt(wrapped.encode())
+    except InvalidToken:
+        raise ValueError("Incorrect master password.")
+
+def generate_key(master_password: str, salt_file: str = SALT_FILE) -> bytes:
+    """
+    Returns the vault key for the master password: the data key it unwraps, or
+    for vaults without one, the key it derives with the salt and KDF in the header.
+    Raises ValueError if the password can't unwrap the data key.
+    """
+    header = load_or_create_kdf_header(salt_file)
+    key = master_key(master_password, header)
+    return unwrap_key(header["dek"], key) if "dek" in header else key
+
+def previous_keys(master_password: str, salt_file: str = SALT_FILE) -> list:
+    """The keys the vault had before each re-key, newest first (e.g. to verify old audit entries)."""
+    header = read_kdf_header(salt_file) or {"history": []}
+    if any("dek" in old for old in header["history"]):
+        wrapping_key = master_key(master_password, header)
+    return [unwrap_key(old["dek"], wrapping_key) if "dek" in old else master_key(master_password, old)
+            for old in reversed(header["history"])]
+
+def kdf_outdated(salt_file: str = SALT_FILE) -> bool:
+    header = read_kdf_header(salt_file)
+    return header is not None and header["kdf"] != target_kdf()
+
+def _time_kdf(params: dict) -> float:
+    start = time.perf_counter()
+    derive_key("calibration", b"\0" * 16, params)
+    return (time.perf_counter() - start) * 1000
+
+def calibrate_kdf(target_ms: float, kdf: str = KDF_PBKDF2):
+    """
+    Picks the costliest parameters for `kdf` that derive a key on this host
+    within `target_ms`. Returns (params, measured milliseconds).
+    """
+    if kdf == KDF_PBKDF2:
+        probe = {"kdf": KDF_PBKDF2, "iterations": 50_000}
+        per_iteration = min(_time_kdf(probe) for _ in range(3)) / probe["iterations"]
+        iterations = int(target_ms / per_iteration) // 1000 * 1000
+        params = {"kdf": KDF_PBKDF2, "iterations": max(MIN_PBKDF2_ITERATIONS, iterations)}
+    elif kdf == KDF_SCRYPT:
+        # scrypt's cost is linear in n, which must be a power of two
+        params = {"kdf": KDF_SCRYPT, "n": MIN_SCRYPT_N, "r": 8, "p": 1}
+        elapsed = _time_kdf(params)
+        while params["n"] < MAX_SCRYPT_N and elapsed * 2 <= target_ms:
+            params["n"] *= 2
+            elapsed = _time_kdf(params)
+        return params, elapsed
     else:
-        salt = generate_salt()
-        with open(SALT_FILE, "wb") as f:
-            f.write(salt)
-        return salt
+        raise ValueError(f"Unknown KDF: {kdf}")
+    return params, _time_kdf(params)
 
-def generate_key(master_password: str) -> bytes:
+def derive_subkey(key: bytes, purpose: str, salt: bytes = None) -> bytes:
     """
-    Derives a strong encryption key from the master password using PBKDF2-HMAC-SHA256 and salt.
+    Derives an independent 32-byte key for `purpose` (e.g. "lookup") from a vault key,
+    so keyed hashes stored next to the vault never reuse the encryption key itself.
+    A random `salt` gives a fresh key per use (e.g. per file) under the same vault key.
     """
-    salt = load_or_create_salt()
-    kdf = PBKDF2HMAC(
+    from cryptography.hazmat.backends import default_backend
+    from cryptography.hazmat.primitives import hashes
+    from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+
+    hkdf = HKDF(
         algorithm=hashes.SHA256(),
         length=32,
         salt=salt,
-        iterations=ITERATIONS,
+        info=purpose.encode(),
         backend=default_backend()
     )
-    return base64.urlsafe_b64encode(kdf.derive(master_password.encode()))
+    return hkdf.derive(base64.urlsafe_b64decode(key))
 
 # ---------------------
 # Encryption Functions
 # ---------------------
 
-def encrypt_data(data: dict, key: bytes) -> bytes:
+def encrypt_data(data: dict, key: bytes, encoding: str = "json") -> bytes:
+    """
+    Encrypts `data` serialized in `encoding` (see recordcodec). JSON tokens are
+    the usual base64 Fernet tokens; the binary encodings return the token's raw
+    bytes instead, a quarter smaller on disk. decrypt_data reads all of them.
+    """
+    import recordcodec
+    from cryptography.fernet import Fernet
+
     f = Fernet(key)
-    return f.encrypt(json.dumps(data).encode())
+    with metrics.span("json_encode" if encoding == recordcodec.ENCODING_JSON else "record_encode"):
+        plaintext = recordcodec.encode(data, encoding)
+    with metrics.span("encrypt"):
+        token = f.encrypt(plaintext)
+    if encoding != recordcodec.ENCODING_JSON:
+        token = base64.urlsafe_b64decode(token)
+    return token
 
 def decrypt_data(ciphertext: bytes, key: bytes) -> dict:
+    import recordcodec
+    from cryptography.fernet import Fernet, InvalidToken
+
     f = Fernet(key)
+    metrics.inc("vault_bytes_read_total", len(ciphertext))
+    if ciphertext[:1] == RAW_TOKEN_VERSION:
+        ciphertext = base64.urlsafe_b64encode(ciphertext)
     try:
-        return json.loads(f.decrypt(ciphertext).decode())
+        with metrics.span("decrypt"):
+            plaintext = f.decrypt(ciphertext)
     except InvalidToken:
         raise ValueError("Incorrect master password or corrupted vault.")
+    encoding = recordcodec.payload_encoding(plaintext)
+    with metrics.span("json_parse" if encoding == recordcodec.ENCODING_JSON else "record_parse"):
+        return recordcodec.decode(plaintext)
+
+def token_signed(ciphertext: bytes, key: bytes) -> bool:
+    """
+    True if `ciphertext` is a token `key` made (in either form): checks its
+    HMAC only, without decrypting or parsing the payload.
+    """
+    try:
+        if ciphertext[:1] != RAW_TOKEN_VERSION:
+            ciphertext = base64.urlsafe_b64decode(ciphertext)
+        signing_key = base64.urlsafe_b64decode(key)[:16]
+    except ValueError:
+        return False
+    # version, timestamp, IV, at least one AES block, then the HMAC-SHA256
+    if len(ciphertext) < 1 + 8 + 16 + 16 + 32 or ciphertext[:1] != RAW_TOKEN_VERSION:
+        return False
+    return hmac.compare_digest(hmac.digest(signing_key, ciphertext[:-32], "sha256"), ciphertext[-32:])
 
 # ---------------------
-# Password Strength Check
+# Password Strength & Generation
 # ---------------------
 
 def check_password_strength(password):
@@ -82,51 +299,23 @@ def check_password_strength(password):
     else:
         return '🔴 Weak'
 
+def generate_password(length: int = 16) -> str:
+    import secrets
+
+    chars = string.ascii_letters + string.digits + string.punctuation
+    return ''.join(secrets.choice(chars) for _ in range(length))
+
 # ---------------------
 # Vault Locking
 # ---------------------
 
-def update_last_access():
-    with open(LOCK_FILE, "w") as f:
+def update_last_access(lock_file: str = LOCK_FILE):
+    with open(lock_file, "w") as f:
         f.write(str(int(time.time())))
 
-def is_vault_locked():
-    if not os.path.exists(LOCK_FILE):
+def is_vault_locked(lock_file: str = LOCK_FILE):
+    if not os.path.exists(lock_file):
         return False
-    with open(LOCK_FILE, "r") as f:
+    with open(lock_file, "r") as f:
         last = int(f.read().strip())
     return (time.time() - last) > LOCK_TIMEOUT
-
-# ---------------------
-# Vault Audit
-# ---------------------
-
-def log_action(action: str, site: str = None, status: str = "SUCCESS", note: str = ""):
-    """
-    Logs actions performed on the vault with timestamps.
-
-    Args:
-        action (str): Action performed (e.g., ADD, GET, DELETE)
-        site (str): Site related to the action
-        status (str): Status of the action (e.g., SUCCESS, FAILURE)
-        note (str): Optional message for context
-    """
-    timestamp = datetime.now().strftime("[%Y-%m-%d %H:%M:%S]")
-    site_part = f" | SITE: {site}" if site else ""
-    note_part = f" ({note})" if note else ""
-    line = f"{timestamp} ACTION: {action}{site_part} | STATUS: {status}{note_part}\n"
-
-    try:
-        with open(AUDIT_LOG_FILE, "a", encoding="utf-8") as log:
-            log.write(line)
-    except Exception as e:
-        print(f"⚠️ Failed to write to audit log: {e}")
-
-def read_audit_log():
-    if not os.path.exists(AUDIT_LOG_FILE):
-        return "No audit log entries found."
-    try:
-        with open(AUDIT_LOG_FILE, "r", encoding="utf-8") as log_file:
-            return log_file.read()
-    except Exception as e:
-        return f"Failed to read audit log: {e}"
\ No newline at end of file
@@ -0,0 +1,83 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+from storage import estimate_size, vault_version
+
+
+class VaultCache:
+    """
+    Process-level cache of decrypted vaults, keyed by key fingerprint and vault path.
+
+    Each entry remembers the file version it was decrypted from, so a write by
+    this process or by anything else (the CLI, the agent) is noticed on the next
+    read and the vault is decrypted again. Entries are evicted least-recently-used
+    once their estimated size passes `max_bytes`; a vault larger than the cap is
+    simply never cached. Cached data is shared, so callers must not modify it.
+    """
+
+    def __init__(self, max_bytes: int = 32 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._size = 0
+        self._entries = OrderedDict()  # (fingerprint, path) -> (version, data, size)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _cache_key(key: bytes, path: str):
+        return hashlib.sha256(key).digest(), os.path.abspath(path)
+
+    def get_or_load(self, key: bytes, path: str, load) -> dict:
+        """
+        Returns the decrypted vault at `path`, calling `load()` only if it
+        changed on disk since it was last cached (or was never cached).
+        """
+        cache_key = self._cache_key(key, path)
+        # Stat before loading: if the file changes mid-load the entry is just refreshed next time
+        version = vault_version(path)
+        with self._lock:
+            entry = self._entries.get(cache_key)
+            if entry is not None and entry[0] == version:
+                self._entries.move_to_end(cache_key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        data = load()
+        size = estimate_size(data)
+        with self._lock:
+            self._drop(cache_key)
+            if size <= self.max_bytes:
+                self._entries[cache_key] = (version, data, size)
+                self._size += size
+                while self._size > self.max_bytes:
+                    self._drop(next(iter(self._entries)))
+        return data
+
+    def _drop(self, cache_key):
+        entry = self._entries.pop(cache_key, None)
+        if entry is not None:
+            self._size -= entry[2]
+
+    def invalidate(self, path: str):
+        """Forgets every cached copy of `path`, whatever key it was decrypted with."""
+        path = os.path.abspath(path)
+        with self._lock:
+            for cache_key in [k for k in self._entries if k[1] == path]:
+                self._drop(cache_key)
+
+    def clear(self):
+        """
+        Drops every decrypted vault. The dicts are left as they are: requests
+        still working on one keep a consistent copy until they finish.
+        """
+        with self._lock:
+            self._entries = OrderedDict()
+            self._size = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses,
+                    "size": len(self._entries), "bytes": self._size}